@@ -0,0 +1,144 @@
+"""Throughput of record inserts and of redirect lookups under concurrent
+readers.
+
+Run from the project root:
+
+    python -m benchmarks.bench_database
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from src.database import Database
+
+NUM_QRS = 1000
+LOOKUPS_PER_THREAD = 2000
+THREAD_COUNTS = (1, 4, 8)
+NUM_INSERTS = 5000
+
+
+class ReconnectingDatabase(Database):
+    """The previous behaviour, a fresh connection for every call"""
+
+    def _connection(self):
+        return sqlite3.connect(self.db_path)
+
+
+def _lookups_per_second(db, qr_uuids, threads, lookups=LOOKUPS_PER_THREAD):
+    def read():
+        for i in range(lookups):
+            db.get_redirect_url(qr_uuids[i % len(qr_uuids)])
+
+    workers = [threading.Thread(target=read) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * lookups / (time.perf_counter() - start)
+
+
+def bench_redirect_lookups(thread_counts=THREAD_COUNTS):
+    """Time get_redirect_url with a connection per call, a connection per
+    thread and the redirect cache in front."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        with Database(db_path) as db:
+            qr_uuids = [db.create_qr_record() for _ in range(NUM_QRS)]
+        variants = (
+            ("reconnect", ReconnectingDatabase, 0),
+            ("pooled", Database, 0),
+            ("pooled + cache", Database, NUM_QRS),
+        )
+        for name, cls, cache_size in variants:
+            db = cls(db_path, cache_size=cache_size)
+            for threads in thread_counts:
+                results[f"{name}, {threads} threads"] = _lookups_per_second(
+                    db, qr_uuids, threads
+                )
+            db.close()
+    return results
+
+
+def bench_inserts(count=NUM_INSERTS):
+    """Time create_qr_record per record against create_qr_records."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with Database(os.path.join(tmp_dir, "bench.db")) as db:
+            rows = [{"qr_uuid": str(uuid.uuid4())} for _ in range(count)]
+            start = time.perf_counter()
+            for row in rows:
+                db.create_qr_record(**row)
+            results["create_qr_record"] = count / (time.perf_counter() - start)
+
+            rows = [{"qr_uuid": str(uuid.uuid4())} for _ in range(count)]
+            start = time.perf_counter()
+            db.create_qr_records(rows)
+            results["create_qr_records"] = count / (time.perf_counter() - start)
+    return results
+
+
+def bench_unknown_lookups(lookups=LOOKUPS_PER_THREAD):
+    """Time lookups of UUIDs that do not exist, with and without the filter."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with Database(os.path.join(tmp_dir, "bench.db"), cache_size=0) as db:
+            db.create_qr_records({} for _ in range(NUM_QRS))
+            unknown = [str(uuid.uuid4()) for _ in range(lookups)]
+            for name in ("unknown, no filter", "unknown, uuid filter"):
+                if name.endswith("uuid filter"):
+                    db.enable_uuid_filter()
+                start = time.perf_counter()
+                for qr_uuid in unknown:
+                    db.get_redirect_url(qr_uuid)
+                results[name] = lookups / (time.perf_counter() - start)
+    return results
+
+
+class SyncScanDatabase(Database):
+    """A scan INSERT committed inside every lookup, for comparison"""
+
+    def get_redirect_url(self, qr_uuid):
+        redirect_url = super().get_redirect_url(qr_uuid)
+        self._insert_scans([(qr_uuid, "claimed", time.time())])
+        return redirect_url
+
+
+def bench_scan_logging(lookups=LOOKUPS_PER_THREAD):
+    """Time lookups with no scan logging, a synchronous INSERT per scan and
+    the write-behind scan log."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        with Database(db_path) as db:
+            qr_uuids = [db.create_qr_record() for _ in range(NUM_QRS)]
+        variants = (
+            ("no scan logging", Database, False),
+            ("synchronous scan insert", SyncScanDatabase, False),
+            ("write-behind scan log", Database, True),
+        )
+        for name, cls, scan_log in variants:
+            with cls(db_path) as db:
+                if scan_log:
+                    db.enable_scan_log()
+                results[name] = _lookups_per_second(db, qr_uuids, 1, lookups)
+    return results
+
+
+def main():
+    for name, rate in bench_inserts().items():
+        print(f"{name:<32} {rate:10.0f} records/s")
+    lookups = bench_redirect_lookups()
+    lookups.update(bench_unknown_lookups())
+    lookups.update(bench_scan_logging())
+    for name, rate in lookups.items():
+        print(f"{name:<32} {rate:10.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    main()
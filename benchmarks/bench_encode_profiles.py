@@ -0,0 +1,65 @@
+"""Encode time against bytes written for each encode profile.
+
+Run from the project root:
+
+    python -m benchmarks.bench_encode_profiles
+"""
+
+import os
+import tempfile
+import time
+
+from src.image_encoding import ENCODE_PROFILES, extension, save_image
+from src.qr_code_generator import QRCodeGenerator
+from src.sticker_generator import StickerGenerator
+
+ICON_PATH = "assets/phone_icon.png"
+TEMPLATE_PATH = "assets/sticQR_template.png"
+QR_SIZE = 700
+POSITION = (720, 1200)
+SCALE_FACTOR = 0.6
+NUMBER = 10
+
+
+def bench_encode_profiles(number=NUMBER):
+    """Return (ms per save, bytes) per output and profile"""
+    qr_generator = QRCodeGenerator(icon_path=ICON_PATH)
+    qr_images = [qr_generator.generate(f"bench-{i}", QR_SIZE) for i in range(number)]
+    sticker_generator = StickerGenerator(TEMPLATE_PATH)
+    images = {
+        "qr": qr_images,
+        "sticker": [
+            sticker_generator.create_sticker(
+                qr_image, POSITION, scale_factor=SCALE_FACTOR
+            )
+            for qr_image in qr_images
+        ],
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for output, batch in images.items():
+            params = {"dpi": (300, 300)} if output == "sticker" else {}
+            for profile in ENCODE_PROFILES:
+                paths = [
+                    os.path.join(tmp_dir, f"{output}_{i}{extension(profile)}")
+                    for i in range(number)
+                ]
+                start = time.perf_counter()
+                for image, path in zip(batch, paths):
+                    save_image(image, path, profile, **params)
+                elapsed = time.perf_counter() - start
+                size = sum(os.path.getsize(path) for path in paths)
+                results[output, profile] = (elapsed / number * 1000, size / number)
+    return results
+
+
+def main():
+    results = bench_encode_profiles()
+    print(f"{'output':8} {'profile':8} {'ms/save':>8} {'bytes':>9} {'vs default':>10}")
+    for (output, profile), (ms, size) in results.items():
+        ratio = size / results[output, "default"][1]
+        print(f"{output:8} {profile:8} {ms:8.1f} {size:9.0f} {ratio:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Images back from a worker process, pickled against through an ImageRing.
+
+Run from the project root:
+
+    python -m benchmarks.bench_image_transport
+"""
+
+import concurrent.futures
+import pickle
+import time
+
+from PIL import Image
+
+from src.image_transport import ImageRing, image_nbytes
+
+NUM_IMAGES = 500
+QR_SIZE = (700, 700)
+PATCH_SIZE = (420, 420)
+WORKERS = 2
+SLOTS = 8
+
+_images = None
+_ring = None
+
+
+def _init(ring):
+    global _images, _ring
+    _images = [
+        Image.new("RGBA", QR_SIZE, (0, 0, 0, 255)),
+        Image.new("RGB", PATCH_SIZE, (255, 255, 255)),
+    ]
+    _ring = ring
+
+
+def _pickled(_):
+    return _images
+
+
+def _shipped(_):
+    return _ring.send(_images)
+
+
+def _images_per_second(ring, work, receive):
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+        WORKERS, initializer=_init, initargs=(ring,)
+    ) as pool:
+        for result in pool.map(work, range(NUM_IMAGES), chunksize=1):
+            receive(result)
+    return NUM_IMAGES / (time.perf_counter() - start)
+
+
+def bench_image_transport():
+    """Return items/s for each transport and the bytes pickled per item"""
+    ring = ImageRing(
+        SLOTS, image_nbytes("RGBA", QR_SIZE) + image_nbytes("RGB", PATCH_SIZE)
+    )
+    try:
+        _init(ring)
+
+        def receive(parcel):
+            qr_image, patch = ring.receive(parcel)
+            patch.load()
+            ring.release(parcel.slot)
+
+        return {
+            "pickle": _images_per_second(ring, _pickled, lambda images: None),
+            "ring": _images_per_second(ring, _shipped, receive),
+            "pickle_bytes": len(pickle.dumps(_images)),
+            "ring_bytes": len(pickle.dumps(_shipped(None))),
+        }
+    finally:
+        ring.close()
+
+
+def main():
+    results = bench_image_transport()
+    print(
+        f"{NUM_IMAGES} x RGBA {QR_SIZE[0]}px QR + RGB {PATCH_SIZE[0]}px patch, "
+        f"{WORKERS} workers"
+    )
+    print(
+        f"pickle: {results['pickle']:8.1f} items/s, "
+        f"{results['pickle_bytes'] / 1e6:.2f} MB pickled per item"
+    )
+    print(
+        f"ring:   {results['ring']:8.1f} items/s, "
+        f"{results['ring_bytes']} bytes pickled per item"
+    )
+
+
+if __name__ == "__main__":
+    main()
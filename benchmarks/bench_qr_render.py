@@ -0,0 +1,108 @@
+"""Per-stage timings for QR rendering.
+
+Run from the project root:
+
+    python -m benchmarks.bench_qr_render
+"""
+
+import timeit
+
+import qrcode
+from PIL import Image
+
+from src.qr_encoder import TemplateEncoder
+from src.qr_code_generator import (
+    QR_BORDER,
+    QR_BOX_SIZE,
+    QRCodeGenerator,
+    _create_rounded_qr,
+    _rasterize_matrix,
+)
+
+ICON_PATH = "assets/phone_icon.png"
+SIZE = 700
+NUMBER = 200
+
+
+def _per_call_ms(func, number=NUMBER):
+    return timeit.timeit(func, number=number) / number * 1000
+
+
+def bench_icon_stage(size=SIZE, number=NUMBER):
+    """Time _add_icon_with_frame with a cold and a warm render plan."""
+    generator = QRCodeGenerator(icon_path=ICON_PATH)
+    rounded = _create_rounded_qr(Image.new("1", (size, size), 1), 30)
+
+    def cold():
+        generator._render_plans.clear()
+        generator._add_icon_with_frame(rounded.copy(), size)
+
+    def warm():
+        generator._add_icon_with_frame(rounded.copy(), size)
+
+    return {
+        "copy only (baseline)": _per_call_ms(rounded.copy, number),
+        "icon stage (uncached)": _per_call_ms(cold, number),
+        "icon stage (cached)": _per_call_ms(warm, number),
+    }
+
+
+CLAIM_URL = "www.sticqr.docpulp.com/claim/00000000-0000-4000-8000-000000000000"
+
+
+def bench_encode(number=NUMBER):
+    """Time encoding a claim URL to a module matrix."""
+    encoder = TemplateEncoder(border=QR_BORDER)
+    encoder.encode(CLAIM_URL)
+
+    def library():
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            border=QR_BORDER,
+        )
+        qr.add_data(CLAIM_URL)
+        qr.make(fit=True)
+        qr.get_matrix()
+
+    return {
+        "encode (qrcode)": _per_call_ms(library, number // 4),
+        "encode (template)": _per_call_ms(lambda: encoder.encode(CLAIM_URL), number),
+    }
+
+
+def bench_rasterize(size=SIZE, number=NUMBER):
+    """Time turning an encoded QR into a rounded RGBA image."""
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=QR_BOX_SIZE,
+        border=QR_BORDER,
+    )
+    qr.add_data(CLAIM_URL)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+
+    def pil():
+        qr_img = qr.make_image(fill_color="black", back_color="white")
+        qr_img = qr_img.resize((size, size), Image.Resampling.NEAREST)
+        _create_rounded_qr(qr_img, 30)
+
+    return {
+        "rasterize (pil)": _per_call_ms(pil, number),
+        "rasterize (matrix)": _per_call_ms(
+            lambda: _rasterize_matrix(matrix, size, 30), number
+        ),
+    }
+
+
+def main():
+    results = {}
+    results.update(bench_encode())
+    results.update(bench_rasterize())
+    results.update(bench_icon_stage())
+    for name, ms in results.items():
+        print(f"{name:<28} {ms:8.3f} ms/QR")
+
+
+if __name__ == "__main__":
+    main()
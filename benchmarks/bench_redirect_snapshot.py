@@ -0,0 +1,68 @@
+"""Redirect lookups from SQLite against the memory-mapped snapshot.
+
+Run from the project root:
+
+    python -m benchmarks.bench_redirect_snapshot
+"""
+
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from src.database import Database
+from src.redirect_snapshot import RedirectSnapshot, write_snapshot
+
+NUM_ROWS = 500_000
+NUM_LOOKUPS = 50000
+CLAIM_EVERY = 10
+
+
+def _lookups_per_second(resolve, qr_uuids):
+    start = time.perf_counter()
+    for qr_uuid in qr_uuids:
+        resolve(qr_uuid)
+    return len(qr_uuids) / (time.perf_counter() - start)
+
+
+def bench_redirect_snapshot(num_rows=NUM_ROWS, lookups=NUM_LOOKUPS):
+    """Return lookups/s per resolver, the snapshot write time and its size"""
+    rng = random.Random(0)
+    qr_uuids = [
+        str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(num_rows)
+    ]
+    probes = [rng.choice(qr_uuids) for _ in range(lookups)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with Database(os.path.join(tmp_dir, "bench.db"), cache_size=0) as db:
+            db.create_qr_records(
+                ({"qr_uuid": qr_uuid} for qr_uuid in qr_uuids), chunk_size=10000
+            )
+            for qr_uuid in qr_uuids[::CLAIM_EVERY]:
+                db.claim_qr(qr_uuid, "1234567890", "XXXXXX7890")
+            results["sqlite"] = _lookups_per_second(db.get_redirect_url, probes)
+
+            path = os.path.join(tmp_dir, "redirects.snap")
+            start = time.perf_counter()
+            write_snapshot(db, path)
+            results["write"] = time.perf_counter() - start
+            results["size"] = os.path.getsize(path) / 1e6
+
+        with RedirectSnapshot(path) as snapshot:
+            results["snapshot"] = _lookups_per_second(snapshot.get_redirect_url, probes)
+    return results
+
+
+def main():
+    results = bench_redirect_snapshot()
+    print(
+        f"{NUM_ROWS} codes, snapshot of {results['size']:.1f} MB "
+        f"written in {results['write']:.1f} s"
+    )
+    for name in ("sqlite", "snapshot"):
+        print(f"{name:<10} {results[name]:>12,.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    main()
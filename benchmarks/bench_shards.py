@@ -0,0 +1,70 @@
+"""Insert and claim throughput of the sharded backend with 1, 4 and 16
+shards, every worker process writing one record or claim per transaction.
+
+Run from the project root:
+
+    python -m benchmarks.bench_shards
+"""
+
+import concurrent.futures
+import os
+import tempfile
+import time
+import uuid
+
+from src.sharded_database import ShardedDatabase
+
+SHARD_COUNTS = (1, 4, 16)
+WORKERS = 8
+RECORDS_PER_WORKER = 500
+
+
+def _insert(db_path, shards, qr_uuids):
+    with ShardedDatabase(db_path, shards, cache_size=0) as db:
+        for qr_uuid in qr_uuids:
+            db.create_qr_record(batch_id="bench", qr_uuid=qr_uuid)
+
+
+def _claim(db_path, shards, qr_uuids):
+    with ShardedDatabase(db_path, shards, cache_size=0) as db:
+        for qr_uuid in qr_uuids:
+            db.claim_qr(qr_uuid, "1234567890", "9876543210")
+
+
+def _per_second(pool, func, db_path, shards, work):
+    start = time.perf_counter()
+    futures = [pool.submit(func, db_path, shards, chunk) for chunk in work]
+    for future in futures:
+        future.result()
+    return sum(len(chunk) for chunk in work) / (time.perf_counter() - start)
+
+
+def bench_shards(shard_counts=SHARD_COUNTS, workers=WORKERS):
+    """Time concurrent inserts and claims for every shard count."""
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for shards in shard_counts:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_path = os.path.join(tmp_dir, "bench.db")
+                # Create the shards up front so workers only write rows
+                ShardedDatabase(db_path, shards).close()
+                work = [
+                    [str(uuid.uuid4()) for _ in range(RECORDS_PER_WORKER)]
+                    for _ in range(workers)
+                ]
+                results[f"insert, {shards} shards"] = _per_second(
+                    pool, _insert, db_path, shards, work
+                )
+                results[f"claim, {shards} shards"] = _per_second(
+                    pool, _claim, db_path, shards, work
+                )
+    return results
+
+
+def main():
+    for name, rate in bench_shards().items():
+        print(f"{name:<32} {rate:10.0f} writes/s")
+
+
+if __name__ == "__main__":
+    main()
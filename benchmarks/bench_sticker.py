@@ -0,0 +1,46 @@
+"""Timings for sticker compositing.
+
+Run from the project root:
+
+    python -m benchmarks.bench_sticker
+"""
+
+import timeit
+
+from src.qr_code_generator import QRCodeGenerator
+from src.sticker_generator import StickerGenerator
+
+ICON_PATH = "assets/phone_icon.png"
+TEMPLATE_PATH = "assets/sticQR_template.png"
+POSITION = (720, 1200)
+SCALE_FACTOR = 0.6
+NUMBER = 20
+
+
+def _per_call_ms(func, number=NUMBER):
+    return timeit.timeit(func, number=number) / number * 1000
+
+
+def bench_create_sticker(number=NUMBER):
+    """Time create_sticker with and without the cached background."""
+    qr_image = QRCodeGenerator(icon_path=ICON_PATH).generate("bench", 700)
+    results = {}
+    for name, cache_backgrounds in (("full template", False), ("cached", True)):
+        generator = StickerGenerator(TEMPLATE_PATH, cache_backgrounds)
+        generator.create_sticker(qr_image, POSITION, scale_factor=SCALE_FACTOR)
+        results[f"create_sticker ({name})"] = _per_call_ms(
+            lambda: generator.create_sticker(
+                qr_image, POSITION, scale_factor=SCALE_FACTOR
+            ),
+            number,
+        )
+    return results
+
+
+def main():
+    for name, ms in bench_create_sticker().items():
+        print(f"{name:<32} {ms:8.3f} ms/sticker")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Database size and redirect lookup latency with text and BLOB UUID keys.
+
+Builds a text database of NUM_ROWS codes, converts it in place to BLOB
+keys and measures both. Run from the project root:
+
+    python -m benchmarks.bench_uuid_format
+"""
+
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from src.database import Database
+
+NUM_ROWS = 5_000_000
+NUM_LOOKUPS = 20000
+SAMPLE_EVERY = 100
+
+
+def _rows(count, sample):
+    rng = random.Random(0)
+    for i in range(count):
+        qr_uuid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        if i % SAMPLE_EVERY == 0:
+            sample.append(qr_uuid)
+        yield {"qr_uuid": qr_uuid, "batch_id": f"batch-{i // 10000}"}
+
+
+def _measure(db, sample, lookups):
+    conn = db._connection()
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size_mb = os.path.getsize(db.db_path) / 1e6
+
+    rng = random.Random(1)
+    qr_uuids = [rng.choice(sample) for _ in range(lookups)]
+    start = time.perf_counter()
+    for qr_uuid in qr_uuids:
+        db.get_redirect_url(qr_uuid)
+    lookup_us = (time.perf_counter() - start) / lookups * 1e6
+    return size_mb, lookup_us
+
+
+def bench_uuid_format(num_rows=NUM_ROWS, lookups=NUM_LOOKUPS):
+    """Return (size in MB, lookup in us) per format and the conversion time."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample = []
+        with Database(os.path.join(tmp_dir, "bench.db"), cache_size=0) as db:
+            db.create_qr_records(_rows(num_rows, sample), chunk_size=10000)
+            results["text"] = _measure(db, sample, lookups)
+
+            start = time.perf_counter()
+            db.convert_uuid_format("blob")
+            results["convert"] = time.perf_counter() - start
+            results["blob"] = _measure(db, sample, lookups)
+    return results
+
+
+def main():
+    results = bench_uuid_format()
+    print(f"{NUM_ROWS} rows, text to blob conversion {results['convert']:.1f} s")
+    for name in ("text", "blob"):
+        size_mb, lookup_us = results[name]
+        print(f"{name:<6} {size_mb:10.1f} MB {lookup_us:8.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,12 +12,13 @@ setup(
         "qrcode",
         "Pillow",
         "fpdf2",
+        "numpy",
         "pytest",
         "pytest-cov",
     ],
     entry_points={
         "console_scripts": [
-            "carqrsticker=src.main:main",
+            "carqrsticker=src.main:cli",
         ],
     },
 )
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import math
+import os
+import struct
+
+_MAGIC = b"QRBF"
+# magic, format version, bit count, hash count, items added, watermark,
+# then from version 2 the length of the JSON meta that follows the bits
+_HEADER_V1 = struct.Struct(">4sBQBQQ")
+_HEADER = struct.Struct(">4sBQBQQI")
+_FORMAT_VERSION = 2
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a tunable false positive
+    rate, in about 1.44 * log2(1 / error_rate) bits per item.
+
+    ``watermark`` is free for the owner to record how far the filter is
+    up to date and ``meta``, a JSON-able dict, for what it was built from.
+    Both are saved and loaded with the bits.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self._init(num_bits, num_hashes, bytearray((num_bits + 7) // 8))
+
+    def _init(self, num_bits, num_hashes, bits, count=0, watermark=0, meta=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = count
+        self.watermark = watermark
+        self.meta = meta or {}
+        self._bits = bits
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        # Kirsch-Mitzenmacher double hashing, h2 made odd so it never sticks
+        h2 |= 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def save(self, path):
+        """Write the filter to ``path``, replacing any previous file atomically"""
+        tmp_path = f"{path}.tmp"
+        meta = json.dumps(self.meta).encode()
+        with open(tmp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    _FORMAT_VERSION,
+                    self.num_bits,
+                    self.num_hashes,
+                    self.count,
+                    self.watermark,
+                    len(meta),
+                )
+            )
+            f.write(self._bits)
+            f.write(meta)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _HEADER_V1.size or data[:4] != _MAGIC:
+            raise ValueError(f"{path} is not a Bloom filter file")
+        # Version 1 files carry no meta
+        version = data[4]
+        header = {1: _HEADER_V1, 2: _HEADER}.get(version)
+        if header is None or len(data) < header.size:
+            raise ValueError(f"{path} is not a Bloom filter file")
+        _, _, num_bits, num_hashes, count, watermark, *meta_size = header.unpack_from(
+            data
+        )
+        bits_end = header.size + (num_bits + 7) // 8
+        meta_size = meta_size[0] if meta_size else 0
+        if len(data) != bits_end + meta_size:
+            raise ValueError(f"{path} is truncated")
+        meta = json.loads(data[bits_end:]) if meta_size else {}
+        bloom = cls.__new__(cls)
+        bloom._init(
+            num_bits,
+            num_hashes,
+            bytearray(data[header.size : bits_end]),
+            count,
+            watermark,
+            meta,
+        )
+        return bloom
@@ -1,51 +1,384 @@
+import argparse
+import csv
+import itertools
+import json
 import sqlite3
 import os
+import sys
+import threading
+import time
 from datetime import datetime
 import uuid
+import weakref
+
+try:
+    from src.bloom_filter import BloomFilter
+    from src.payload import CLAIM_URL, CONTACT_URL, resolve_qr_uuid
+    from src.redirect_cache import MISSING, RedirectCache
+    from src.scan_log import ScanLog
+except ImportError:
+    from bloom_filter import BloomFilter
+    from payload import CLAIM_URL, CONTACT_URL, resolve_qr_uuid
+    from redirect_cache import MISSING, RedirectCache
+    from scan_log import ScanLog
+
+
+# Applied to every connection. WAL lets readers run while a claim is being
+# written, and with WAL synchronous=NORMAL only syncs at checkpoints.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # negative means KiB, so 16 MB
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    # Milliseconds a writer waits for the lock before "database is locked"
+    "busy_timeout": 5000,
+}
+
+# Claims still locked out after busy_timeout are retried this many times,
+# sleeping CLAIM_RETRY_DELAY seconds, doubled on every attempt, in between.
+CLAIM_RETRIES = 3
+CLAIM_RETRY_DELAY = 0.05
+
+
+# Ordered schema upgrades, MIGRATIONS[n] takes the schema from version n to
+# n + 1. Only ever append steps, databases already in use have run the rest.
+MIGRATIONS = [
+    # 1: the original tables, a no-op on databases created before versioning
+    (
+        """
+        CREATE TABLE IF NOT EXISTS qr_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            qr_uuid VARCHAR(36) UNIQUE NOT NULL,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed BOOLEAN DEFAULT FALSE,
+            batch_id VARCHAR(50),
+            status VARCHAR(20) DEFAULT 'active',
+            file_path VARCHAR(255),
+            sticker_path VARCHAR(255),
+            redirect_url VARCHAR(255)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS claims (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            qr_uuid VARCHAR(36),
+            claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_phone VARCHAR(15),
+            masked_number VARCHAR(15),
+            FOREIGN KEY (qr_uuid) REFERENCES qr_codes(qr_uuid)
+        )
+        """,
+    ),
+    # 2: indexes for batch listings and claim lookups, plus a covering index
+    # so redirects are answered from the index alone
+    (
+        "CREATE INDEX IF NOT EXISTS idx_qr_codes_batch_id ON qr_codes (batch_id)",
+        "CREATE INDEX IF NOT EXISTS idx_qr_codes_redirect "
+        "ON qr_codes (qr_uuid, claimed, redirect_url)",
+        "CREATE INDEX IF NOT EXISTS idx_claims_qr_uuid ON claims (qr_uuid)",
+    ),
+    # 3: per-database settings, such as the UUID storage format
+    ("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)",),
+    # 4: scan events, written behind the redirect path by a ScanLog
+    (
+        """
+        CREATE TABLE IF NOT EXISTS scans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            qr_uuid VARCHAR(36),
+            scanned_at TIMESTAMP,
+            outcome VARCHAR(10)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scans_qr_uuid ON scans (qr_uuid)",
+    ),
+    # 5: batch jobs and the stickers they planned, so a run that died can be
+    # resumed; whether a sticker's files exist is checked on disk instead
+    (
+        """
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            batch_id VARCHAR(50) PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status VARCHAR(20) DEFAULT 'running',
+            options TEXT,
+            pdf_path VARCHAR(255)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS batch_job_items (
+            batch_id VARCHAR(50),
+            idx INTEGER,
+            qr_uuid VARCHAR(36),
+            stored BOOLEAN DEFAULT FALSE,
+            PRIMARY KEY (batch_id, idx)
+        )
+        """,
+    ),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+QR_CODE_COLUMNS = (
+    "id",
+    "qr_uuid",
+    "generated_at",
+    "claimed",
+    "batch_id",
+    "status",
+    "file_path",
+    "sticker_path",
+    "redirect_url",
+)
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# What a scan resolved to, recorded with every scan when a scan log is on
+SCAN_OUTCOMES = ("unclaimed", "claimed", "unknown")
+
+# How qr_uuid is stored: 36-character text, or the 16 UUID bytes as a BLOB
+# which halves the key in the table and in both qr_uuid indexes.
+UUID_FORMATS = ("text", "blob")
+
+# Seconds between catching the UUID filter up with rows other processes
+# inserted; until then those codes resolve as unknown.
+UUID_FILTER_REFRESH = 1.0
+
+# Rows read per lock hold when the UUID filter catches up
+UUID_FILTER_PAGE = 10000
+
+# The lookups that have to stay on an index as the tables grow. The planner
+# prefers the UNIQUE qr_uuid index for redirects, which still reads the
+# table row, so they name the covering index explicitly.
+HOT_QUERIES = {
+    "redirect": "SELECT claimed, redirect_url FROM qr_codes "
+    "INDEXED BY idx_qr_codes_redirect WHERE qr_uuid = ?",
+    "batch": "SELECT * FROM qr_codes WHERE batch_id = ?",
+    "batch_page": "SELECT * FROM qr_codes WHERE batch_id = ? AND id > ? "
+    "ORDER BY id LIMIT ?",
+    "claim": "SELECT user_phone, masked_number FROM claims WHERE qr_uuid = ?",
+}
+
+
+def encode_uuid(qr_uuid):
+    """The 16-byte BLOB key of a canonical UUID string, other IDs stay text"""
+    try:
+        value = uuid.UUID(qr_uuid)
+    except (AttributeError, TypeError, ValueError):
+        return qr_uuid
+    return value.bytes if str(value) == qr_uuid else qr_uuid
+
+
+def decode_uuid(key):
+    """The UUID string of a stored key in either format"""
+    return str(uuid.UUID(bytes=key)) if isinstance(key, bytes) else key
+
+
+def redirect_url_for(qr_uuid, claimed, redirect_url):
+    """Where a code with this claim state sends its scanner"""
+    if claimed and redirect_url:
+        return redirect_url
+    return CLAIM_URL.format(qr_uuid)
+
+
+def scan_outcome(qr_uuid, redirect_url):
+    if redirect_url is None:
+        return "unknown"
+    return "unclaimed" if redirect_url == CLAIM_URL.format(qr_uuid) else "claimed"
+
+
+def _decode_column(rows, index):
+    return [row[:index] + (decode_uuid(row[index]),) + row[index + 1 :] for row in rows]
+
+
+def export_rows(rows, columns, output, export_format="csv"):
+    """Write ``rows`` of ``columns`` to ``output`` as CSV or JSON Lines"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {export_format!r}, "
+            f"expected one of {EXPORT_FORMATS}"
+        )
+    count = 0
+    if export_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            output.write(json.dumps(dict(zip(columns, row))) + "\n")
+            count += 1
+    return count
+
+
+class _ThreadConnection:
+    """Holds a thread's connection in its thread-local storage"""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _close_connection(conn, connections, lock):
+    """Close ``conn`` unless Database.close() already took it"""
+    with lock:
+        if conn not in connections:
+            return
+        connections.remove(conn)
+    conn.close()
 
 
 class Database:
-    def __init__(self, db_path="car_qr.db"):
+    """SQLite store for QR codes and claims.
+
+    Each thread keeps one open connection until it exits or the Database
+    is closed; call close() or use it as a context manager when done.
+
+    With ``cache_size`` set, redirect lookups go through a RedirectCache of
+    that many entries kept for ``cache_ttl`` seconds. Writes through this
+    instance invalidate it at once, but claims made through another
+    Database or process on the same file only show up once the entry
+    expires: until then the claim URL is still served. It is off by
+    default, only enable it where that window is acceptable.
+
+    ``uuid_format`` converts the database to that UUID storage format when
+    it differs from the stored one; None keeps what the file already uses.
+    Methods take and return UUID strings in either format.
+    """
+
+    def __init__(
+        self,
+        db_path="car_qr.db",
+        pragmas=None,
+        cache_size=0,
+        cache_ttl=60.0,
+        uuid_format=None,
+    ):
         self.db_path = db_path
+        self.pragmas = dict(PRAGMAS, **(pragmas or {}))
+        self.redirect_cache = (
+            RedirectCache(cache_size, cache_ttl) if cache_size else None
+        )
+        self.uuid_filter = None
+        self.scan_log = None
+        self._filter_synced_at = 0.0
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
         self.initialize_db()
+        self.uuid_format = self._stored_uuid_format()
+        if uuid_format is not None and uuid_format != self.uuid_format:
+            self.convert_uuid_format(uuid_format)
 
-    def initialize_db(self):
-        """Create tables if they don't exist"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+    def __enter__(self):
+        return self
 
-            # Create QR codes table
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS qr_codes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    qr_uuid VARCHAR(36) UNIQUE NOT NULL,
-                    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    claimed BOOLEAN DEFAULT FALSE,
-                    batch_id VARCHAR(50),
-                    status VARCHAR(20) DEFAULT 'active',
-                    file_path VARCHAR(255),
-                    sticker_path VARCHAR(255),
-                    redirect_url VARCHAR(255)
-                )
-            """
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connection(self):
+        """Return this thread's connection, opening it on first use"""
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            # Shared across threads only so close() can close them all
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            owner = self._local.owner = _ThreadConnection(conn)
+            with self._lock:
+                self._connections.append(conn)
+            # The thread's locals are dropped when it exits, which closes
+            # its connection then rather than at close()
+            weakref.finalize(
+                owner, _close_connection, conn, self._connections, self._lock
             )
+        return owner.conn
 
-            # Create claims table
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS claims (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    qr_uuid VARCHAR(36),
-                    claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    user_phone VARCHAR(15),
-                    masked_number VARCHAR(15),
-                    FOREIGN KEY (qr_uuid) REFERENCES qr_codes(qr_uuid)
-                )
-            """
+    def close(self):
+        """Close every connection this Database opened"""
+        if self.scan_log is not None:
+            self.scan_log.close()
+            self.scan_log = None
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def initialize_db(self):
+        """Create tables if they don't exist and apply pending migrations"""
+        self.migrate()
+
+    def schema_version(self):
+        return self._connection().execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self, target=None):
+        """Apply the MIGRATIONS steps up to ``target``, by default all of them.
+
+        The schema version is kept in ``PRAGMA user_version`` and each step
+        commits together with its version bump. Returns the version reached.
+        """
+        target = SCHEMA_VERSION if target is None else target
+        conn = self._connection()
+        while True:
+            with conn:
+                # Re-read the version under the write lock so concurrent
+                # processes never apply the same step twice
+                conn.execute("BEGIN IMMEDIATE")
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= target:
+                    return version
+                for statement in MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+
+    def _stored_uuid_format(self):
+        row = (
+            self._connection()
+            .execute("SELECT value FROM settings WHERE name = 'uuid_format'")
+            .fetchone()
+        )
+        return row[0] if row else "text"
+
+    def convert_uuid_format(self, uuid_format):
+        """Rewrite every stored qr_uuid in ``uuid_format`` and record it.
+
+        One transaction, followed by a VACUUM to hand back the space saved.
+        Run it while no other process has the database open.
+        """
+        if uuid_format not in UUID_FORMATS:
+            raise ValueError(
+                f"Unknown UUID format {uuid_format!r}, expected one of {UUID_FORMATS}"
             )
+        convert = "encode_uuid" if uuid_format == "blob" else "decode_uuid"
+        conn = self._connection()
+        conn.create_function("encode_uuid", 1, encode_uuid, deterministic=True)
+        conn.create_function("decode_uuid", 1, decode_uuid, deterministic=True)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("qr_codes", "claims", "scans", "batch_job_items"):
+                conn.execute(f"UPDATE {table} SET qr_uuid = {convert}(qr_uuid)")
+            conn.execute(
+                "INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)",
+                ("uuid_format", uuid_format),
+            )
+        conn.execute("VACUUM")
+        self.uuid_format = uuid_format
 
-            conn.commit()
+    def _key(self, qr_uuid):
+        """The stored form of ``qr_uuid``"""
+        return encode_uuid(qr_uuid) if self.uuid_format == "blob" else qr_uuid
+
+    def query_plans(self):
+        """Return the EXPLAIN QUERY PLAN details of every HOT_QUERIES entry"""
+        conn = self._connection()
+        plans = {}
+        for name, query in HOT_QUERIES.items():
+            params = (None,) * query.count("?")
+            plans[name] = [
+                row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            ]
+        return plans
 
     def create_qr_record(
         self, batch_id=None, file_path=None, sticker_path=None, qr_uuid=None
@@ -53,84 +386,515 @@ class Database:
         """Create a new QR code record"""
         if qr_uuid is None:
             qr_uuid = str(uuid.uuid4())
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
                 INSERT INTO qr_codes (qr_uuid, batch_id, file_path, sticker_path)
                 VALUES (?, ?, ?, ?)
             """,
-                (qr_uuid, batch_id, file_path, sticker_path),
+                (self._key(qr_uuid), batch_id, file_path, sticker_path),
             )
             conn.commit()
+            # Drop a cached not-found answer
+            self._filter_add(qr_uuid)
+            self._invalidate_redirects(qr_uuid)
             return qr_uuid
 
+    def create_qr_records(self, rows, chunk_size=500):
+        """Insert many QR code records, one transaction per chunk.
+
+        ``rows`` is any iterable of dicts taking the create_qr_record
+        keyword arguments. Returns the number of records inserted and the
+        UUIDs skipped because they already exist or repeat within ``rows``.
+        """
+        rows = iter(rows)
+        inserted = 0
+        collisions = []
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return inserted, collisions
+            inserted += self._insert_chunk(chunk, collisions)
+
+    def _insert_chunk(self, rows, collisions):
+        values = [
+            (
+                row.get("qr_uuid") or str(uuid.uuid4()),
+                row.get("batch_id"),
+                row.get("file_path"),
+                row.get("sticker_path"),
+            )
+            for row in rows
+        ]
+        with self._connection() as conn:
+            # Hold the write lock so nothing can insert between check and insert
+            conn.execute("BEGIN IMMEDIATE")
+            keys = [self._key(value[0]) for value in values]
+            placeholders = ", ".join("?" * len(keys))
+            seen = {
+                key
+                for (key,) in conn.execute(
+                    f"SELECT qr_uuid FROM qr_codes WHERE qr_uuid IN ({placeholders})",
+                    keys,
+                )
+            }
+            fresh = []
+            for key, value in zip(keys, values):
+                if key in seen:
+                    collisions.append(value[0])
+                else:
+                    seen.add(key)
+                    fresh.append(value)
+            conn.executemany(
+                """
+                INSERT INTO qr_codes (qr_uuid, batch_id, file_path, sticker_path)
+                VALUES (?, ?, ?, ?)
+            """,
+                [(self._key(value[0]),) + value[1:] for value in fresh],
+            )
+        self._filter_add(*(value[0] for value in fresh))
+        self._invalidate_redirects(*(value[0] for value in fresh))
+        return len(fresh)
+
     def get_qr_details(self, qr_uuid):
         """Get QR code details"""
-        with sqlite3.connect(self.db_path) as conn:
+        qr_uuid = resolve_qr_uuid(qr_uuid)
+        with self._connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM qr_codes WHERE qr_uuid = ?", (qr_uuid,))
-            return cursor.fetchone()
+            cursor.execute(
+                "SELECT * FROM qr_codes WHERE qr_uuid = ?", (self._key(qr_uuid),)
+            )
+            row = cursor.fetchone()
+            return row and _decode_column([row], 1)[0]
 
     def claim_qr(self, qr_uuid, user_phone, masked_number):
-        """Claim a QR code and update its redirect URL"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        """Claim a QR code and update its redirect URL.
 
-            # Check if QR is already claimed
-            cursor.execute("SELECT claimed FROM qr_codes WHERE qr_uuid = ?", (qr_uuid,))
-            result = cursor.fetchone()
-            if result and result[0]:
-                return False, "QR code already claimed"
+        Safe under concurrent claims, exactly one caller wins a code.
+        """
+        qr_uuid = resolve_qr_uuid(qr_uuid)
+        for attempt in range(CLAIM_RETRIES + 1):
+            try:
+                claimed = self._claim(qr_uuid, user_phone, masked_number)
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == CLAIM_RETRIES:
+                    raise
+                time.sleep(CLAIM_RETRY_DELAY * 2**attempt)
 
-            # Update QR status, redirect URL and create claim record
-            contact_url = f"www.sticqr.docpulp.com/contact/{qr_uuid}"
-            cursor.execute(
+        if claimed is None:
+            return False, "QR code not found"
+        if not claimed:
+            return False, "QR code already claimed"
+        self._invalidate_redirects(qr_uuid)
+        return True, "QR code claimed successfully"
+
+    def _claim(self, qr_uuid, user_phone, masked_number):
+        """True if claimed, False if already claimed, None if not found"""
+        key = self._key(qr_uuid)
+        with self._connection() as conn:
+            # Take the write lock up front, a deferred transaction would
+            # have to upgrade its read lock and can fail halfway
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
                 """
-                UPDATE qr_codes 
-                SET claimed = TRUE, redirect_url = ? 
-                WHERE qr_uuid = ?
+                UPDATE qr_codes
+                SET claimed = TRUE, redirect_url = ?
+                WHERE qr_uuid = ? AND claimed IS NOT TRUE
             """,
-                (contact_url, qr_uuid),
+                (CONTACT_URL.format(qr_uuid), key),
             )
+            if cursor.rowcount != 1:
+                exists = conn.execute(
+                    "SELECT 1 FROM qr_codes WHERE qr_uuid = ?", (key,)
+                ).fetchone()
+                return False if exists else None
 
-            cursor.execute(
+            conn.execute(
                 """
                 INSERT INTO claims (qr_uuid, user_phone, masked_number)
                 VALUES (?, ?, ?)
             """,
-                (qr_uuid, user_phone, masked_number),
+                (key, user_phone, masked_number),
             )
-
-            conn.commit()
-            return True, "QR code claimed successfully"
+            return True
 
     def get_redirect_url(self, qr_uuid):
-        """Get the current redirect URL for a QR code based on its claim status"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Get the current redirect URL for a QR code based on its claim status.
+
+        Accepts the legacy UUID as well as the compact base36 ID. The scan
+        is recorded when a scan log is enabled.
+        """
+        qr_uuid = resolve_qr_uuid(qr_uuid)
+        redirect_url = self._redirect_url(qr_uuid)
+        if self.scan_log is not None:
+            self.scan_log.record(qr_uuid, scan_outcome(qr_uuid, redirect_url))
+        return redirect_url
+
+    def _redirect_url(self, qr_uuid):
+        # Checked before the cache so junk UUIDs never evict real entries
+        if not self._known_uuid(qr_uuid):
+            return None
+        cache = self.redirect_cache
+        if cache is None:
+            return self._lookup_redirect_url(qr_uuid)
+
+        redirect_url = cache.get(qr_uuid)
+        if redirect_url is MISSING:
+            generation = cache.generation
+            redirect_url = self._lookup_redirect_url(qr_uuid)
+            cache.put(qr_uuid, redirect_url, generation)
+        return redirect_url
+
+    def _lookup_redirect_url(self, qr_uuid):
+        with self._connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT claimed, redirect_url 
-                FROM qr_codes 
-                WHERE qr_uuid = ?
-            """,
-                (qr_uuid,),
-            )
+            cursor.execute(HOT_QUERIES["redirect"], (self._key(qr_uuid),))
             result = cursor.fetchone()
 
             if not result:
                 return None
+            return redirect_url_for(qr_uuid, *result)
 
-            claimed, redirect_url = result
-            if claimed and redirect_url:
-                return redirect_url
-            else:
-                return f"www.sticqr.docpulp.com/claim/{qr_uuid}"
+    def _invalidate_redirects(self, *qr_uuids):
+        if self.redirect_cache is not None:
+            self.redirect_cache.invalidate(*qr_uuids)
+
+    def enable_uuid_filter(self, path=None, capacity=None, error_rate=0.001):
+        """Answer lookups of UUIDs a Bloom filter rules out without SQLite.
+
+        The filter is loaded from ``path`` when that file exists and caught
+        up with the rows inserted since it was saved, otherwise it is built
+        from qr_codes. ``capacity`` defaults to twice the current row count.
+        A saved filter that was built from another database file, or that
+        has seen rows this one does not hold, e.g. after a restore, is
+        built again: it could rule out UUIDs that do exist.
+        """
+        uuid_filter = None
+        if path and os.path.exists(path):
+            uuid_filter = BloomFilter.load(path)
+            if not self._uuid_filter_matches(uuid_filter):
+                uuid_filter = None
+        if uuid_filter is None:
+            if capacity is None:
+                count_query = "SELECT COUNT(*) FROM qr_codes"
+                (rows,) = self._connection().execute(count_query).fetchone()
+                capacity = max(2 * rows, 100000)
+            uuid_filter = BloomFilter(capacity, error_rate)
+            uuid_filter.meta = {"db_path": os.path.abspath(self.db_path), "rows": 0}
+        self.uuid_filter = uuid_filter
+        self.sync_uuid_filter()
+        return uuid_filter
+
+    def _uuid_filter_matches(self, uuid_filter):
+        """True if ``uuid_filter`` was built from this database as it is"""
+        if uuid_filter.meta.get("db_path") != os.path.abspath(self.db_path):
+            return False
+        conn = self._connection()
+        max_id, rows = conn.execute(
+            "SELECT COALESCE(MAX(id), 0), "
+            "(SELECT COUNT(*) FROM qr_codes WHERE id <= ?) FROM qr_codes",
+            (uuid_filter.watermark,),
+        ).fetchone()
+        return uuid_filter.watermark <= max_id and rows == uuid_filter.meta.get("rows")
+
+    def save_uuid_filter(self, path):
+        with self._lock:
+            self.uuid_filter.save(path)
+
+    def sync_uuid_filter(self):
+        """Add the rows inserted since the filter's watermark"""
+        uuid_filter = self.uuid_filter
+        cursor = self._connection().execute(
+            "SELECT id, qr_uuid FROM qr_codes WHERE id > ? ORDER BY id",
+            (uuid_filter.watermark,),
+        )
+        # Rows are read without the lock, which _connection() takes as well,
+        # so a long first sync does not hold up other threads' first query
+        while True:
+            rows = cursor.fetchmany(UUID_FILTER_PAGE)
+            if not rows:
+                break
+            qr_uuids = [(row_id, decode_uuid(key)) for row_id, key in rows]
+            with self._lock:
+                # Another thread may have synced some of the rows meanwhile
+                new = [item for item in qr_uuids if item[0] > uuid_filter.watermark]
+                uuid_filter.update(qr_uuid for _, qr_uuid in new)
+                if new:
+                    uuid_filter.watermark = new[-1][0]
+                # Rows up to the watermark, checked when the filter is loaded
+                uuid_filter.meta["rows"] = uuid_filter.meta.get("rows", 0) + len(new)
+        self._filter_synced_at = time.monotonic()
+
+    def _known_uuid(self, qr_uuid):
+        """False only when qr_uuid is certainly not in qr_codes"""
+        if self.uuid_filter is None or qr_uuid in self.uuid_filter:
+            return True
+        if time.monotonic() - self._filter_synced_at < UUID_FILTER_REFRESH:
+            return False
+        self.sync_uuid_filter()
+        return qr_uuid in self.uuid_filter
+
+    def _filter_add(self, *qr_uuids):
+        if self.uuid_filter is not None:
+            with self._lock:
+                self.uuid_filter.update(qr_uuids)
+
+    def enable_scan_log(self, flush_size=500, flush_interval=1.0, max_buffer=100000):
+        """Record every get_redirect_url call in the scans table.
+
+        Events are buffered by a ScanLog and written by its thread in one
+        transaction per flush, so lookups never wait on the insert. close()
+        writes what is still buffered.
+        """
+        if self.scan_log is None:
+            self.scan_log = ScanLog(
+                self._insert_scans, flush_size, flush_interval, max_buffer
+            )
+        return self.scan_log
+
+    def _insert_scans(self, events):
+        rows = [
+            (self._key(qr_uuid), scanned_at, outcome)
+            for qr_uuid, outcome, scanned_at in events
+        ]
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Unix times become UTC timestamps like CURRENT_TIMESTAMP's
+            conn.executemany(
+                "INSERT INTO scans (qr_uuid, scanned_at, outcome) "
+                "VALUES (?, strftime('%Y-%m-%d %H:%M:%f', ?, 'unixepoch'), ?)",
+                rows,
+            )
+
+    def batch_scan_counts(self, batch_id=None):
+        """Scans per batch as (batch_id, scans, codes scanned) rows.
+
+        Only scans of known codes count, ``batch_id`` limits it to one batch.
+        """
+        query = (
+            "SELECT q.batch_id, COUNT(*), COUNT(DISTINCT s.qr_uuid) FROM scans s "
+            "JOIN qr_codes q ON q.qr_uuid = s.qr_uuid {} "
+            "GROUP BY q.batch_id ORDER BY q.batch_id"
+        )
+        conn = self._connection()
+        if batch_id is None:
+            return conn.execute(query.format("")).fetchall()
+        return conn.execute(
+            query.format("WHERE q.batch_id = ?"), (batch_id,)
+        ).fetchall()
+
+    def create_batch_job(self, batch_id, options, pdf_path=None):
+        """Record a new batch job run with ``options``, a JSON-able dict, and
+        the PDF it is going to write"""
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT INTO batch_jobs (batch_id, options, pdf_path) "
+                    "VALUES (?, ?, ?)",
+                    (batch_id, json.dumps(options), pdf_path),
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Batch job {batch_id!r} already exists") from None
+
+    def get_batch_job(self, batch_id):
+        """The job as a dict with its item counts, None if there is none"""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT batch_id, created_at, status, options, pdf_path "
+            "FROM batch_jobs WHERE batch_id = ?",
+            (batch_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        items, stored = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(stored), 0) FROM batch_job_items "
+            "WHERE batch_id = ?",
+            (batch_id,),
+        ).fetchone()
+        columns = ("batch_id", "created_at", "status", "options", "pdf_path")
+        job = dict(zip(columns, row))
+        job.update(options=json.loads(job["options"]), items=items, stored=stored)
+        return job
+
+    def add_batch_job_items(self, batch_id, items):
+        """Record the (index, qr_uuid) pairs of a job in one transaction"""
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO batch_job_items (batch_id, idx, qr_uuid) VALUES (?, ?, ?)",
+                [(batch_id, index, self._key(qr_uuid)) for index, qr_uuid in items],
+            )
+
+    def iter_batch_job_items(self, batch_id, page_size=1000):
+        """Yield (index, qr_uuid, stored) of a job in index order"""
+        conn = self._connection()
+        last_index = -1
+        while True:
+            rows = conn.execute(
+                "SELECT idx, qr_uuid, stored FROM batch_job_items "
+                "WHERE batch_id = ? AND idx > ? ORDER BY idx LIMIT ?",
+                (batch_id, last_index, page_size),
+            ).fetchall()
+            for index, key, stored in rows:
+                yield index, decode_uuid(key), bool(stored)
+            if len(rows) < page_size:
+                return
+            last_index = rows[-1][0]
+
+    def mark_batch_job_items_stored(self, batch_id, indexes):
+        with self._connection() as conn:
+            conn.executemany(
+                "UPDATE batch_job_items SET stored = TRUE "
+                "WHERE batch_id = ? AND idx = ?",
+                [(batch_id, index) for index in indexes],
+            )
+
+    def finish_batch_job(self, batch_id, pdf_path):
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE batch_jobs SET status = 'done', pdf_path = ? "
+                "WHERE batch_id = ?",
+                (pdf_path, batch_id),
+            )
 
     def get_batch_qrs(self, batch_id):
         """Get all QR codes in a batch"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(HOT_QUERIES["batch"], (batch_id,))
+            return _decode_column(cursor.fetchall(), 1)
+
+    def iter_batch_qrs(self, batch_id, columns=None, page_size=1000):
+        """Yield the QR codes of a batch in id order, ``page_size`` at a time.
+
+        Pages are fetched by keyset on id, so memory stays flat and every
+        page is an index range scan however deep into the batch it is.
+        ``columns`` picks a subset of QR_CODE_COLUMNS, by default all.
+        """
+        columns = tuple(columns or QR_CODE_COLUMNS)
+        unknown = set(columns) - set(QR_CODE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns {sorted(unknown)}")
+
+        # id comes first to carry the keyset, it is dropped unless asked for
+        query = HOT_QUERIES["batch_page"].replace("*", ", ".join(("id",) + columns))
+        conn = self._connection()
+        last_id = 0
+        while True:
+            rows = conn.execute(query, (batch_id, last_id, page_size)).fetchall()
+            if "qr_uuid" in columns:
+                rows = _decode_column(rows, columns.index("qr_uuid") + 1)
+            for row in rows:
+                yield row[1:]
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def export_batch(self, batch_id, output, export_format="csv", columns=None):
+        """Stream a batch to the text file ``output`` as CSV or JSON Lines.
+
+        Returns the number of QR codes written.
+        """
+        columns = tuple(columns or QR_CODE_COLUMNS)
+        return export_rows(
+            self.iter_batch_qrs(batch_id, columns), columns, output, export_format
+        )
+
+    def redirect_watermarks(self):
+        """The highest qr_codes and claims ids, every later insert or claim
+        has a higher one"""
+        conn = self._connection()
+        return tuple(
+            conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            for table in ("qr_codes", "claims")
+        )
+
+    def iter_redirects(self, page_size=1000):
+        """Yield (qr_uuid, claimed, redirect_url) for every code in key order.
+
+        Pages are fetched by keyset on the covering redirect index. Keys
+        sort as stored, so in the blob format non-UUID IDs come first.
+        """
+        query = (
+            "SELECT qr_uuid, claimed, redirect_url FROM qr_codes "
+            "INDEXED BY idx_qr_codes_redirect {} ORDER BY qr_uuid LIMIT ?"
+        )
+        conn = self._connection()
+        rows = conn.execute(query.format(""), (page_size,)).fetchall()
+        while rows:
+            last_key = rows[-1][0]
+            yield from _decode_column(rows, 0)
+            if len(rows) < page_size:
+                return
+            rows = conn.execute(
+                query.format("WHERE qr_uuid > ?"), (last_key, page_size)
+            ).fetchall()
+
+    def redirect_changes(self, qr_codes_id, claims_id):
+        """Rows inserted after qr_codes id ``qr_codes_id`` or claimed after
+        claims id ``claims_id``, as (qr_uuid, claimed, redirect_url).
+
+        Returns the current redirect_watermarks() with the rows.
+        """
+        watermarks = self.redirect_watermarks()
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT qr_uuid, claimed, redirect_url FROM qr_codes WHERE id > ? "
+                "OR qr_uuid IN (SELECT qr_uuid FROM claims WHERE id > ?)",
+                (qr_codes_id, claims_id),
+            )
+            .fetchall()
+        )
+        return watermarks, _decode_column(rows, 0)
+
+    def get_claim(self, qr_uuid):
+        """Get the phone and masked number a QR code was claimed with"""
+        qr_uuid = resolve_qr_uuid(qr_uuid)
+        with self._connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM qr_codes WHERE batch_id = ?", (batch_id,))
-            return cursor.fetchall()
+            cursor.execute(HOT_QUERIES["claim"], (self._key(qr_uuid),))
+            return cursor.fetchone()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the QR code database")
+    parser.add_argument("db_path", nargs="?", default="car_qr.db")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="print the query plans of the hot queries",
+    )
+    parser.add_argument(
+        "--scans", action="store_true", help="print the scan counts of every batch"
+    )
+    parser.add_argument("--export", metavar="BATCH_ID", help="export a batch")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument(
+        "--output", "-o", help="file to export to, standard output by default"
+    )
+    args = parser.parse_args(argv)
+
+    with Database(args.db_path) as db:
+        if args.export:
+            if args.output:
+                with open(args.output, "w", newline="") as output:
+                    db.export_batch(args.export, output, args.format)
+            else:
+                db.export_batch(args.export, sys.stdout, args.format)
+            return
+        if args.scans:
+            for batch_id, scans, codes in db.batch_scan_counts():
+                print(f"{batch_id}: {scans} scans of {codes} codes")
+            return
+        print(f"{args.db_path}: schema version {db.schema_version()}")
+        if args.check:
+            for name, plan in db.query_plans().items():
+                print(f"{name}: {HOT_QUERIES[name]}")
+                for detail in plan:
+                    print(f"    {detail}")
+
+
+if __name__ == "__main__":
+    main()
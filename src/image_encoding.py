@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+# "default" keeps Pillow's PNG settings, "fast" trades size for encode
+# time, "compact" writes 1-bit or palette PNGs where the colours allow and
+# "webp" writes lossless WebP
+ENCODE_PROFILES = ("default", "fast", "compact", "webp")
+
+# Profiles whose files decode to the exact pixels that were saved
+LOSSLESS_PROFILES = ("default", "fast", "webp")
+
+# zlib level of the "fast" profile, Pillow's default is 6
+FAST_COMPRESS_LEVEL = 1
+
+# Share of the pixels "compact" keeps exact when it drops to a palette
+COMPACT_COVERAGE = 0.99
+
+# Every complete PNG ends with this IEND chunk, a write cut short does not
+PNG_TRAILER = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def check_profile(profile):
+    if profile not in ENCODE_PROFILES:
+        raise ValueError(
+            f"Unknown encode profile {profile!r}, expected one of {ENCODE_PROFILES}"
+        )
+
+
+def extension(profile):
+    """File extension of images saved with ``profile``"""
+    return ".webp" if profile == "webp" else ".png"
+
+
+def save_image(image, path, profile="default", **params):
+    """Save ``image`` to ``path`` with an encode profile.
+
+    ``params`` go to Image.save, e.g. ``dpi``. Only "compact" may change
+    pixels, see compact_image().
+    """
+    check_profile(profile)
+    if profile == "webp":
+        # exact keeps the colour of transparent pixels
+        image.save(path, "WEBP", lossless=True, exact=True, **params)
+    elif profile == "fast":
+        image.save(path, "PNG", compress_level=FAST_COMPRESS_LEVEL, **params)
+    elif profile == "compact":
+        compact_image(image).save(path, "PNG", optimize=True, **params)
+    else:
+        image.save(path, "PNG", **params)
+
+
+def compact_image(image):
+    """``image`` in as few bits per pixel as its colours allow.
+
+    Black and white images become 1 bit. Images whose 256 most common
+    colours cover COMPACT_COVERAGE of the pixels become palette images,
+    the rarer colours, like the anti-aliased edge of a QR icon, take the
+    nearest palette colour. Anything else is returned as it is.
+    """
+    if image.mode == "RGBA" and image.getextrema()[3] == (255, 255):
+        image = image.convert("RGB")
+    if image.mode not in ("RGB", "RGBA"):
+        return image
+
+    pixels = np.asarray(image)
+    bands = pixels.shape[2]
+    packed = np.zeros(pixels.shape[:2], np.uint32)
+    for band in range(bands):
+        packed |= pixels[..., band].astype(np.uint32) << (8 * band)
+    colors, indices, counts = np.unique(packed, return_inverse=True, return_counts=True)
+    if bands == 3 and set(colors.tolist()) <= {0, 0xFFFFFF}:
+        return image.convert("1")
+
+    kept = np.sort(np.argsort(counts)[::-1][:256])
+    if counts[kept].sum() < COMPACT_COVERAGE * packed.size:
+        return image
+    unpacked = np.stack([colors >> (8 * band) & 255 for band in range(bands)], 1)
+    palette = unpacked[kept].astype(np.int32)
+    distances = ((unpacked[:, None, :] - palette[None, :, :]) ** 2).sum(2)
+    nearest = distances.argmin(1)
+    nearest[kept] = np.arange(len(kept))
+    result = Image.fromarray(
+        nearest[indices].reshape(packed.shape).astype(np.uint8), "P"
+    )
+    result.putpalette(palette.astype(np.uint8).tobytes(), image.mode)
+    return result
+
+
+def encoded_complete(path):
+    """True if the PNG or WebP at ``path`` was written to the end"""
+    try:
+        with open(path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            if path.endswith(".webp"):
+                # A RIFF header holds the size of the rest of the file
+                f.seek(0)
+                header = f.read(12)
+                return (
+                    len(header) == 12
+                    and header[:4] == b"RIFF"
+                    and header[8:] == b"WEBP"
+                    and int.from_bytes(header[4:8], "little") + 8 == size
+                )
+            if size < len(PNG_TRAILER):
+                return False
+            f.seek(-len(PNG_TRAILER), os.SEEK_END)
+            return f.read() == PNG_TRAILER
+    except FileNotFoundError:
+        return False
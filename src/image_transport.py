@@ -0,0 +1,124 @@
+import collections
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+
+# Where an image lies in its slot, enough to map it back with frombuffer
+ImageSpec = collections.namedtuple("ImageSpec", ["mode", "size", "offset"])
+
+# What crosses the process boundary instead of the images: the slot they
+# were written to and an ImageSpec per image, None where no image was sent
+Parcel = collections.namedtuple("Parcel", ["slot", "specs"])
+
+
+# Bytes per pixel of tobytes() for the modes a slot can hold
+_PIXEL_BYTES = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4, "RGBX": 4, "CMYK": 4}
+
+
+def image_nbytes(mode, size):
+    """Bytes of an image of ``mode`` and ``size`` in its raw packing"""
+    return _PIXEL_BYTES[mode] * size[0] * size[1]
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching also registers the block with the
+        # resource tracker, which would unlink it when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class ImageRing:
+    """Pass PIL images between processes through shared memory.
+
+    One shared memory block is split into ``slots`` slots of ``slot_size``
+    bytes. send() takes the next free slot, copies the images into it and
+    returns a Parcel, which is all that needs to be pickled. receive() maps
+    the images back with Image.frombuffer; L, RGBA, RGBX and CMYK images
+    are views on the slot and stay valid until release(). Free slots go
+    round in a queue, so senders wait when every slot is in use.
+
+    The ring pickles as a reference to the same block, pass it to worker
+    processes as an initializer argument.
+    """
+
+    def __init__(self, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._owner = True
+        self._free = multiprocessing.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+
+    def __getstate__(self):
+        return {
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "name": self._shm.name,
+            "free": self._free,
+        }
+
+    def __setstate__(self, state):
+        self.slots = state["slots"]
+        self.slot_size = state["slot_size"]
+        self._shm = _attach(state["name"])
+        self._owner = False
+        self._free = state["free"]
+
+    def fits(self, images):
+        """True if ``images`` can be sent, palette images never can"""
+        images = [image for image in images if image is not None]
+        if any(image.mode not in _PIXEL_BYTES for image in images):
+            return False
+        size = sum(image_nbytes(image.mode, image.size) for image in images)
+        return size <= self.slot_size
+
+    def send(self, images, timeout=None):
+        """Copy ``images`` into a free slot, None if they do not fit one"""
+        if not self.fits(images):
+            return None
+        slot = self._free.get(timeout=timeout)
+        offset = slot * self.slot_size
+        specs = []
+        for image in images:
+            if image is None:
+                specs.append(None)
+                continue
+            data = image.tobytes()
+            self._shm.buf[offset : offset + len(data)] = data
+            specs.append(ImageSpec(image.mode, image.size, offset))
+            offset += len(data)
+        return Parcel(slot, specs)
+
+    def receive(self, parcel):
+        """The images of ``parcel``, mapped onto its slot"""
+        images = []
+        for spec in parcel.specs:
+            if spec is None:
+                images.append(None)
+                continue
+            size = image_nbytes(spec.mode, spec.size)
+            buffer = self._shm.buf[spec.offset : spec.offset + size]
+            images.append(
+                Image.frombuffer(spec.mode, spec.size, buffer, "raw", spec.mode, 0, 1)
+            )
+        return images
+
+    def release(self, slot):
+        """Hand ``slot`` back once no image received from it is used"""
+        self._free.put(slot)
+
+    def close(self):
+        try:
+            self._shm.close()
+        except BufferError:
+            # An image still maps the block, it goes when the process does
+            pass
+        if self._owner:
+            self._shm.unlink()
+            self._free.close()
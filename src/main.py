@@ -4,79 +4,446 @@ try:
     from src.sticker_generator import StickerGenerator
     from src.pdf_generator import PDFGenerator
     from src.database import Database
+    from src.image_encoding import ENCODE_PROFILES
+    from src.pipeline import PIPELINE_EXECUTORS, StickerPipeline, complete_file
 except ImportError:
     # When running directly from src directory
     from qr_code_generator import QRCodeGenerator
     from sticker_generator import StickerGenerator
     from pdf_generator import PDFGenerator
     from database import Database
+    from image_encoding import ENCODE_PROFILES
+    from pipeline import PIPELINE_EXECUTORS, StickerPipeline, complete_file
 
+import argparse
+import collections
+import sys
+import time
 import uuid
 import os
-from PIL import Image
 
+RECORD_CHUNK_SIZE = 500
 
-def main(template_image, icon_path, output_path, output_dir="../static"):
+# The last line of a PDF that was written to the end
+PDF_TRAILER = b"%%EOF\n"
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets")
+DEFAULT_TEMPLATE = os.path.join(ASSETS_DIR, "sticQR_template.png")
+DEFAULT_ICON = os.path.join(ASSETS_DIR, "phone_icon.png")
+
+
+def main(
+    template_image,
+    icon_path,
+    output_path=None,
+    output_dir="../static",
+    save_intermediates=True,
+    vector=False,
+    count=10,
+    qr_size=700,
+    scale_factor=0.6,
+    batch_id=None,
+    db_path="car_qr.db",
+    chunk_size=RECORD_CHUNK_SIZE,
+    executor="processes",
+    max_workers=None,
+    encode_profile="default",
+):
+    """Generate ``count`` stickers into one imposed PDF.
+
+    The batch streams through in chunks of ``chunk_size``: UUIDs are drawn
+    as they are rendered, records are stored a chunk at a time and PDF
+    pages are written as they fill, so memory use does not grow with
+    ``count``. Progress is printed after every chunk, with the depth of
+    every stage queue when ``executor`` is "staged".
+
+    The run is tracked as a batch job, resume() finishes it if it dies.
+    ``encode_profile`` sets how the intermediate QR and sticker images are
+    encoded, one of image_encoding.ENCODE_PROFILES.
+    """
     # Initialize database
-    db = Database()
-    batch_id = str(uuid.uuid4())
-
-    # 1. Create a QR code generator
-    qr_generator = QRCodeGenerator(icon_path=icon_path)
-
-    # 2. Generate QR codes with consistent UUIDs
-    batch_output_folder = os.path.join(output_dir, "qrcodes_batch")
-    os.makedirs(batch_output_folder, exist_ok=True)
-
-    # Pre-generate UUIDs for consistency
-    qr_uuids = [str(uuid.uuid4()) for _ in range(10)]
-    qr_image_paths = qr_generator.generate_batch(
-        num_qrs=10,
-        size=700,
-        output_folder=batch_output_folder,
-        qr_uuids=qr_uuids,  # Pass the pre-generated UUIDs
-    )
-
-    # 3. Create a sticker for each QR code and store in database
-    sticker_generator = StickerGenerator(template_path=template_image)
-    stickers_batch_folder = os.path.join(output_dir, "stickers_batch")
-    os.makedirs(stickers_batch_folder, exist_ok=True)
-    sticker_paths = []
-
-    for i, qr_image_path in enumerate(qr_image_paths):
-        qr_image = Image.open(qr_image_path)
-        sticker_output_path = os.path.join(stickers_batch_folder, f"sticker_{i}.png")
-        sticker_generator.create_sticker(
-            qr_image=qr_image,
-            position=(720, 1200),
-            output_path=sticker_output_path,
-            scale_factor=0.6,
+    db = Database(db_path)
+    batch_id = batch_id or str(uuid.uuid4())
+    options = {
+        "template_image": os.path.abspath(template_image),
+        "icon_path": os.path.abspath(icon_path),
+        "output_dir": os.path.abspath(output_dir),
+        "save_intermediates": save_intermediates,
+        "vector": vector,
+        "count": count,
+        "qr_size": qr_size,
+        "scale_factor": scale_factor,
+        "chunk_size": chunk_size,
+        "encode_profile": encode_profile,
+    }
+    # The job records where its files go, resume() only trusts files there
+    options.update(_batch_paths(options["output_dir"], batch_id, save_intermediates))
+    try:
+        db.create_batch_job(batch_id, options, options["pdf_path"])
+        return _run_batch(
+            db,
+            batch_id,
+            dict(
+                options,
+                output_dir=output_dir,
+                **_batch_paths(output_dir, batch_id, save_intermediates),
+            ),
+            executor,
+            max_workers,
         )
-        sticker_paths.append(sticker_output_path)
-
-        # Store QR and sticker info in database with consistent UUID
-        db.create_qr_record(
-            qr_uuid=qr_uuids[i],
-            batch_id=batch_id,
-            file_path=qr_image_path,
-            sticker_path=sticker_output_path,
+    finally:
+        db.close()
+
+
+def resume(batch_id, db_path="car_qr.db", executor="processes", max_workers=None):
+    """Finish the batch job ``batch_id`` with the options it was started with.
+
+    Records that were never stored are stored. Unless the job's PDF was
+    completed it is rebuilt, and every sticker is drawn again for it:
+    complete QR PNGs are decoded rather than encoded again and only the
+    missing or truncated PNGs are written. With a completed PDF only the
+    stickers with a missing or truncated PNG are rendered again, so
+    resuming a finished batch does nothing.
+    """
+    db = Database(db_path)
+    try:
+        job = db.get_batch_job(batch_id)
+        if job is None:
+            raise ValueError(f"No batch job {batch_id!r} in {db_path}")
+        return _run_batch(
+            db, batch_id, job["options"], executor, max_workers, resuming=True
         )
+    finally:
+        db.close()
 
-    # 4. Create a PDF from the generated stickers
-    pdf_generator = PDFGenerator()
-    pdf_output_path = os.path.join(output_dir, "qr_codes", "stickers.pdf")
-    os.makedirs(os.path.dirname(pdf_output_path), exist_ok=True)
-    pdf_generator.create_pdf_from_images(
-        image_paths=sticker_paths,
-        output_path=pdf_output_path,
+
+def _batch_paths(output_dir, batch_id, save_intermediates):
+    """Where a batch writes its files. Every batch gets a directory of its
+    own, so batches sharing an output directory never overwrite each
+    other's stickers or PDF."""
+    batch_dir = os.path.join(output_dir, batch_id)
+    return {
+        "qr_folder": (
+            os.path.join(batch_dir, "qrcodes_batch") if save_intermediates else None
+        ),
+        "sticker_folder": (
+            os.path.join(batch_dir, "stickers_batch") if save_intermediates else None
+        ),
+        "pdf_path": os.path.join(batch_dir, "qr_codes", "stickers.pdf"),
+    }
+
+
+def _run_batch(db, batch_id, options, executor, max_workers, resuming=False):
+    # Jobs that did not record their paths wrote into the shared output
+    # directory, where the files may belong to any batch. None of them is
+    # reused, the batch is rendered again into a directory of its own.
+    trusted = "pdf_path" in options
+    if not trusted:
+        options = dict(
+            options,
+            **_batch_paths(
+                options["output_dir"], batch_id, options["save_intermediates"]
+            ),
+        )
+    pipeline, sticker_generator = _create_pipeline(
+        options, reuse_files=resuming and trusted
     )
+    job = db.get_batch_job(batch_id)
+    build_pdf = not (trusted and _pdf_complete(job))
+    run = _BatchRun(db, batch_id, job, pipeline, options, trusted, build_pdf)
+    stickers = run.stickers(executor, max_workers)
 
-    print("Enhanced QR code generation complete!")
+    pdf_output_path = options["pdf_path"]
+    if build_pdf:
+        # 4. Impose the stickers 2x2 per sheet, the template is embedded once
+        pdf_generator = PDFGenerator()
+        os.makedirs(os.path.dirname(pdf_output_path), exist_ok=True)
+        pdf_generator.create_imposed_pdf(
+            stickers=stickers,
+            output_path=pdf_output_path,
+            backgrounds=sticker_generator.background,
+            columns=2,
+            rows=2,
+        )
+        db.finish_batch_job(batch_id, os.path.abspath(pdf_output_path))
+    else:
+        collections.deque(stickers, maxlen=0)
 
+    if resuming and not (build_pdf or run.processed()):
+        print(f"Batch {batch_id} is complete, nothing to do")
+        return pdf_output_path
+    print(
+        f"Batch {batch_id}: {run.done} stickers in "
+        f"{time.perf_counter() - run.start:.1f} s "
+        f"({_rate(run.done, run.start):.1f} stickers/s), "
+        f"written to {pdf_output_path}"
+    )
+    return pdf_output_path
+
+
+def _create_pipeline(options, reuse_files):
+    """The StickerPipeline of a batch with ``options`` and its sticker
+    generator"""
+    # 1. Create the QR code and sticker generators
+    # Jobs started before encode profiles existed wrote default PNGs
+    encode_profile = options.get("encode_profile", "default")
+    qr_generator = QRCodeGenerator(
+        icon_path=options["icon_path"], encode_profile=encode_profile
+    )
+    sticker_generator = StickerGenerator(
+        template_path=options["template_image"], encode_profile=encode_profile
+    )
+
+    # 2. Render QR codes straight into stickers in memory, the QR and
+    # sticker PNGs are only written when the intermediates are kept. Vector
+    # stickers print the QR code as paths instead of pixels. A resumed run
+    # keeps the PNGs of this job that are already complete.
+    for folder in (options["qr_folder"], options["sticker_folder"]):
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+    pipeline = StickerPipeline(
+        qr_generator,
+        sticker_generator,
+        qr_size=options["qr_size"],
+        position=(720, 1200),
+        scale_factor=options["scale_factor"],
+        qr_folder=options["qr_folder"],
+        sticker_folder=options["sticker_folder"],
+        vector=options["vector"],
+        reuse_files=reuse_files,
+    )
+    return pipeline, sticker_generator
+
+
+def _pdf_complete(job):
+    """True if the job finished writing the PDF it recorded"""
+    return bool(
+        job["status"] == "done"
+        and job["pdf_path"]
+        and complete_file(job["pdf_path"], PDF_TRAILER)
+    )
+
+
+class _BatchRun:
+    """The stickers of one run of a batch job and its progress.
+
+    stickers() yields the sticker layers for the PDF. Stickers that are
+    already done, when the PDF is not rebuilt and the files of a trusted
+    job are complete, are only counted and recorded if need be.
+    """
+
+    def __init__(self, db, batch_id, job, pipeline, options, trusted, build_pdf):
+        self.db = db
+        self.batch_id = batch_id
+        self.job = job
+        self.pipeline = pipeline
+        self.count = options["count"]
+        self.chunk_size = options["chunk_size"]
+        self.trusted = trusted
+        self.build_pdf = build_pdf
+        self.start = time.perf_counter()
+        self.done = self.rendered_count = self.stored_count = 0
+        self.records = []
+        # Whether each sticker in flight in the pipeline already has its record
+        self.in_flight_stored = collections.deque()
+
+    def processed(self):
+        """True once a sticker was rendered or a record stored"""
+        return bool(self.rendered_count or self.stored_count or self.records)
+
+    def planned(self):
+        """Stickers an earlier run planned come first. New UUIDs are drawn
+        lazily and recorded a chunk at a time before they are rendered."""
+        yield from self.db.iter_batch_job_items(self.batch_id)
+        index = self.job["items"]
+        while index < self.count:
+            items = [
+                (i, str(uuid.uuid4()))
+                for i in range(index, min(index + self.chunk_size, self.count))
+            ]
+            self.db.add_batch_job_items(self.batch_id, items)
+            for i, qr_uuid in items:
+                yield i, qr_uuid, False
+            index += len(items)
+
+    def to_render(self):
+        for index, qr_uuid, stored in self.planned():
+            if self.build_pdf or not (
+                self.trusted and self.pipeline.files_complete(index, qr_uuid)
+            ):
+                self.in_flight_stored.append(stored)
+                yield index, qr_uuid
+                continue
+            if not stored:
+                self.add_record(index, qr_uuid, *self.pipeline.paths(index, qr_uuid))
+            self.advance()
+
+    def stickers(self, executor, max_workers):
+        for rendered in self.pipeline.iter_items(
+            self.to_render(), executor=executor, max_workers=max_workers
+        ):
+            self.rendered_count += 1
+            if not self.in_flight_stored.popleft():
+                self.add_record(
+                    rendered.index,
+                    rendered.qr_uuid,
+                    rendered.qr_path,
+                    rendered.sticker_path,
+                )
+            self.advance()
+            yield rendered.layers
+        self.store()
+
+    def add_record(self, index, qr_uuid, qr_path, sticker_path):
+        self.records.append(
+            {
+                "index": index,
+                "qr_uuid": qr_uuid,
+                "batch_id": self.batch_id,
+                "file_path": qr_path,
+                "sticker_path": sticker_path,
+            }
+        )
+        if len(self.records) == self.chunk_size:
+            self.store()
+
+    def store(self):
+        # 3. Store the stickers in the database in bulk as they come out of
+        # the pipeline, one transaction per chunk of records
+        if not self.records:
+            return
+        _, collisions = self.db.create_qr_records(self.records)
+        for qr_uuid in collisions:
+            print(f"QR code {qr_uuid} already exists, record skipped")
+        self.db.mark_batch_job_items_stored(
+            self.batch_id, [r["index"] for r in self.records]
+        )
+        self.stored_count += len(self.records)
+        self.records = []
+
+    def advance(self):
+        self.done += 1
+        # Stickers skipped by a resume before any work are not progress
+        if not self.processed():
+            return
+        if self.done % self.chunk_size == 0 or self.done == self.count:
+            done, count = self.done, self.count
+            progress = (
+                f"{done}/{count} stickers, {_rate(done, self.start):.1f} stickers/s"
+            )
+            depths = self.pipeline.queue_depths()
+            if depths:
+                queued = " ".join(f"{name}={depth}" for name, depth in depths.items())
+                progress += f", queued {queued}"
+            print(progress)
+
+
+def _rate(done, start):
+    return done / max(time.perf_counter() - start, 1e-9)
+
+
+def cli(argv=None):
+    """Entry point of the carqrsticker console script, returns its exit
+    status"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["resume"]:
+        return _resume_cli(argv[1:])
+    parser = argparse.ArgumentParser(
+        description="Generate a batch of QR code stickers as a print-ready PDF",
+        epilog="carqrsticker resume BATCH_ID finishes a batch whose run died",
+    )
+    parser.add_argument(
+        "--count", "-n", type=int, default=10, help="number of stickers"
+    )
+    parser.add_argument("--size", type=int, default=700, help="QR code size in pixels")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=0.6,
+        help="scale of the whole sticker, 1.0 is the template's full size",
+    )
+    parser.add_argument("--batch-id", help="batch ID, a new UUID by default")
+    parser.add_argument(
+        "--output-dir",
+        default="static",
+        help="directory for the PDF and the intermediate PNGs",
+    )
+    parser.add_argument("--db-path", default="car_qr.db")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE)
+    parser.add_argument("--icon", default=DEFAULT_ICON)
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=RECORD_CHUNK_SIZE,
+        help="stickers stored per database transaction and progress report",
+    )
+    parser.add_argument("--executor", choices=PIPELINE_EXECUTORS, default="processes")
+    parser.add_argument("--workers", type=int, help="render workers")
+    parser.add_argument(
+        "--encode-profile",
+        choices=ENCODE_PROFILES,
+        default="default",
+        help="how the intermediate QR and sticker images are encoded",
+    )
+    parser.add_argument(
+        "--vector", action="store_true", help="draw QR codes as PDF paths"
+    )
+    parser.add_argument(
+        "--no-intermediates",
+        dest="save_intermediates",
+        action="store_false",
+        help="only write the PDF, not the QR and sticker PNGs",
+    )
+    args = parser.parse_args(argv)
+    if args.count < 0:
+        parser.error("--count must not be negative")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.batch_id and _batch_job_exists(args.db_path, args.batch_id):
+        parser.error(
+            f"batch {args.batch_id} already exists, "
+            f"run carqrsticker resume {args.batch_id} to finish it"
+        )
 
-if __name__ == "__main__":
     main(
-        template_image="../assets/sticQR_template.png",
-        icon_path="../assets/phone_icon.png",
-        output_path="../static/qr_codes/enhanced_qr_card.png",
+        args.template,
+        args.icon,
+        output_dir=args.output_dir,
+        save_intermediates=args.save_intermediates,
+        vector=args.vector,
+        count=args.count,
+        qr_size=args.size,
+        scale_factor=args.scale,
+        batch_id=args.batch_id,
+        db_path=args.db_path,
+        chunk_size=args.chunk_size,
+        executor=args.executor,
+        max_workers=args.workers,
+        encode_profile=args.encode_profile,
+    )
+    return 0
+
+
+def _resume_cli(argv):
+    parser = argparse.ArgumentParser(
+        prog="carqrsticker resume",
+        description="Finish a batch whose run died, redoing only what is missing",
     )
+    parser.add_argument("batch_id")
+    parser.add_argument("--db-path", default="car_qr.db")
+    parser.add_argument("--executor", choices=PIPELINE_EXECUTORS, default="processes")
+    parser.add_argument("--workers", type=int, help="render workers")
+    args = parser.parse_args(argv)
+    if not _batch_job_exists(args.db_path, args.batch_id):
+        parser.error(f"no batch {args.batch_id} in {args.db_path}")
+    resume(args.batch_id, args.db_path, args.executor, args.workers)
+    return 0
+
+
+def _batch_job_exists(db_path, batch_id):
+    with Database(db_path) as db:
+        return db.get_batch_job(batch_id) is not None
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,61 @@
+import string
+import uuid
+
+PAYLOADS = ("legacy", "compact")
+
+CLAIM_URL = "www.sticqr.docpulp.com/claim/{}"
+CONTACT_URL = "www.sticqr.docpulp.com/contact/{}"
+# Upper case only, so the whole URL fits QR alphanumeric mode
+COMPACT_CLAIM_URL = "WWW.STICQR.DOCPULP.COM/C/{}"
+
+COMPACT_ALPHABET = string.digits + string.ascii_uppercase
+COMPACT_ID_LENGTH = 25  # 36 ** 25 > 2 ** 128
+
+
+def to_compact_id(qr_uuid):
+    """Encode a UUID as a fixed-width upper-case base36 string"""
+    value = uuid.UUID(str(qr_uuid)).int
+    digits = []
+    for _ in range(COMPACT_ID_LENGTH):
+        value, digit = divmod(value, 36)
+        digits.append(COMPACT_ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+def from_compact_id(compact_id):
+    """Decode a base36 compact ID back to its canonical UUID string"""
+    compact_id = compact_id.upper()
+    if len(compact_id) != COMPACT_ID_LENGTH:
+        raise ValueError(f"Compact ID must be {COMPACT_ID_LENGTH} characters")
+    value = 0
+    for char in compact_id:
+        digit = COMPACT_ALPHABET.find(char)
+        if digit < 0:
+            raise ValueError(f"Invalid compact ID character: {char!r}")
+        value = value * 36 + digit
+    return str(uuid.UUID(int=value))
+
+
+def is_compact_id(qr_id):
+    return (
+        isinstance(qr_id, str)
+        and len(qr_id) == COMPACT_ID_LENGTH
+        and all(char in COMPACT_ALPHABET for char in qr_id.upper())
+        and int(qr_id, 36) < 2**128
+    )
+
+
+def resolve_qr_uuid(qr_id):
+    """Map a legacy UUID or a compact ID to the UUID stored in the database"""
+    if is_compact_id(qr_id):
+        return from_compact_id(qr_id)
+    return qr_id
+
+
+def claim_url(qr_id, payload="legacy"):
+    """Return the URL printed in the QR code for ``qr_id``"""
+    if payload == "compact":
+        return COMPACT_CLAIM_URL.format(to_compact_id(qr_id))
+    if payload == "legacy":
+        return CLAIM_URL.format(qr_id)
+    raise ValueError(f"Unknown payload {payload!r}, expected one of {PAYLOADS}")
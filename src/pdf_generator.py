@@ -1,10 +1,268 @@
+import numpy as np
 from fpdf import FPDF
+from PIL import Image
+
+# Bezier control point distance for a quarter circle of radius 1
+BEZIER_ARC = 0.5523
+
+try:
+    from src.pdf_writer import A4_MM, PT_PER_MM, PDFStreamWriter
+except ImportError:
+    from pdf_writer import A4_MM, PT_PER_MM, PDFStreamWriter
 
 
 class PDFGenerator:
     def create_pdf_from_images(self, image_paths, output_path):
+        """Write one page per image; accepts file paths or PIL images"""
         pdf = FPDF()
         for image_path in image_paths:
             pdf.add_page()
             pdf.image(image_path, x=10, y=10, w=190)
         pdf.output(output_path)
+
+    def create_imposed_pdf(
+        self,
+        stickers,
+        output_path,
+        backgrounds=None,
+        columns=2,
+        rows=2,
+        dpi=300,
+        page_size=A4_MM,
+        gutter=4,
+        cut_marks=True,
+    ):
+        """Lay stickers out ``columns`` x ``rows`` per page at print size.
+
+        ``stickers`` yields PIL images or StickerLayers. A layered sticker's
+        background comes from ``backgrounds(background_key)`` and is embedded
+        once for the whole document, each sticker then only adds its patch.
+        Vector StickerLayers draw their QR code as paths over that background,
+        images they refer to are embedded once as well.
+        Pages are streamed to disk as they fill up. Returns the page count.
+        """
+        with PDFStreamWriter(output_path) as writer:
+            imposition = _Imposition(
+                writer, backgrounds, columns, rows, dpi, page_size, gutter, cut_marks
+            )
+            for sticker in stickers:
+                imposition.add(sticker)
+            imposition.flush()
+            return writer.page_count
+
+
+def _fill_color(color):
+    return " ".join(f"{channel / 255:.3f}" for channel in color[:3]) + " rg"
+
+
+def _rounded_rect(box, radius):
+    """Path of a rectangle with circular corners of ``radius``"""
+    x0, y0, x1, y1 = box
+    radius = min(radius, (x1 - x0) / 2, (y1 - y0) / 2)
+    if radius <= 0:
+        return f"{x0:.3f} {y0:.3f} {x1 - x0:.3f} {y1 - y0:.3f} re"
+    r, k = radius, radius * (1 - BEZIER_ARC)
+    points = [
+        ("m", x0 + r, y0),
+        ("l", x1 - r, y0),
+        ("c", x1 - k, y0, x1, y0 + k, x1, y0 + r),
+        ("l", x1, y1 - r),
+        ("c", x1, y1 - k, x1 - k, y1, x1 - r, y1),
+        ("l", x0 + r, y1),
+        ("c", x0 + k, y1, x0, y1 - k, x0, y1 - r),
+        ("l", x0, y0 + r),
+        ("c", x0, y0 + k, x0 + k, y0, x0 + r, y0),
+    ]
+    return (
+        " ".join(
+            " ".join(f"{value:.3f}" for value in point[1:]) + f" {point[0]}"
+            for point in points
+        )
+        + " h"
+    )
+
+
+def _module_runs(matrix):
+    """Rectangles covering the dark modules, one per horizontal run"""
+    matrix = np.asarray(matrix, dtype=bool)
+    padded = np.zeros((matrix.shape[0], matrix.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return " ".join(
+        f"{start} {row} {end - start} 1 re"
+        for row, start, end in zip(rows, starts, ends)
+    )
+
+
+class _Imposition:
+    """Places stickers on the current sheet and writes it once it is full"""
+
+    def __init__(
+        self, writer, backgrounds, columns, rows, dpi, page_size, gutter, cut_marks
+    ):
+        self.writer = writer
+        self.backgrounds = backgrounds
+        self.columns = columns
+        self.rows = rows
+        self.pt_per_px = 72 / dpi
+        self.page_size = page_size
+        self.gutter = gutter * PT_PER_MM
+        self.cut_marks = cut_marks
+        self.sticker_size = None
+        self._background_ids = {}
+        self._image_ids = {}
+        self._content = []
+        self._xobjects = {}
+        self._placed = 0
+
+    def add(self, sticker):
+        background_key = getattr(sticker, "background_key", None)
+        if background_key is not None:
+            background = self.backgrounds(background_key)
+            patch, box = sticker.patch, sticker.box
+        else:
+            background = None
+            patch = getattr(sticker, "patch", sticker)
+            box = (0, 0) + patch.size
+
+        size = background.size if background is not None else patch.size
+        if self.sticker_size is None:
+            self._layout(size)
+        x, y = self._cell_origin(self._placed)
+        width, height = self.sticker_size
+
+        if background is not None:
+            if background_key not in self._background_ids:
+                name = f"B{len(self._background_ids)}"
+                self._background_ids[background_key] = (
+                    name,
+                    self.writer.add_image(background),
+                )
+            name, obj_id = self._background_ids[background_key]
+            self._draw(name, obj_id, x, y, width, height)
+
+        if isinstance(patch, list):
+            self._draw_shapes(patch, x, y + height)
+            self._next_cell()
+            return
+
+        name = f"S{self._placed}"
+        patch_x = x + box[0] * self.pt_per_px
+        patch_y = y + height - box[3] * self.pt_per_px
+        self._draw(
+            name,
+            self.writer.add_image(patch),
+            patch_x,
+            patch_y,
+            (box[2] - box[0]) * self.pt_per_px,
+            (box[3] - box[1]) * self.pt_per_px,
+        )
+        self._next_cell()
+
+    def _next_cell(self):
+        self._placed += 1
+        if self._placed == self.columns * self.rows:
+            self.flush()
+
+    def flush(self):
+        if not self._placed:
+            return
+        if self.cut_marks:
+            self._content.append(self._cut_marks())
+        self.writer.add_page("\n".join(self._content), self._xobjects, self.page_size)
+        self._content = []
+        self._xobjects = {}
+        self._placed = 0
+
+    def _draw(self, name, obj_id, x, y, width, height):
+        self._xobjects[name] = obj_id
+        self._content.append(
+            f"q {width:.3f} 0 0 {height:.3f} {x:.3f} {y:.3f} cm /{name} Do Q"
+        )
+
+    def _draw_shapes(self, shapes, x, top):
+        """Draw VectorShapes given in sticker pixels, y pointing down"""
+        scale = self.pt_per_px
+        ops = [f"q {scale:.5f} 0 0 {-scale:.5f} {x:.3f} {top:.3f} cm"]
+        for shape in shapes:
+            x0, y0, x1, y1 = shape.box
+            if shape.kind == "image":
+                name, obj_id = self._embed_image(shape.fill)
+                self._xobjects[name] = obj_id
+                ops.append(
+                    f"q {x1 - x0:.3f} 0 0 {y0 - y1:.3f} {x0:.3f} {y1:.3f} cm "
+                    f"/{name} Do Q"
+                )
+            elif shape.kind == "modules":
+                matrix = np.asarray(shape.fill, dtype=bool)
+                module = (x1 - x0) / matrix.shape[1]
+                ops.append(
+                    f"q {_rounded_rect(shape.box, shape.radius)} W n 0 g "
+                    f"{module:.5f} 0 0 {module:.5f} {x0:.3f} {y0:.3f} cm "
+                    f"{_module_runs(matrix)} f Q"
+                )
+            else:
+                ops.append(
+                    f"{_fill_color(shape.fill)} "
+                    f"{_rounded_rect(shape.box, shape.radius)} f"
+                )
+        ops.append("Q")
+        self._content.append("\n".join(ops))
+
+    def _embed_image(self, image_path):
+        if image_path not in self._image_ids:
+            with Image.open(image_path) as image:
+                self._image_ids[image_path] = (
+                    f"I{len(self._image_ids)}",
+                    self.writer.add_image(image),
+                )
+        return self._image_ids[image_path]
+
+    def _layout(self, size):
+        width, height = (side * self.pt_per_px for side in size)
+        page_width, page_height = (side * PT_PER_MM for side in self.page_size)
+        grid_width = self.columns * width + (self.columns - 1) * self.gutter
+        grid_height = self.rows * height + (self.rows - 1) * self.gutter
+        if grid_width > page_width or grid_height > page_height:
+            raise ValueError(
+                f"A {self.columns}x{self.rows} grid of {size[0]}x{size[1]}px "
+                f"stickers does not fit on a {self.page_size} mm page"
+            )
+        self.sticker_size = (width, height)
+        self.left = (page_width - grid_width) / 2
+        self.top = (page_height + grid_height) / 2
+        self.bottom = self.top - grid_height
+        self.right = self.left + grid_width
+
+    def _cell_origin(self, index):
+        """Bottom-left corner of cell ``index``, filled row by row from the top"""
+        row, column = divmod(index, self.columns)
+        width, height = self.sticker_size
+        x = self.left + column * (width + self.gutter)
+        y = self.top - (row + 1) * height - row * self.gutter
+        return x, y
+
+    def _cut_marks(self, offset=2 * PT_PER_MM, length=5 * PT_PER_MM):
+        """Marks in the page margin in line with every sticker edge"""
+        width, height = self.sticker_size
+        lines = []
+        for column in range(self.columns):
+            for x in self._edges(self.left, column, width):
+                lines.append((x, self.top + offset, x, self.top + offset + length))
+                lines.append(
+                    (x, self.bottom - offset, x, self.bottom - offset - length)
+                )
+        for row in range(self.rows):
+            for y in self._edges(self.bottom, row, height):
+                lines.append((self.left - offset, y, self.left - offset - length, y))
+                lines.append((self.right + offset, y, self.right + offset + length, y))
+        strokes = " ".join(
+            f"{x1:.3f} {y1:.3f} m {x2:.3f} {y2:.3f} l" for x1, y1, x2, y2 in lines
+        )
+        return f"q 0.25 w 0 G {strokes} S Q"
+
+    def _edges(self, start, index, size):
+        edge = start + index * (size + self.gutter)
+        return (edge, edge + size)
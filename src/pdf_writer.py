@@ -0,0 +1,128 @@
+import array
+import io
+import struct
+import zlib
+
+PT_PER_MM = 72 / 25.4
+A4_MM = (210, 297)
+
+
+def _png_idat(png_bytes):
+    """Concatenate the IDAT payload of a PNG, a zlib stream of PNG-filtered
+    rows that PDF can read directly with /Predictor 15."""
+    data = []
+    offset = 8  # PNG signature
+    while offset < len(png_bytes):
+        length, chunk_type = struct.unpack(">I4s", png_bytes[offset : offset + 8])
+        if chunk_type == b"IDAT":
+            data.append(png_bytes[offset + 8 : offset + 8 + length])
+        offset += 12 + length
+    return b"".join(data)
+
+
+class PDFStreamWriter:
+    """Minimal PDF writer that streams every object to disk as it is added.
+
+    Only object offsets and page references are kept in memory, 8 and 4
+    bytes per object in arrays, so memory use stays flat however many pages
+    are written. Images are embedded as
+    Flate-compressed XObjects that any number of pages can reference.
+    """
+
+    def __init__(self, output_path, compress_level=6):
+        self.compress_level = compress_level
+        self._file = open(output_path, "wb")
+        # Indexed by object number, 1 is the catalog and 2 the page tree
+        self._offsets = array.array("Q", bytes(8 * 3))
+        self._pages = array.array("I")
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    @property
+    def page_count(self):
+        return len(self._pages)
+
+    def write_object(self, body, stream=None, obj_id=None):
+        if obj_id is None:
+            obj_id = len(self._offsets)
+            self._offsets.append(self._file.tell())
+        else:
+            self._offsets[obj_id] = self._file.tell()
+        if stream is None:
+            self._file.write(f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+        else:
+            header = f"{obj_id} 0 obj\n<< {body} /Length {len(stream)} >>\nstream\n"
+            self._file.write(header.encode("latin-1"))
+            self._file.write(stream)
+            self._file.write(b"\nendstream\nendobj\n")
+        return obj_id
+
+    def add_image(self, image):
+        """Embed a PIL image and return its object number.
+
+        Transparency is kept as a soft mask.
+        """
+        smask = ""
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGBA")
+            alpha = image.getchannel("A")
+            if alpha.getextrema() != (255, 255):
+                smask = f" /SMask {self.add_image(alpha)} 0 R"
+            image = image.convert("RGB")
+        colors, color_space = (
+            (3, "DeviceRGB") if image.mode == "RGB" else (1, "DeviceGray")
+        )
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", compress_level=self.compress_level)
+        width, height = image.size
+        return self.write_object(
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /{color_space} /BitsPerComponent 8 /Filter /FlateDecode "
+            f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent 8 "
+            f"/Columns {width} >>{smask}",
+            _png_idat(buffer.getvalue()),
+        )
+
+    def add_page(self, content, xobjects, page_size=A4_MM):
+        """Write a page drawing ``content`` with the named image XObjects"""
+        content_id = self.write_object(
+            "/Filter /FlateDecode", zlib.compress(content.encode("latin-1"))
+        )
+        resources = " ".join(
+            f"/{name} {obj_id} 0 R" for name, obj_id in xobjects.items()
+        )
+        width, height = (side * PT_PER_MM for side in page_size)
+        page_id = self.write_object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.2f} {height:.2f}] "
+            f"/Resources << /XObject << {resources} >> >> /Contents {content_id} 0 R >>"
+        )
+        self._pages.append(page_id)
+        return page_id
+
+    def close(self):
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._pages)
+        self.write_object(
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>", obj_id=2
+        )
+        self.write_object("<< /Type /Catalog /Pages 2 0 R >>", obj_id=1)
+
+        xref_offset = self._file.tell()
+        size = len(self._offsets)
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        xref += [
+            f"{self._offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, size)
+        ]
+        xref.append(
+            f"trailer\n<< /Size {size} /Root 1 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n"
+        )
+        self._file.write("".join(xref).encode("latin-1"))
+        self._file.close()
@@ -0,0 +1,348 @@
+import collections
+import concurrent.futures
+import functools
+import itertools
+import os
+import uuid
+
+from PIL import Image
+
+try:
+    from src.image_encoding import LOSSLESS_PROFILES, encoded_complete
+    from src.image_transport import ImageRing, image_nbytes
+    from src.qr_code_generator import BATCH_EXECUTORS
+    from src.stages import Stage, StagedExecutor
+except ImportError:
+    from image_encoding import LOSSLESS_PROFILES, encoded_complete
+    from image_transport import ImageRing, image_nbytes
+    from qr_code_generator import BATCH_EXECUTORS
+    from stages import Stage, StagedExecutor
+
+# "staged" draws stickers in processes and writes them in threads
+PIPELINE_EXECUTORS = BATCH_EXECUTORS + ("staged",)
+
+# layers is a StickerLayers, compose it with the sticker generator to get
+# the full sticker image
+RenderedSticker = collections.namedtuple(
+    "RenderedSticker", ["index", "qr_uuid", "layers", "qr_path", "sticker_path"]
+)
+
+# A sticker drawn in memory, qr_image is only set when a PNG needs it and
+# the write flags say which PNGs save() still has to write
+DrawnSticker = collections.namedtuple(
+    "DrawnSticker",
+    [
+        "index",
+        "qr_uuid",
+        "layers",
+        "qr_image",
+        "qr_path",
+        "sticker_path",
+        "write_qr",
+        "write_sticker",
+    ],
+)
+
+# Chunks a pooled iter_stickers keeps in flight per worker, so a batch of
+# any size streams through in bounded memory
+PENDING_PER_WORKER = 4
+
+# Threads of the "staged" executor that encode and write PNGs, and the
+# stickers queued in front of each stage
+SAVE_WORKERS = 4
+STAGE_QUEUE_SIZE = 8
+
+# A DrawnSticker whose images wait in an ImageRing slot, its qr_image and
+# raster patch are None until save() maps them back
+ShippedSticker = collections.namedtuple("ShippedSticker", ["drawn", "parcel"])
+
+# Set once per worker process so the generators are not pickled per task
+_worker_pipeline = None
+_worker_ring = None
+
+
+def _init_worker(pipeline, ring=None):
+    global _worker_pipeline, _worker_ring
+    _worker_pipeline = pipeline
+    _worker_ring = ring
+
+
+def _render_in_worker(items):
+    return [_worker_pipeline.render(*item) for item in items]
+
+
+def _draw_in_worker(item):
+    drawn = _worker_pipeline.draw(*item)
+    if _worker_ring is None:
+        return drawn
+    return _ship(drawn, _worker_ring)
+
+
+def _ship(drawn, ring):
+    """Send the images of ``drawn`` through ``ring``, or ``drawn`` itself
+    when they do not fit a slot"""
+    patch = drawn.layers.patch
+    if not isinstance(patch, Image.Image):
+        patch = None
+    parcel = ring.send([drawn.qr_image, patch])
+    if parcel is None:
+        return drawn
+    layers = drawn.layers._replace(patch=None) if patch else drawn.layers
+    return ShippedSticker(drawn._replace(qr_image=None, layers=layers), parcel)
+
+
+def complete_file(path, trailer):
+    """True if ``path`` exists and ends with ``trailer``"""
+    try:
+        with open(path, "rb") as f:
+            if f.seek(0, os.SEEK_END) < len(trailer):
+                return False
+            f.seek(-len(trailer), os.SEEK_END)
+            return f.read() == trailer
+    except FileNotFoundError:
+        return False
+
+
+def _bounded_map(pool, fn, items, chunksize, window):
+    """Like pool.map over chunks of ``items``, but only reads ahead while
+    fewer than ``window`` chunks are pending"""
+    chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.submit(fn, chunk))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+class StickerPipeline:
+    """Render QR codes straight into stickers in memory.
+
+    Intermediate PNGs are only written when ``qr_folder`` or
+    ``sticker_folder`` is set, so a batch can go from QR encoding to PDF
+    pages without any encode/decode round trip. Stickers travel as
+    StickerLayers, only the QR patch differs from sticker to sticker. With
+    ``vector`` set the patch is the QR code as vector shapes and no QR is
+    rasterized unless an intermediate PNG is kept.
+
+    With ``reuse_files`` set, intermediate PNGs that are already complete
+    on disk are kept: a saved QR code is decoded rather than encoded again
+    and a saved sticker is not written again.
+    """
+
+    def __init__(
+        self,
+        qr_generator,
+        sticker_generator,
+        qr_size=700,
+        position=(720, 1200),
+        scale_factor=0.6,
+        qr_folder=None,
+        sticker_folder=None,
+        vector=False,
+        reuse_files=False,
+    ):
+        self.qr_generator = qr_generator
+        self.sticker_generator = sticker_generator
+        self.qr_size = qr_size
+        self.position = position
+        self.scale_factor = scale_factor
+        self.qr_folder = qr_folder
+        self.sticker_folder = sticker_folder
+        self.vector = vector
+        self.reuse_files = reuse_files
+        self._staged = None
+
+    def __getstate__(self):
+        # Worker processes get the pipeline, not the executor feeding them
+        return dict(self.__dict__, _staged=None)
+
+    def paths(self, index, qr_uuid):
+        """Where the intermediate QR and sticker PNGs go, None when not kept"""
+        qr_path = sticker_path = None
+        if self.qr_folder:
+            qr_path = self.qr_generator.qr_path(qr_uuid, self.qr_folder)
+        if self.sticker_folder:
+            sticker_path = os.path.join(
+                self.sticker_folder,
+                f"sticker_{index}{self.sticker_generator.extension}",
+            )
+        return qr_path, sticker_path
+
+    def files_complete(self, index, qr_uuid):
+        """True if every intermediate PNG of the sticker is complete on disk"""
+        return all(
+            encoded_complete(path) for path in self.paths(index, qr_uuid) if path
+        )
+
+    def render(self, index, qr_uuid):
+        return self.save(self.draw(index, qr_uuid))
+
+    def draw(self, index, qr_uuid):
+        """Encode the QR code and lay out the sticker, without writing"""
+        qr_path, sticker_path = self.paths(index, qr_uuid)
+        write_qr = qr_path and not self._reusable(qr_path)
+        write_sticker = sticker_path and not self._reusable(sticker_path)
+
+        qr_image = None
+        # A saved QR is only decoded when it holds the exact pixels
+        lossless = self.qr_generator.encode_profile in LOSSLESS_PROFILES
+        if qr_path and not write_qr and lossless and (write_sticker or not self.vector):
+            with Image.open(qr_path) as saved:
+                qr_image = saved.convert("RGBA")
+        elif write_qr or write_sticker or not self.vector:
+            qr_image = self.qr_generator.generate(qr_uuid, self.qr_size)
+
+        if self.vector:
+            layers = self.sticker_generator.create_vector_layers(
+                self.qr_generator.generate_vector(qr_uuid, self.qr_size),
+                self.position,
+                self.scale_factor,
+            )
+        else:
+            layers = self.sticker_generator.create_layers(
+                qr_image, self.position, self.scale_factor
+            )
+        if not (write_qr or write_sticker):
+            qr_image = None
+        return DrawnSticker(
+            index,
+            qr_uuid,
+            layers,
+            qr_image,
+            qr_path,
+            sticker_path,
+            bool(write_qr),
+            bool(write_sticker),
+        )
+
+    def save(self, drawn):
+        """Write the PNGs a DrawnSticker still needs, return a RenderedSticker"""
+        if drawn.write_qr:
+            self.qr_generator.save_qr(drawn.qr_image, drawn.qr_uuid, self.qr_folder)
+        if drawn.write_sticker:
+            if self.vector:
+                sticker = self.sticker_generator.create_sticker(
+                    drawn.qr_image, self.position, scale_factor=self.scale_factor
+                )
+            else:
+                sticker = self.sticker_generator.compose(drawn.layers)
+            self.sticker_generator.save_sticker(sticker, drawn.sticker_path)
+        return RenderedSticker(
+            drawn.index, drawn.qr_uuid, drawn.layers, drawn.qr_path, drawn.sticker_path
+        )
+
+    def _reusable(self, path):
+        return self.reuse_files and encoded_complete(path)
+
+    def compose(self, rendered):
+        """Return the full sticker image for a raster RenderedSticker"""
+        return self.sticker_generator.compose(rendered.layers)
+
+    def iter_stickers(self, qr_uuids, executor="serial", max_workers=None, chunksize=1):
+        """Yield a RenderedSticker per UUID, in the order of ``qr_uuids``.
+
+        ``qr_uuids`` may be a lazy iterable, pooled executors only read
+        PENDING_PER_WORKER chunks of ``chunksize`` per worker ahead.
+
+        The "staged" executor runs draw() in ``max_workers`` processes and
+        save() in SAVE_WORKERS threads, connected by queues of
+        STAGE_QUEUE_SIZE stickers, so slow writes hold back drawing.
+        """
+        if executor not in PIPELINE_EXECUTORS:
+            raise ValueError(
+                f"Unknown executor {executor!r}, expected one of {PIPELINE_EXECUTORS}"
+            )
+        return self._iter_stickers(
+            enumerate(qr_uuids), executor, max_workers, chunksize
+        )
+
+    def iter_items(self, items, executor="serial", max_workers=None, chunksize=1):
+        """Like iter_stickers for (index, qr_uuid) pairs, so a batch can be
+        rendered with gaps in its numbering"""
+        if executor not in PIPELINE_EXECUTORS:
+            raise ValueError(
+                f"Unknown executor {executor!r}, expected one of {PIPELINE_EXECUTORS}"
+            )
+        return self._iter_stickers(iter(items), executor, max_workers, chunksize)
+
+    def _save_shipped(self, ring, shipped):
+        if isinstance(shipped, DrawnSticker):
+            return self.save(shipped)
+        drawn, parcel = shipped
+        try:
+            qr_image, patch = ring.receive(parcel)
+            layers = drawn.layers
+            if patch is not None:
+                # The patch outlives the slot, it goes on into the PDF
+                layers = layers._replace(
+                    patch=patch.copy() if patch.readonly else patch
+                )
+            rendered = self.save(drawn._replace(qr_image=qr_image, layers=layers))
+        finally:
+            ring.release(parcel.slot)
+        return rendered
+
+    def _slot_size(self):
+        """Bytes of the images draw() hands to save() for one sticker"""
+        qr_image = self.qr_generator.generate(str(uuid.UUID(int=0)), self.qr_size)
+        size = image_nbytes(qr_image.mode, qr_image.size)
+        if not self.vector:
+            patch = self.sticker_generator.create_layers(
+                qr_image, self.position, self.scale_factor
+            ).patch
+            size += image_nbytes(patch.mode, patch.size)
+        return size
+
+    def queue_depths(self):
+        """Stickers queued in front of each stage of the "staged" executor"""
+        return self._staged.queue_depths() if self._staged else {}
+
+    def _iter_stickers(self, items, executor, max_workers, chunksize):
+        if executor == "serial":
+            for item in items:
+                yield self.render(*item)
+            return
+
+        workers = max_workers or os.cpu_count() or 1
+        if executor == "staged":
+            # Images come back from the draw processes through shared
+            # memory, a slot per sticker between drawing and saving
+            ring = ImageRing(
+                workers + STAGE_QUEUE_SIZE + SAVE_WORKERS, self._slot_size()
+            )
+            try:
+                self._staged = StagedExecutor(
+                    [
+                        Stage("draw", _draw_in_worker, workers, "processes"),
+                        Stage(
+                            "save",
+                            functools.partial(self._save_shipped, ring),
+                            SAVE_WORKERS,
+                            "threads",
+                        ),
+                    ],
+                    queue_size=STAGE_QUEUE_SIZE,
+                    initializer=_init_worker,
+                    initargs=(self, ring),
+                )
+                yield from self._staged.map(items)
+            finally:
+                ring.close()
+            return
+        if executor == "processes":
+            pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers, initializer=_init_worker, initargs=(self,)
+            )
+            render = _render_in_worker
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+            def render(chunk):
+                return [self.render(*item) for item in chunk]
+
+        with pool:
+            yield from _bounded_map(
+                pool, render, items, chunksize, workers * PENDING_PER_WORKER
+            )
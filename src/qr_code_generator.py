@@ -1,18 +1,74 @@
 import qrcode
-from PIL import Image, ImageDraw
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps
+import collections
 import concurrent.futures
+import functools
 import os
 import uuid
 
+try:
+    from src.image_encoding import check_profile, extension, save_image
+    from src.payload import PAYLOADS, claim_url
+    from src.qr_encoder import TemplateEncoder
+except ImportError:
+    from image_encoding import check_profile, extension, save_image
+    from payload import PAYLOADS, claim_url
+    from qr_encoder import TemplateEncoder
 
-def _create_rounded_qr(qr_img, corner_radius=20):
-    """Add rounded corners to QR code"""
-    mask = Image.new("L", qr_img.size, 0)
+BATCH_EXECUTORS = ("threads", "processes", "serial")
+RENDERERS = ("matrix", "pil")
+ENCODERS = ("template", "qrcode")
+
+QR_BOX_SIZE = 25
+QR_BORDER = 2
+
+# A QR code as shapes in pixels of its raster rendering, border included.
+# kind is "rect" (fill is a colour), "modules" (fill is the module matrix,
+# clipped to the rounded box) or "image" (fill is an image path).
+VectorShape = collections.namedtuple("VectorShape", ["kind", "box", "radius", "fill"])
+VectorQR = collections.namedtuple("VectorQR", ["size", "shapes"])
+
+_IconLayout = collections.namedtuple("_IconLayout", ["icon_box", "cutout", "frame"])
+
+
+@functools.lru_cache(maxsize=32)
+def _rounded_mask(size, corner_radius):
+    mask = Image.new("L", size, 0)
     draw = ImageDraw.Draw(mask)
-    draw.rounded_rectangle(
-        [0, 0, qr_img.size[0], qr_img.size[1]], radius=corner_radius, fill=255
+    draw.rounded_rectangle([0, 0, size[0], size[1]], radius=corner_radius, fill=255)
+    return mask
+
+
+@functools.lru_cache(maxsize=8)
+def _load_icon(icon_path):
+    return Image.open(icon_path).convert("RGBA")
+
+
+@functools.lru_cache(maxsize=32)
+def _module_lookup(matrix_width, size):
+    """Map every output pixel to its module, exactly as the NEAREST resize
+    of a ``QR_BOX_SIZE`` rendering does."""
+    source_width = matrix_width * QR_BOX_SIZE
+    columns = Image.fromarray(np.arange(source_width, dtype=np.int32)[None, :], "I")
+    columns = columns.resize((size, 1), Image.Resampling.NEAREST)
+    return np.asarray(columns)[0] // QR_BOX_SIZE
+
+
+def _rasterize_matrix(matrix, size, corner_radius):
+    """Render a QR module matrix straight to a rounded RGBA image"""
+    lookup = _module_lookup(len(matrix), size)
+    modules = np.where(matrix, 0, 255).astype(np.uint8)
+    gray = Image.fromarray(modules.take(lookup, 0).take(lookup, 1), "L")
+    return Image.merge(
+        "RGBA", (gray, gray, gray, _rounded_mask((size, size), corner_radius))
     )
 
+
+def _create_rounded_qr(qr_img, corner_radius=20):
+    """Add rounded corners to QR code"""
+    mask = _rounded_mask(qr_img.size, corner_radius)
+
     rounded_qr = Image.new("RGBA", qr_img.size, (255, 255, 255, 0))
     rounded_qr.paste(qr_img, (0, 0))
     rounded_qr.putalpha(mask)
@@ -20,8 +76,38 @@ def _create_rounded_qr(qr_img, corner_radius=20):
     return rounded_qr
 
 
+# Set once per worker process so the generator is not pickled per task
+_worker_generator = None
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _generate_in_worker(qr_id, size, output_folder):
+    return _worker_generator.generate_and_save_qr(qr_id, size, output_folder)
+
+
 class QRCodeGenerator:
-    def __init__(self, style_config=None, icon_path=None):
+    def __init__(
+        self,
+        style_config=None,
+        icon_path=None,
+        renderer="matrix",
+        encoder="template",
+        payload="legacy",
+        encode_profile="default",
+    ):
+        if renderer not in RENDERERS:
+            raise ValueError(
+                f"Unknown renderer {renderer!r}, expected one of {RENDERERS}"
+            )
+        if encoder not in ENCODERS:
+            raise ValueError(f"Unknown encoder {encoder!r}, expected one of {ENCODERS}")
+        if payload not in PAYLOADS:
+            raise ValueError(f"Unknown payload {payload!r}, expected one of {PAYLOADS}")
+        check_profile(encode_profile)
         self.config = {
             "qr_style": "rounded",
             "icon_style": "custom" if icon_path else "modern",
@@ -39,22 +125,30 @@ class QRCodeGenerator:
         if style_config:
             self.config.update(style_config)
         self.icon_path = icon_path
+        self.renderer = renderer
+        # The encoder only applies to the matrix renderer, "pil" always
+        # renders through the qrcode library end to end.
+        self.encoder = encoder
+        self._template_encoder = TemplateEncoder(border=QR_BORDER)
+        # "compact" prints an upper-case alphanumeric URL with a base36 ID,
+        # which fits a smaller QR version than the legacy claim URL.
+        self.payload = payload
+        # How save_qr encodes, see image_encoding.ENCODE_PROFILES
+        self.encode_profile = encode_profile
+        self._render_plans = {}
 
     def generate(self, qr_id, size=300):
         # Initial URL will always be the claim URL
-        qr_data = f"www.sticqr.docpulp.com/claim/{qr_id}"
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_M,
-            box_size=25,
-            border=2,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        qr_img = qr_img.resize((size, size), Image.Resampling.NEAREST)
-        qr_img = _create_rounded_qr(qr_img, self.config["corner_radius"])
+        qr_data = claim_url(qr_id, self.payload)
+        if self.renderer == "matrix":
+            qr_img = _rasterize_matrix(
+                self._encode(qr_data), size, self.config["corner_radius"]
+            )
+        else:
+            qr = self._make_qr(qr_data)
+            qr_img = qr.make_image(fill_color="black", back_color="white")
+            qr_img = qr_img.resize((size, size), Image.Resampling.NEAREST)
+            qr_img = _create_rounded_qr(qr_img, self.config["corner_radius"])
 
         if self.icon_path:
             qr_img = self._add_icon_with_frame(qr_img, size)
@@ -77,17 +171,52 @@ class QRCodeGenerator:
 
         return qr_img
 
+    def _make_qr(self, qr_data):
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            box_size=QR_BOX_SIZE,
+            border=QR_BORDER,
+        )
+        qr.add_data(qr_data)
+        qr.make(fit=True)
+        return qr
+
+    def _encode(self, qr_data):
+        """Return the module matrix for ``qr_data``, border included"""
+        if self.encoder == "template":
+            return self._template_encoder.encode(qr_data)
+        return self._make_qr(qr_data).get_matrix()
+
     def _add_icon_with_frame(self, qr_img, qr_size):
-        icon_size = max(60, qr_size // 7)
-        try:
-            icon = Image.open(self.icon_path)
-            if icon.mode != "RGBA":
-                icon = icon.convert("RGBA")
-            icon = icon.resize((icon_size, icon_size), Image.Resampling.LANCZOS)
-        except Exception as e:
-            print(f"Error loading icon: {e}")
+        overlays = self._get_render_plan(qr_size)
+        if overlays is None:
             return qr_img
 
+        if qr_img.mode != "RGBA":
+            qr_img = qr_img.convert("RGBA")
+        for overlay, position, mask in overlays:
+            qr_img.paste(overlay, position, mask)
+
+        return qr_img
+
+    def _get_render_plan(self, qr_size):
+        """Return the cached icon/cutout/frame overlays for ``qr_size``.
+
+        The overlays only depend on the size and the style config, so they
+        are drawn once and then pasted onto every QR code.
+        """
+        key = (qr_size, repr(sorted(self.config.items())))
+        if key not in self._render_plans:
+            self._render_plans[key] = self._build_render_plan(qr_size)
+        return self._render_plans[key]
+
+    def _icon_layout(self, qr_size):
+        """Icon, cutout and frame boxes centred on a QR code of ``qr_size``.
+
+        Boxes are ``(box, radius)`` pairs, ``frame`` is None when disabled.
+        """
+        icon_size = max(60, qr_size // 7)
         qr_center = qr_size // 2
         frame_width = (
             self.config.get("frame_width", 8)
@@ -102,106 +231,194 @@ class QRCodeGenerator:
             + self.config["cutout_padding"] * 2
         )
 
-        cutout_mask = Image.new("L", qr_img.size, 255)
-        cutout_draw = ImageDraw.Draw(cutout_mask)
+        def centred(box_size, radius):
+            start = qr_center - box_size // 2
+            return (start, start, start + box_size, start + box_size), radius
 
-        cutout_x = qr_center - total_cutout_size // 2
-        cutout_y = qr_center - total_cutout_size // 2
-
-        if self.config["cutout_shape"] == "rounded_square":
-            cutout_radius = total_cutout_size // 6
-            cutout_draw.rounded_rectangle(
-                [
-                    cutout_x,
-                    cutout_y,
-                    cutout_x + total_cutout_size,
-                    cutout_y + total_cutout_size,
-                ],
-                radius=cutout_radius,
-                fill=0,
+        frame = None
+        if self.config.get("frame_enabled", True) and frame_width > 0:
+            frame_outer_size = total_cutout_size - self.config["cutout_padding"] * 2
+            frame_inner_size = frame_outer_size - frame_width * 2
+            frame = (
+                centred(frame_outer_size, frame_outer_size // 8),
+                centred(frame_inner_size, frame_inner_size // 8),
             )
-
-        if qr_img.mode != "RGBA":
-            qr_img = qr_img.convert("RGBA")
-
-        qr_alpha = qr_img.split()[-1]
-        qr_alpha = Image.composite(
-            qr_alpha, Image.new("L", qr_img.size, 0), cutout_mask
+        return _IconLayout(
+            centred(icon_size, 0)[0],
+            centred(total_cutout_size, total_cutout_size // 6),
+            frame,
         )
-        qr_img.putalpha(qr_alpha)
 
-        cutout_bg = Image.new("RGBA", qr_img.size, (0, 0, 0, 0))
+    def _build_render_plan(self, qr_size):
+        canvas_size = (qr_size, qr_size)
+        layout = self._icon_layout(qr_size)
+        icon_size = layout.icon_box[2] - layout.icon_box[0]
+        try:
+            icon = _load_icon(self.icon_path)
+            icon = icon.resize((icon_size, icon_size), Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"Error loading icon: {e}")
+            return None
+
+        cutout_box, cutout_radius = layout.cutout
+        cutout_mask = Image.new("L", canvas_size, 255)
+        cutout_bg = Image.new("RGBA", canvas_size, (0, 0, 0, 0))
         cutout_bg_draw = ImageDraw.Draw(cutout_bg)
 
         if self.config["cutout_shape"] == "rounded_square":
-            cutout_radius = total_cutout_size // 6
+            ImageDraw.Draw(cutout_mask).rounded_rectangle(
+                cutout_box, radius=cutout_radius, fill=0
+            )
             cutout_bg_draw.rounded_rectangle(
-                [
-                    cutout_x,
-                    cutout_y,
-                    cutout_x + total_cutout_size,
-                    cutout_y + total_cutout_size,
-                ],
+                cutout_box,
                 radius=cutout_radius,
                 fill=self.config["cutout_background"],
             )
 
-        if self.config.get("frame_enabled", True) and frame_width > 0:
-            frame_color = self.config.get("frame_color", (40, 40, 40, 255))
-            frame_outer_size = total_cutout_size - self.config["cutout_padding"] * 2
-            frame_inner_size = frame_outer_size - frame_width * 2
-
-            frame_outer_x = qr_center - frame_outer_size // 2
-            frame_outer_y = qr_center - frame_outer_size // 2
-            frame_inner_x = qr_center - frame_inner_size // 2
-            frame_inner_y = qr_center - frame_inner_size // 2
-
-            if self.config["cutout_shape"] == "rounded_square":
-                frame_radius = frame_outer_size // 8
+            if layout.frame:
+                (outer_box, outer_radius), (inner_box, inner_radius) = layout.frame
                 cutout_bg_draw.rounded_rectangle(
-                    [
-                        frame_outer_x,
-                        frame_outer_y,
-                        frame_outer_x + frame_outer_size,
-                        frame_outer_y + frame_outer_size,
-                    ],
-                    radius=frame_radius,
-                    fill=frame_color,
+                    outer_box,
+                    radius=outer_radius,
+                    fill=self.config.get("frame_color", (40, 40, 40, 255)),
                 )
-
-                inner_radius = frame_inner_size // 8
                 cutout_bg_draw.rounded_rectangle(
-                    [
-                        frame_inner_x,
-                        frame_inner_y,
-                        frame_inner_x + frame_inner_size,
-                        frame_inner_y + frame_inner_size,
-                    ],
+                    inner_box,
                     radius=inner_radius,
                     fill=self.config["cutout_background"],
                 )
 
-        final_qr = Image.alpha_composite(cutout_bg, qr_img)
-        icon_pos = (qr_center - icon_size // 2, qr_center - icon_size // 2)
-        final_qr.paste(icon, icon_pos, icon)
+        icon_pos = layout.icon_box[:2]
+        if self.config["cutout_shape"] != "rounded_square":
+            # Nothing is cut out, the icon sits directly on the modules
+            return [(icon, icon_pos, icon)]
+
+        # Inside the cutout the QR is fully transparent, so the composite
+        # there never depends on the modules and can be cut out as a tile.
+        box = (
+            max(cutout_box[0], 0),
+            max(cutout_box[1], 0),
+            min(cutout_box[2] + 1, qr_size),
+            min(cutout_box[3] + 1, qr_size),
+        )
+        tile_mask = ImageOps.invert(cutout_mask.crop(box))
+        if tile_mask.crop(layout.icon_box).getextrema() == (255, 255):
+            cutout_bg.paste(icon, icon_pos, icon)
+            return [(cutout_bg.crop(box), box[:2], tile_mask)]
+        return [(cutout_bg.crop(box), box[:2], tile_mask), (icon, icon_pos, icon)]
+
+    def generate_vector(self, qr_id, size=300):
+        """Describe the QR code ``generate`` draws as a VectorQR.
+
+        Shapes are drawn in order and only the "modules" shape depends on
+        ``qr_id``, so the QR prints sharp at any scale.
+        """
+        matrix = self._encode(claim_url(qr_id, self.payload))
+        border = self.config["border_width"]
+        total = size + border * 2
+        radius = self.config["corner_radius"]
+        qr_box = (border, border, border + size, border + size)
+
+        shapes = []
+        if border > 0:
+            shapes.append(
+                VectorShape(
+                    "rect", (0, 0, total, total), 0, self.config["border_color"]
+                )
+            )
+        shapes.append(VectorShape("rect", qr_box, radius, (255, 255, 255, 255)))
+        shapes.append(VectorShape("modules", qr_box, radius, matrix))
+        if self.icon_path:
+            shapes.extend(self._vector_icon(size, border))
+        return VectorQR((total, total), shapes)
+
+    def _vector_icon(self, qr_size, offset):
+        try:
+            _load_icon(self.icon_path)
+        except Exception as e:
+            print(f"Error loading icon: {e}")
+            return []
 
-        return final_qr
+        def shifted(box):
+            return tuple(value + offset for value in box)
+
+        layout = self._icon_layout(qr_size)
+        shapes = []
+        if self.config["cutout_shape"] == "rounded_square":
+            background = self.config["cutout_background"]
+            cutout_box, cutout_radius = layout.cutout
+            shapes.append(
+                VectorShape("rect", shifted(cutout_box), cutout_radius, background)
+            )
+            if layout.frame:
+                (outer_box, outer_radius), (inner_box, inner_radius) = layout.frame
+                frame_color = self.config.get("frame_color", (40, 40, 40, 255))
+                shapes.append(
+                    VectorShape("rect", shifted(outer_box), outer_radius, frame_color)
+                )
+                shapes.append(
+                    VectorShape("rect", shifted(inner_box), inner_radius, background)
+                )
+        shapes.append(VectorShape("image", shifted(layout.icon_box), 0, self.icon_path))
+        return shapes
 
     def generate_and_save_qr(self, qr_id, size, output_folder):
         qr_image = self.generate(qr_id, size)
-        output_path = os.path.join(output_folder, f"carqr_{qr_id}.png")
-        qr_image.save(output_path, "PNG")
+        return self.save_qr(qr_image, qr_id, output_folder)
+
+    def qr_path(self, qr_id, output_folder):
+        return os.path.join(
+            output_folder, f"carqr_{qr_id}{extension(self.encode_profile)}"
+        )
+
+    def save_qr(self, qr_image, qr_id, output_folder):
+        output_path = self.qr_path(qr_id, output_folder)
+        save_image(qr_image, output_path, self.encode_profile)
         return output_path
 
-    def generate_batch(self, num_qrs, size, output_folder, qr_uuids=None):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            if qr_uuids is None:
-                qr_uuids = [str(uuid.uuid4()) for _ in range(num_qrs)]
-            futures = [
-                executor.submit(self.generate_and_save_qr, qr_uuid, size, output_folder)
-                for qr_uuid in qr_uuids
-            ]
-            image_paths = [
-                future.result() for future in concurrent.futures.as_completed(futures)
-            ]
-        return image_paths
+    def generate_batch(
+        self,
+        num_qrs,
+        size,
+        output_folder,
+        qr_uuids=None,
+        executor="threads",
+        max_workers=None,
+        chunksize=1,
+    ):
+        """Generate and save a batch of QR codes.
+
+        ``executor`` selects how the work is spread: ``"threads"``,
+        ``"processes"`` (scales with cores, rendering holds the GIL) or
+        ``"serial"``. Returned paths follow the order of ``qr_uuids``.
+        """
+        if executor not in BATCH_EXECUTORS:
+            raise ValueError(
+                f"Unknown executor {executor!r}, expected one of {BATCH_EXECUTORS}"
+            )
+        if qr_uuids is None:
+            qr_uuids = [str(uuid.uuid4()) for _ in range(num_qrs)]
+
+        render = functools.partial(
+            self.generate_and_save_qr, size=size, output_folder=output_folder
+        )
+        if self.icon_path:
+            # Build the overlays up front so pool workers receive them ready-made
+            self._get_render_plan(size)
+        if executor == "serial":
+            return [render(qr_uuid) for qr_uuid in qr_uuids]
+
+        if executor == "processes":
+            # Each worker receives the generator and its overlays once
+            pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(self,),
+            )
+            render = functools.partial(
+                _generate_in_worker, size=size, output_folder=output_folder
+            )
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        with pool:
+            return list(pool.map(render, qr_uuids, chunksize=chunksize))
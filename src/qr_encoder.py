@@ -0,0 +1,197 @@
+import collections
+import threading
+
+import numpy as np
+import qrcode
+from numpy.lib.stride_tricks import sliding_window_view
+from qrcode import util
+
+# Payload shapes TemplateEncoder keeps a template for, least recently used
+# ones are dropped first
+TEMPLATE_CACHE_SIZE = 16
+
+# Finder-like 1:1:3:1:1 patterns scored by lost point level 3
+_FINDER_PATTERNS = np.array(
+    [
+        [1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0],
+        [0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1],
+    ],
+    dtype=bool,
+)
+
+
+def _run_penalty(candidates):
+    """Level 1 lost points: runs of five or more modules along the last axis"""
+    count, rows, cols = candidates.shape
+    starts = np.ones((count, rows, cols + 1), dtype=bool)
+    starts[..., 1:-1] = candidates[..., 1:] != candidates[..., :-1]
+
+    # Row ends and the next row's start are adjacent in the flattened view,
+    # which only adds runs of length 1 and never scores.
+    flat = np.flatnonzero(starts)
+    lengths = np.diff(flat)
+    owners = flat[:-1] // (rows * (cols + 1))
+    penalty = np.where(lengths >= 5, lengths - 2, 0)
+    return np.bincount(owners, weights=penalty, minlength=count).astype(np.int64)
+
+
+def _finder_penalty(candidates):
+    """Level 3 lost points: finder-like patterns along the last axis"""
+    windows = sliding_window_view(candidates, 11, axis=2)
+    hits = np.zeros(windows.shape[:3], dtype=bool)
+    for pattern in _FINDER_PATTERNS:
+        hits |= (windows == pattern).all(axis=-1)
+    return hits.sum(axis=(1, 2)) * 40
+
+
+def lost_points(candidates):
+    """Score a stack of module grids exactly like ``qrcode.util.lost_point``"""
+    columns = candidates.transpose(0, 2, 1)
+    points = _run_penalty(candidates) + _run_penalty(columns)
+
+    top_left = candidates[:, :-1, :-1]
+    blocks = (
+        (top_left == candidates[:, 1:, :-1])
+        & (top_left == candidates[:, :-1, 1:])
+        & (top_left == candidates[:, 1:, 1:])
+    )
+    points += blocks.sum(axis=(1, 2)) * 3
+
+    points += _finder_penalty(candidates) + _finder_penalty(columns)
+
+    modules_count = candidates.shape[1]
+    for i, dark_count in enumerate(candidates.sum(axis=(1, 2)).tolist()):
+        percent = float(dark_count) / (modules_count**2)
+        points[i] += int(abs(percent * 100 - 50) / 5) * 10
+    return points
+
+
+class _Template:
+    """Everything about a code that only depends on the payload's shape"""
+
+    def __init__(self, data, error_correction):
+        qr = qrcode.QRCode(version=1, error_correction=error_correction, border=0)
+        qr.add_data(data)
+        self.version = qr.best_fit(start=qr.version)
+
+        qr.modules_count = modules_count = self.version * 4 + 17
+        qr.modules = [[None] * modules_count for _ in range(modules_count)]
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(modules_count - 7, 0)
+        qr.setup_position_probe_pattern(0, modules_count - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+        blank = qr.modules
+
+        # Mask scoring runs with blank format information, the final code
+        # carries the real format bits for the chosen mask.
+        self.test_grid = self._with_format_info(qr, blank, True, 0)
+        self.final_grids = [
+            self._with_format_info(qr, blank, False, mask_pattern)
+            for mask_pattern in range(8)
+        ]
+
+        positions = self._data_positions(qr.modules)
+        self.rows = np.array([row for row, _ in positions], dtype=np.intp)
+        self.cols = np.array([col for _, col in positions], dtype=np.intp)
+        self.masks = np.array(
+            [
+                [util.mask_func(mask_pattern)(row, col) for row, col in positions]
+                for mask_pattern in range(8)
+            ],
+            dtype=bool,
+        )
+
+    @staticmethod
+    def _with_format_info(qr, blank, test, mask_pattern):
+        qr.modules = [row[:] for row in blank]
+        qr.setup_type_info(test, mask_pattern)
+        if qr.version >= 7:
+            qr.setup_type_number(test)
+        return np.array([[bool(module) for module in row] for row in qr.modules])
+
+    @staticmethod
+    def _data_positions(modules):
+        """Free modules in the order ``QRCode.map_data`` fills them"""
+        modules_count = len(modules)
+        positions = []
+        inc = -1
+        row = modules_count - 1
+        for col in range(modules_count - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            while True:
+                for c in (col, col - 1):
+                    if modules[row][c] is None:
+                        positions.append((row, c))
+                row += inc
+                if row < 0 or modules_count <= row:
+                    row -= inc
+                    inc = -inc
+                    break
+        return positions
+
+
+class TemplateEncoder:
+    """Encode QR codes against templates cached per payload shape.
+
+    A payload's shape is how ``qrcode`` splits it into data modes. Claim
+    URLs nearly always share one shape, so the version, function patterns
+    and data placement order are worked out once; each code then only
+    places its data bits and scores the eight masks. The module matrix is
+    identical to ``QRCode.make(fit=True)`` followed by ``get_matrix()``.
+    At most ``cache_size`` templates are kept.
+    """
+
+    def __init__(
+        self,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        border=2,
+        cache_size=TEMPLATE_CACHE_SIZE,
+    ):
+        self.error_correction = error_correction
+        self.border = border
+        self.cache_size = cache_size
+        self._templates = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Worker processes get the templates, each its own lock
+        return dict(self.__dict__, _lock=None)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _lock=threading.Lock())
+
+    def template_for(self, data):
+        chunks = list(util.optimal_data_chunks(data, minimum=20))
+        shape = tuple((chunk.mode, len(chunk)) for chunk in chunks)
+        with self._lock:
+            template = self._templates.get(shape)
+            if template is not None:
+                self._templates.move_to_end(shape)
+                return template, chunks
+        # Built without the lock, a race only builds the same template twice
+        template = _Template(data, self.error_correction)
+        with self._lock:
+            self._templates[shape] = template
+            if len(self._templates) > self.cache_size:
+                self._templates.popitem(last=False)
+        return template, chunks
+
+    def encode(self, data):
+        """Return the module matrix for ``data`` as a bool array with border"""
+        template, chunks = self.template_for(data)
+        codewords = util.create_data(template.version, self.error_correction, chunks)
+
+        bits = np.zeros(len(template.rows), dtype=bool)
+        data_bits = np.unpackbits(np.asarray(codewords, dtype=np.uint8))
+        bits[: len(data_bits)] = data_bits[: len(bits)]
+        masked = bits ^ template.masks
+
+        candidates = np.repeat(template.test_grid[None], 8, axis=0)
+        candidates[:, template.rows, template.cols] = masked
+        best = int(np.argmin(lost_points(candidates)))
+
+        matrix = template.final_grids[best].copy()
+        matrix[template.rows, template.cols] = masked[best]
+        return np.pad(matrix, self.border)
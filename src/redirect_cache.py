@@ -0,0 +1,72 @@
+import collections
+import threading
+import time
+
+# Returned by RedirectCache.get when nothing usable is cached; None is a
+# valid cached answer for QR codes that do not exist.
+MISSING = object()
+
+
+class RedirectCache:
+    """Bounded LRU cache of redirect lookups whose entries expire after ``ttl``.
+
+    invalidate() must be called whenever a stored answer can change. A
+    lookup that started before an invalidation never stores its result, so
+    a claim racing with a scan cannot leave the old URL behind.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for ``key``, or MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+    def put(self, key, value, generation):
+        """Store ``value`` unless anything was invalidated since ``generation``"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
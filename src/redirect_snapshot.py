@@ -0,0 +1,345 @@
+import argparse
+import array
+import io
+import mmap
+import os
+import re
+import struct
+
+try:
+    from src.database import Database, encode_uuid, redirect_url_for
+    from src.payload import CLAIM_URL, CONTACT_URL, resolve_qr_uuid
+    from src.sharded_database import ShardedDatabase
+except ImportError:
+    from database import Database, encode_uuid, redirect_url_for
+    from payload import CLAIM_URL, CONTACT_URL, resolve_qr_uuid
+    from sharded_database import ShardedDatabase
+
+_MAGIC = b"QRRS"
+# magic, format version, prefix bits, record count, watermark count and
+# offset, offset of the URL table. The watermarks, a qr_codes and a claims
+# id per database or shard, end the file. Version 1 held the one pair in
+# place of the count and offset.
+_HEADER = struct.Struct("<4sHHQQQQ")
+_FORMAT_VERSION = 2
+# UUID bytes, state, padding, offset of the URL in the URL table. The UUID
+# bytes compare as two big-endian integers, in the order records are sorted.
+_RECORD = struct.Struct("<16sB3xI")
+_KEY = struct.Struct(">QQ")
+_STATE = struct.Struct("<B3xI")
+_URL_LENGTH = struct.Struct("<H")
+# The records are followed by the index of the first record of every UUID
+# prefix, so a lookup only searches the few records sharing its prefix.
+# Prefixes get about PREFIX_RECORDS records each, up to MAX_PREFIX_BITS bits.
+_BUCKET = struct.Struct("<II")
+PREFIX_RECORDS = 4
+MAX_PREFIX_BITS = 20
+_CANONICAL_UUID = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+)
+
+# Record states, the first two URLs are derived from the UUID so only
+# custom redirect URLs take space in the URL table
+UNCLAIMED, CONTACT, CUSTOM = range(3)
+
+# A delta is a log of "<qr_uuid>\t<redirect url>" lines, each group of
+# changes ends with a "#\t<qr_codes id>\t<claims id>" watermark line, with a
+# pair of ids per shard for a ShardedDatabase. Readers apply a group only
+# once its watermark line is complete.
+_WATERMARK_LINE = re.compile(rb"(?:^|(?<=\n))#((?:\t\d+)+)\n")
+_DELTA_BLOCK = 64 * 1024
+
+
+def _watermark_line(watermarks):
+    return ("#" + "".join(f"\t{value}" for value in watermarks) + "\n").encode()
+
+
+def write_snapshot(db, path, delta_path=None):
+    """Write the redirect of every code in ``db``, a Database or
+    ShardedDatabase, to the snapshot ``path``.
+
+    The file is replaced atomically. With ``delta_path`` a new, empty delta
+    starting at this snapshot replaces that file too. Only canonical UUIDs
+    fit the fixed-width records, other IDs are left out. Returns the number
+    of codes written and skipped.
+    """
+    # Taken before the rows, anything that changes while they stream is in
+    # the first delta as well
+    watermarks = db.redirect_watermarks()
+    urls = io.BytesIO()
+    # First record of every MAX_PREFIX_BITS prefix, thinned out at the end
+    starts = array.array("I", bytes(4 * ((1 << MAX_PREFIX_BITS) + 1)))
+    next_prefix = 0
+    count = skipped = 0
+    previous = b""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(_HEADER.size))
+        for qr_uuid, claimed, redirect_url in db.iter_redirects():
+            key = encode_uuid(qr_uuid)
+            if not isinstance(key, bytes):
+                skipped += 1
+                continue
+            if key <= previous:
+                raise ValueError(f"{qr_uuid} is out of key order")
+            previous = key
+            prefix = int.from_bytes(key[:3], "big") >> (24 - MAX_PREFIX_BITS)
+            while next_prefix <= prefix:
+                starts[next_prefix] = count
+                next_prefix += 1
+
+            url = redirect_url_for(qr_uuid, claimed, redirect_url)
+            state, offset = CUSTOM, 0
+            if url == CLAIM_URL.format(qr_uuid):
+                state = UNCLAIMED
+            elif url == CONTACT_URL.format(qr_uuid):
+                state = CONTACT
+            else:
+                offset = urls.tell()
+                encoded = url.encode()
+                urls.write(_URL_LENGTH.pack(len(encoded)) + encoded)
+            f.write(_RECORD.pack(key, state, offset))
+            count += 1
+
+        starts[next_prefix:] = array.array("I", [count]) * (len(starts) - next_prefix)
+        prefix_bits = min(MAX_PREFIX_BITS, (count // PREFIX_RECORDS).bit_length())
+        buckets = starts[:: 1 << (MAX_PREFIX_BITS - prefix_bits)]
+        f.write(struct.pack(f"<{len(buckets)}I", *buckets))
+        url_offset = f.tell()
+        f.write(urls.getbuffer())
+        watermarks_offset = f.tell()
+        f.write(struct.pack(f"<{len(watermarks)}Q", *watermarks))
+        f.seek(0)
+        f.write(
+            _HEADER.pack(
+                _MAGIC,
+                _FORMAT_VERSION,
+                prefix_bits,
+                count,
+                len(watermarks),
+                watermarks_offset,
+                url_offset,
+            )
+        )
+    os.replace(tmp_path, path)
+
+    if delta_path:
+        with open(f"{delta_path}.tmp", "wb") as f:
+            f.write(_watermark_line(watermarks))
+        os.replace(f"{delta_path}.tmp", delta_path)
+    return count, skipped
+
+
+def _last_watermark(f):
+    """End offset and watermarks of the last complete watermark line"""
+    position = f.seek(0, os.SEEK_END)
+    tail = b""
+    while position > 0:
+        start = max(0, position - _DELTA_BLOCK)
+        f.seek(start)
+        tail = f.read(position - start) + tail
+        position = start
+        matches = list(_WATERMARK_LINE.finditer(tail))
+        # A match at the start of the block may begin mid-line
+        if matches and (position == 0 or matches[-1].start() > 0):
+            match = matches[-1]
+            watermarks = tuple(int(value) for value in match[1].split(b"\t")[1:])
+            return position + match.end(), watermarks
+    raise ValueError(f"{f.name} has no watermark, it is not a delta")
+
+
+def append_delta(db, delta_path):
+    """Append the codes inserted or claimed in ``db`` since the last
+    watermark of ``delta_path`` and return how many were written.
+
+    A group left incomplete by an interrupted append is discarded first,
+    its changes are written again.
+    """
+    with open(delta_path, "r+b") as f:
+        end, watermarks = _last_watermark(f)
+        f.truncate(end)
+        watermarks, rows = db.redirect_changes(*watermarks)
+        lines = [
+            f"{qr_uuid}\t{redirect_url_for(qr_uuid, claimed, url)}\n".encode()
+            for qr_uuid, claimed, url in rows
+        ]
+        f.seek(end)
+        f.write(b"".join(lines) + _watermark_line(watermarks))
+    return len(lines)
+
+
+class RedirectSnapshot:
+    """Redirect lookups from a snapshot file, without SQLite.
+
+    The file is memory-mapped and binary-searched in place, a lookup only
+    unpacks the records it probes. It answers like
+    Database.get_redirect_url for codes with a canonical UUID. Changes
+    appended to ``delta_path`` are kept in a dict on top of the snapshot,
+    refresh() applies the ones appended since the last call.
+    """
+
+    def __init__(self, path, delta_path=None):
+        self.path = path
+        self.delta_path = delta_path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not a redirect snapshot")
+        header = _HEADER.unpack_from(self._mmap)
+        magic, version, prefix_bits, count, *watermarks, url_offset = header
+        if magic != _MAGIC or version not in (1, _FORMAT_VERSION):
+            self.close()
+            raise ValueError(f"{path} is not a redirect snapshot")
+        buckets_offset = _HEADER.size + count * _RECORD.size
+        buckets_end = buckets_offset + 4 * ((1 << prefix_bits) + 1)
+        if version > 1:
+            watermark_count, watermarks_offset = watermarks
+            watermarks_end = watermarks_offset + 8 * watermark_count
+            if watermarks_offset < url_offset or watermarks_end != len(self._mmap):
+                self.close()
+                raise ValueError(f"{path} is truncated")
+        if url_offset != buckets_end or url_offset > len(self._mmap):
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        if version > 1:
+            watermarks = struct.unpack_from(
+                f"<{watermark_count}Q", self._mmap, watermarks_offset
+            )
+        self.count = count
+        self._prefix_shift = 64 - prefix_bits
+        self._buckets_offset = buckets_offset
+        self.watermarks = self.snapshot_watermarks = tuple(watermarks)
+        self._url_offset = url_offset
+        self._delta = {}
+        self._delta_offset = 0
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._mmap.close()
+
+    def refresh(self):
+        """Apply the complete delta groups appended since the last refresh.
+
+        Returns the number of changes applied.
+        """
+        if self.delta_path is None:
+            return 0
+        with open(self.delta_path, "rb") as f:
+            f.seek(self._delta_offset)
+            data = f.read()
+
+        applied = 0
+        pending = {}
+        position = committed = 0
+        while True:
+            end = data.find(b"\n", position)
+            if end < 0:
+                break
+            line = data[position:end].decode()
+            position = end + 1
+            if not line.startswith("#\t"):
+                qr_uuid, url = line.split("\t", 1)
+                pending[qr_uuid] = url
+                continue
+
+            watermarks = tuple(int(value) for value in line.split("\t")[1:])
+            first = self._delta_offset == committed == 0
+            if first and watermarks != self.snapshot_watermarks:
+                raise ValueError(
+                    f"{self.delta_path} does not start at the snapshot {self.path}"
+                )
+            self._delta.update(pending)
+            applied += len(pending)
+            pending = {}
+            committed = position
+            self.watermarks = watermarks
+        self._delta_offset += committed
+        return applied
+
+    def get_redirect_url(self, qr_uuid):
+        """The redirect URL of a code, None for codes the snapshot lacks.
+
+        Accepts the legacy UUID as well as the compact base36 ID.
+        """
+        qr_uuid = resolve_qr_uuid(qr_uuid)
+        url = self._delta.get(qr_uuid)
+        if url is not None:
+            return url
+        if not _CANONICAL_UUID.fullmatch(qr_uuid):
+            return None
+
+        target = _KEY.unpack(bytes.fromhex(qr_uuid.replace("-", "")))
+        snapshot = self._mmap
+        low, high = _BUCKET.unpack_from(
+            snapshot, self._buckets_offset + 4 * (target[0] >> self._prefix_shift)
+        )
+        while low < high:
+            middle = (low + high) // 2
+            offset = _HEADER.size + middle * _RECORD.size
+            probe = _KEY.unpack_from(snapshot, offset)
+            if probe < target:
+                low = middle + 1
+            elif probe > target:
+                high = middle
+            else:
+                return self._url(qr_uuid, offset)
+        return None
+
+    def _url(self, qr_uuid, offset):
+        state, url_offset = _STATE.unpack_from(self._mmap, offset + 16)
+        if state == UNCLAIMED:
+            return CLAIM_URL.format(qr_uuid)
+        if state == CONTACT:
+            return CONTACT_URL.format(qr_uuid)
+        offset = self._url_offset + url_offset
+        (length,) = _URL_LENGTH.unpack_from(self._mmap, offset)
+        offset += _URL_LENGTH.size
+        return self._mmap[offset : offset + length].decode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a redirect snapshot, or append to its delta"
+    )
+    parser.add_argument("db_path")
+    parser.add_argument(
+        "--shards", type=int, help="open db_path as a ShardedDatabase of this many"
+    )
+    parser.add_argument("snapshot", nargs="?", help="snapshot file to write")
+    parser.add_argument("--delta", help="delta file started with the snapshot")
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="append the changes since the last append to --delta instead",
+    )
+    args = parser.parse_args(argv)
+    if args.append and not args.delta:
+        parser.error("--append needs --delta")
+    if not args.append and not args.snapshot:
+        parser.error("a snapshot file is needed unless --append is given")
+
+    if args.shards:
+        db = ShardedDatabase(args.db_path, args.shards)
+    else:
+        db = Database(args.db_path)
+    with db:
+        if args.append:
+            count = append_delta(db, args.delta)
+            print(f"{args.delta}: appended {count} changes")
+            return
+        count, skipped = write_snapshot(db, args.snapshot, args.delta)
+        print(f"{args.snapshot}: {count} codes, {skipped} non-UUID IDs skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import threading
+import time
+
+
+class ScanLog:
+    """Write-behind buffer of scan events.
+
+    record() only appends to an in-memory buffer. A background thread hands
+    the buffered events to ``write`` in one call once ``flush_size`` of them
+    are waiting, and at least every ``flush_interval`` seconds otherwise.
+    When ``max_buffer`` events are waiting, for example while writes are
+    stuck behind a lock, new events are dropped and counted so a scan never
+    waits for the database. Events of a failed write go back in the buffer.
+    """
+
+    def __init__(
+        self,
+        write,
+        flush_size=500,
+        flush_interval=1.0,
+        max_buffer=100000,
+        clock=time.time,
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.clock = clock
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_error = None
+        self._write = write
+        self._buffer = []
+        self._closed = False
+        self._condition = threading.Condition()
+        # Keeps flushes in order, so events are written in the order recorded
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="scan-log", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, qr_uuid, outcome, scanned_at=None):
+        """Buffer a scan event, False if it was dropped"""
+        event = (qr_uuid, outcome, self.clock() if scanned_at is None else scanned_at)
+        with self._condition:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self._buffer.append(event)
+            self.recorded += 1
+            if len(self._buffer) >= self.flush_size:
+                self._condition.notify()
+        return True
+
+    def flush(self):
+        """Write every buffered event now and return how many were written"""
+        with self._flush_lock:
+            with self._condition:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+            try:
+                self._write(events)
+            except Exception:
+                with self._condition:
+                    self.failed_flushes += 1
+                    room = max(self.max_buffer - len(self._buffer), 0)
+                    self.dropped += max(len(events) - room, 0)
+                    self._buffer[:0] = events[:room]
+                raise
+            with self._condition:
+                self.flushed += len(events)
+                self.flushes += 1
+            return len(events)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self.flush_size,
+                    timeout=self.flush_interval,
+                )
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception as e:
+                self.last_error = e
+            if closed:
+                return
+
+    def close(self):
+        """Stop the flush thread after a last flush"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "depth": len(self._buffer),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
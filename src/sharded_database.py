@@ -0,0 +1,236 @@
+import heapq
+import itertools
+import os
+import uuid
+import zlib
+
+try:
+    from src.database import QR_CODE_COLUMNS, Database, export_rows
+    from src.payload import resolve_qr_uuid
+except ImportError:
+    from database import QR_CODE_COLUMNS, Database, export_rows
+    from payload import resolve_qr_uuid
+
+# Characters of the UUID that pick its shard
+SHARD_PREFIX_LENGTH = 8
+
+
+def shard_paths(db_path, shards):
+    """File names of the shards, they include the shard count so a database
+    is never reopened with a different routing."""
+    base, ext = os.path.splitext(db_path)
+    return [f"{base}.shard{i:02d}of{shards:02d}{ext or '.db'}" for i in range(shards)]
+
+
+class ShardedDatabase:
+    """The Database interface over ``shards`` SQLite files.
+
+    QR codes and their claims live in the shard picked by the UUID prefix,
+    so writers to different shards never wait for each other. Lookups by
+    UUID go to one shard, batch queries fan out to all of them. Batch jobs
+    and their items live in the first shard. Row ids are per shard, so the
+    redirect watermarks are a qr_codes and claims id pair per shard. Extra
+    keyword arguments are passed to every shard's Database.
+    """
+
+    def __init__(self, db_path="car_qr.db", shards=4, **kwargs):
+        self.db_path = db_path
+        self.shards = [
+            Database(path, **kwargs) for path in shard_paths(db_path, shards)
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def shard_index(self, qr_uuid):
+        prefix = resolve_qr_uuid(qr_uuid)[:SHARD_PREFIX_LENGTH]
+        return zlib.crc32(prefix.encode()) % len(self.shards)
+
+    def shard_for(self, qr_uuid):
+        return self.shards[self.shard_index(qr_uuid)]
+
+    def initialize_db(self):
+        for shard in self.shards:
+            shard.initialize_db()
+
+    def schema_version(self):
+        return min(shard.schema_version() for shard in self.shards)
+
+    def migrate(self, target=None):
+        """Migrate every shard, returns the lowest version reached"""
+        return min(shard.migrate(target) for shard in self.shards)
+
+    def convert_uuid_format(self, uuid_format):
+        for shard in self.shards:
+            shard.convert_uuid_format(uuid_format)
+
+    def query_plans(self):
+        """The query plans of the first shard, they all share its schema"""
+        return self.shards[0].query_plans()
+
+    def create_qr_record(
+        self, batch_id=None, file_path=None, sticker_path=None, qr_uuid=None
+    ):
+        """Create a new QR code record"""
+        if qr_uuid is None:
+            qr_uuid = str(uuid.uuid4())
+        return self.shard_for(qr_uuid).create_qr_record(
+            batch_id, file_path, sticker_path, qr_uuid
+        )
+
+    def create_qr_records(self, rows, chunk_size=500):
+        """Insert many QR code records, each chunk split across the shards.
+
+        Returns the number of records inserted and the colliding UUIDs.
+        """
+        rows = iter(rows)
+        inserted = 0
+        collisions = []
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return inserted, collisions
+            by_shard = [[] for _ in self.shards]
+            for row in chunk:
+                if not row.get("qr_uuid"):
+                    row = dict(row, qr_uuid=str(uuid.uuid4()))
+                by_shard[self.shard_index(row["qr_uuid"])].append(row)
+            for shard, shard_rows in zip(self.shards, by_shard):
+                if shard_rows:
+                    count, shard_collisions = shard.create_qr_records(
+                        shard_rows, chunk_size
+                    )
+                    inserted += count
+                    collisions.extend(shard_collisions)
+
+    def get_qr_details(self, qr_uuid):
+        return self.shard_for(qr_uuid).get_qr_details(qr_uuid)
+
+    def claim_qr(self, qr_uuid, user_phone, masked_number):
+        return self.shard_for(qr_uuid).claim_qr(qr_uuid, user_phone, masked_number)
+
+    def get_redirect_url(self, qr_uuid):
+        return self.shard_for(qr_uuid).get_redirect_url(qr_uuid)
+
+    def get_claim(self, qr_uuid):
+        return self.shard_for(qr_uuid).get_claim(qr_uuid)
+
+    def batch_scan_counts(self, batch_id=None):
+        """Scans per batch summed over the shards, a code is only ever in
+        one shard so codes scanned add up as well"""
+        totals = {}
+        for shard in self.shards:
+            for batch, scans, codes in shard.batch_scan_counts(batch_id):
+                previous_scans, previous_codes = totals.get(batch, (0, 0))
+                totals[batch] = (previous_scans + scans, previous_codes + codes)
+        return [
+            (batch,) + totals[batch]
+            for batch in sorted(totals, key=lambda batch: (batch is not None, batch))
+        ]
+
+    @property
+    def _jobs(self):
+        return self.shards[0]
+
+    def create_batch_job(self, batch_id, options, pdf_path=None):
+        return self._jobs.create_batch_job(batch_id, options, pdf_path)
+
+    def get_batch_job(self, batch_id):
+        return self._jobs.get_batch_job(batch_id)
+
+    def add_batch_job_items(self, batch_id, items):
+        return self._jobs.add_batch_job_items(batch_id, items)
+
+    def iter_batch_job_items(self, batch_id, page_size=1000):
+        return self._jobs.iter_batch_job_items(batch_id, page_size)
+
+    def mark_batch_job_items_stored(self, batch_id, indexes):
+        return self._jobs.mark_batch_job_items_stored(batch_id, indexes)
+
+    def finish_batch_job(self, batch_id, pdf_path):
+        return self._jobs.finish_batch_job(batch_id, pdf_path)
+
+    def get_batch_qrs(self, batch_id):
+        """Get all QR codes in a batch, shard by shard"""
+        return [row for shard in self.shards for row in shard.get_batch_qrs(batch_id)]
+
+    def iter_batch_qrs(self, batch_id, columns=None, page_size=1000):
+        """Stream a batch shard by shard, each in id order"""
+        for shard in self.shards:
+            yield from shard.iter_batch_qrs(batch_id, columns, page_size)
+
+    def export_batch(self, batch_id, output, export_format="csv", columns=None):
+        columns = tuple(columns or QR_CODE_COLUMNS)
+        return export_rows(
+            self.iter_batch_qrs(batch_id, columns), columns, output, export_format
+        )
+
+    def iter_redirects(self, page_size=1000):
+        """Yield (qr_uuid, claimed, redirect_url) for every code, the shards
+        merged in key order"""
+
+        def sort_key(row):
+            key = self.shards[0]._key(row[0])
+            # SQLite sorts text keys before blobs
+            return isinstance(key, bytes), key
+
+        return heapq.merge(
+            *(shard.iter_redirects(page_size) for shard in self.shards), key=sort_key
+        )
+
+    def redirect_watermarks(self):
+        """The qr_codes and claims id pair of every shard, in shard order"""
+        return tuple(
+            itertools.chain.from_iterable(
+                shard.redirect_watermarks() for shard in self.shards
+            )
+        )
+
+    def redirect_changes(self, *watermarks):
+        """The redirect_changes() of every shard since ``watermarks``, as
+        returned by redirect_watermarks()"""
+        if len(watermarks) != 2 * len(self.shards):
+            raise ValueError(
+                f"Expected a pair of watermarks for each of {len(self.shards)} "
+                f"shards, got {len(watermarks)} watermarks"
+            )
+        new_watermarks = []
+        rows = []
+        for i, shard in enumerate(self.shards):
+            shard_watermarks, shard_rows = shard.redirect_changes(
+                *watermarks[2 * i : 2 * i + 2]
+            )
+            new_watermarks.extend(shard_watermarks)
+            rows.extend(shard_rows)
+        return tuple(new_watermarks), rows
+
+    def sync_uuid_filter(self):
+        for shard in self.shards:
+            shard.sync_uuid_filter()
+
+    def enable_uuid_filter(self, path=None, capacity=None, error_rate=0.001):
+        """Give every shard its own filter, saved next to ``path``"""
+        for i, shard in enumerate(self.shards):
+            shard.enable_uuid_filter(
+                path and f"{path}.{i}",
+                capacity and -(-capacity // len(self.shards)),
+                error_rate,
+            )
+
+    def save_uuid_filter(self, path):
+        for i, shard in enumerate(self.shards):
+            shard.save_uuid_filter(f"{path}.{i}")
+
+    def enable_scan_log(self, flush_size=500, flush_interval=1.0, max_buffer=100000):
+        """Give every shard its own scan log"""
+        return [
+            shard.enable_scan_log(flush_size, flush_interval, max_buffer)
+            for shard in self.shards
+        ]
@@ -0,0 +1,198 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+
+STAGE_EXECUTORS = ("threads", "processes")
+
+# A stage of a StagedExecutor. ``fn`` takes one item and returns the item
+# for the next stage; ``workers`` run it at once, in threads or processes.
+Stage = collections.namedtuple("Stage", ["name", "fn", "workers", "executor"])
+
+# Seconds a blocked worker waits before checking whether the run was closed
+_POLL = 0.1
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class StagedExecutor:
+    """Run items through a chain of stages, each with its own worker pool.
+
+    Stages are connected by queues of ``queue_size`` items, so a slow stage
+    fills its input queue and blocks the stages before it rather than
+    letting work pile up in memory. map() only reads ahead while the first
+    queue has room and fewer than ``window`` items are in flight, so a
+    slow caller throttles the stages too, and yields results in input
+    order. Process stages call
+    ``initializer(*initargs)`` once per worker process, their ``fn`` and
+    items must pickle.
+    """
+
+    def __init__(self, stages, queue_size=8, initializer=None, initargs=()):
+        for stage in stages:
+            if stage.executor not in STAGE_EXECUTORS:
+                raise ValueError(
+                    f"Unknown executor {stage.executor!r} for stage {stage.name!r}, "
+                    f"expected one of {STAGE_EXECUTORS}"
+                )
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.initializer = initializer
+        self.initargs = initargs
+        # Every queue full, every worker busy and as much waiting to be
+        # taken by the caller
+        self.window = queue_size * (len(self.stages) + 1) + sum(
+            stage.workers for stage in self.stages
+        )
+        self._queues = []
+        self._max_depths = {}
+        self._processed = {}
+        self._lock = threading.Lock()
+
+    def queue_depths(self):
+        """Items waiting in front of every stage, and in front of the caller"""
+        names = [stage.name for stage in self.stages] + ["output"]
+        return {name: q.qsize() for name, q in zip(names, self._queues)}
+
+    def stats(self):
+        depths = self.queue_depths()
+        return {
+            name: {
+                "depth": depth,
+                "max_depth": self._max_depths.get(name, 0),
+                "processed": self._processed.get(name, 0),
+            }
+            for name, depth in depths.items()
+        }
+
+    def map(self, items):
+        """Yield ``items`` run through every stage, in the order given"""
+        self._queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        # The caller drains the output queue, it never needs to block on it
+        self._queues.append(queue.Queue())
+        self._max_depths = {}
+        self._processed = {}
+        closed = threading.Event()
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        pools, threads = [], []
+        try:
+            for i, stage in enumerate(self.stages):
+                pool = None
+                if stage.executor == "processes":
+                    pool = concurrent.futures.ProcessPoolExecutor(
+                        stage.workers,
+                        initializer=self.initializer,
+                        initargs=self.initargs,
+                    )
+                    pools.append(pool)
+                for _ in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self._work,
+                        args=(stage, pool, i, remaining, closed),
+                        name=f"stage-{stage.name}",
+                        daemon=True,
+                    )
+                    thread.start()
+                    threads.append(thread)
+            yield from self._feed_and_collect(iter(items))
+        finally:
+            closed.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                pool.shutdown(cancel_futures=True)
+
+    def _feed_and_collect(self, items):
+        first, output = self._queues[0], self._queues[-1]
+        first_name = self.stages[0].name if self.stages else "output"
+        pending = {}
+        next_seq = fed = 0
+        exhausted = False
+        while True:
+            # Read ahead only while the first stage has room
+            while not exhausted and not first.full() and fed - next_seq < self.window:
+                item = next(items, _DONE)
+                if item is _DONE:
+                    exhausted = True
+                    first.put(_DONE)
+                    break
+                first.put((fed, item))
+                fed += 1
+                self._note_depth(first_name, first)
+
+            if next_seq in pending:
+                result = pending.pop(next_seq)
+                next_seq += 1
+                if isinstance(result, _Failure):
+                    raise result.error
+                yield result
+                continue
+            if exhausted and next_seq == fed:
+                return
+            message = self._get(output)
+            if message is not None:
+                seq, result = message
+                pending[seq] = result
+
+    def _work(self, stage, pool, index, remaining, closed):
+        inbox, outbox = self._queues[index], self._queues[index + 1]
+        next_name = (
+            self.stages[index + 1].name if index + 1 < len(self.stages) else "output"
+        )
+        while not closed.is_set():
+            message = self._get(inbox)
+            if message is None:
+                continue
+            if message is _DONE:
+                # Let the other workers of this stage see it too, the last
+                # one to stop passes it on to the next stage. The caller
+                # counts its results and needs none.
+                with self._lock:
+                    remaining[stage.name] -= 1
+                    last = remaining[stage.name] == 0
+                if not last:
+                    inbox.put(_DONE)
+                elif index + 1 < len(self.stages):
+                    self._put(outbox, _DONE, closed)
+                return
+            seq, item = message
+            if not isinstance(item, _Failure):
+                try:
+                    if pool is None:
+                        item = stage.fn(item)
+                    else:
+                        item = pool.submit(stage.fn, item).result()
+                except Exception as e:
+                    item = _Failure(e)
+            with self._lock:
+                self._processed[stage.name] = self._processed.get(stage.name, 0) + 1
+            self._put(outbox, (seq, item), closed)
+            self._note_depth(next_name, outbox)
+
+    def _note_depth(self, name, q):
+        depth = q.qsize()
+        with self._lock:
+            if depth > self._max_depths.get(name, 0):
+                self._max_depths[name] = depth
+
+    @staticmethod
+    def _get(q):
+        """Next message of ``q``, None if nothing came or the run was closed"""
+        try:
+            return q.get(timeout=_POLL)
+        except queue.Empty:
+            return None
+
+    @staticmethod
+    def _put(q, message, closed):
+        while not closed.is_set():
+            try:
+                q.put(message, timeout=_POLL)
+                return
+            except queue.Full:
+                continue
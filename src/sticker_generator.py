@@ -1,15 +1,116 @@
+import collections
+import math
+
 from PIL import Image
 
+try:
+    from src.image_encoding import check_profile, extension, save_image
+except ImportError:
+    from image_encoding import check_profile, extension, save_image
+
+# LANCZOS reads this many source pixels either side when not downscaling
+LANCZOS_SUPPORT = 3
+
+# Maximum per-channel difference between cached and full-template stickers
+CACHED_STICKER_TOLERANCE = 2
+
+# A sticker as the cached background it shares with the rest of the batch
+# and the patch the QR changes. background_key is None when the patch is the
+# whole sticker. For vector stickers the patch is a list of VectorShapes in
+# sticker pixels instead of an image.
+StickerLayers = collections.namedtuple(
+    "StickerLayers", ["background_key", "patch", "box"]
+)
+
+_Background = collections.namedtuple(
+    "_Background", ["image", "region_box", "source_box", "resize_box", "qr_offset"]
+)
+
+
+def _flatten(img):
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    background.paste(img, mask=img.split()[-1])
+    return background
+
 
 class StickerGenerator:
-    def __init__(self, template_path):
+    def __init__(self, template_path, cache_backgrounds=True, encode_profile="default"):
         self.template = Image.open(template_path)
         if self.template.mode != "RGBA":
             self.template = self.template.convert("RGBA")
+        # Load now so concurrent create_sticker calls never share the file
+        self.template.load()
+        # With cached backgrounds only the QR region of each sticker is
+        # flattened and resized; the result matches the full-template path
+        # within CACHED_STICKER_TOLERANCE per channel.
+        self.cache_backgrounds = cache_backgrounds
+        check_profile(encode_profile)
+        # How save_sticker encodes, see image_encoding.ENCODE_PROFILES
+        self.encode_profile = encode_profile
+        self._flat_template = None
+        self._backgrounds = {}
+
+    def create_sticker(self, qr_image, position, output_path=None, scale_factor=None):
+        """Composite the QR onto the template, saving it only if output_path is set"""
+        result_img = self.compose(self.create_layers(qr_image, position, scale_factor))
+        if output_path:
+            self.save_sticker(result_img, output_path)
+        return result_img
+
+    def create_layers(self, qr_image, position, scale_factor=None):
+        """Split a sticker into its shared background and the QR patch"""
+        if self.cache_backgrounds:
+            key = (scale_factor, position, qr_image.size)
+            background = self._get_background(*key)
+            if background is not None:
+                patch = self._render_patch(qr_image, background, scale_factor)
+                return StickerLayers(key, patch, background.region_box)
+
+        result_img = self._compose_full(qr_image, position, scale_factor)
+        return StickerLayers(None, result_img, (0, 0) + result_img.size)
+
+    def create_vector_layers(self, vector_qr, position, scale_factor=None):
+        """Place a VectorQR on the cached background of the raster sticker"""
+        key = (scale_factor, position, vector_qr.size)
+        if self._get_background(*key) is None:
+            raise ValueError(f"A QR code at {position} lies outside the template")
+
+        scale = scale_factor or 1
+        qr_x = position[0] - vector_qr.size[0] // 2
+        qr_y = position[1] - vector_qr.size[1] // 2
+
+        def place(box):
+            return tuple(
+                (value + (qr_x, qr_y)[i % 2]) * scale for i, value in enumerate(box)
+            )
+
+        shapes = [
+            shape._replace(box=place(shape.box), radius=shape.radius * scale)
+            for shape in vector_qr.shapes
+        ]
+        return StickerLayers(key, shapes, place((0, 0) + vector_qr.size))
+
+    def background(self, background_key):
+        """Return the cached background image a StickerLayers refers to"""
+        return self._get_background(*background_key).image
 
-    def create_sticker(self, qr_image, position, output_path, scale_factor=None):
-        template_width, template_height = self.template.size
+    def compose(self, layers):
+        if layers.background_key is None:
+            return layers.patch
+        result_img = self.background(layers.background_key).copy()
+        result_img.paste(layers.patch, layers.box[:2])
+        return result_img
+
+    @property
+    def extension(self):
+        """File extension save_sticker paths should have"""
+        return extension(self.encode_profile)
 
+    def save_sticker(self, sticker, output_path):
+        save_image(sticker, output_path, self.encode_profile, dpi=(300, 300))
+        print(f"Sticker saved to {output_path}")
+
+    def _compose_full(self, qr_image, position, scale_factor):
         qr_x = position[0] - qr_image.size[0] // 2
         qr_y = position[1] - qr_image.size[1] // 2
 
@@ -17,9 +118,7 @@ class StickerGenerator:
         result_img.paste(qr_image, (qr_x, qr_y), qr_image)
 
         if result_img.mode == "RGBA":
-            background = Image.new("RGB", result_img.size, (255, 255, 255))
-            background.paste(result_img, mask=result_img.split()[-1])
-            result_img = background
+            result_img = _flatten(result_img)
 
         if scale_factor:
             new_width = int(result_img.width * scale_factor)
@@ -27,7 +126,86 @@ class StickerGenerator:
             result_img = result_img.resize(
                 (new_width, new_height), Image.Resampling.LANCZOS
             )
-
-        result_img.save(output_path, "PNG", dpi=(300, 300))
-        print(f"Sticker saved to {output_path}")
         return result_img
+
+    def _render_patch(self, qr_image, background, scale_factor):
+        region = self.template.crop(background.source_box)
+        region.paste(qr_image, background.qr_offset, qr_image)
+        region = _flatten(region)
+        if scale_factor:
+            region_box = background.region_box
+            region = region.resize(
+                (region_box[2] - region_box[0], region_box[3] - region_box[1]),
+                Image.Resampling.LANCZOS,
+                box=background.resize_box,
+            )
+        return region
+
+    def _get_background(self, scale_factor, position, qr_size):
+        key = (scale_factor, position, qr_size)
+        if key not in self._backgrounds:
+            self._backgrounds[key] = self._build_background(*key)
+        return self._backgrounds[key]
+
+    def _build_background(self, scale_factor, position, qr_size):
+        """Pre-flatten and pre-scale the template and work out which part of
+        it a QR of ``qr_size`` at ``position`` affects."""
+        if self._flat_template is None:
+            self._flat_template = _flatten(self.template)
+        width, height = self.template.size
+
+        qr_x = position[0] - qr_size[0] // 2
+        qr_y = position[1] - qr_size[1] // 2
+        qr_box = (
+            max(qr_x, 0),
+            max(qr_y, 0),
+            min(qr_x + qr_size[0], width),
+            min(qr_y + qr_size[1], height),
+        )
+        if qr_box[0] >= qr_box[2] or qr_box[1] >= qr_box[3]:
+            return None
+
+        if not scale_factor:
+            return _Background(
+                self._flat_template,
+                qr_box,
+                qr_box,
+                None,
+                (qr_x - qr_box[0], qr_y - qr_box[1]),
+            )
+
+        new_size = (int(width * scale_factor), int(height * scale_factor))
+        image = self._flat_template.resize(new_size, Image.Resampling.LANCZOS)
+
+        # Output pixels whose filter support reaches the QR, and the source
+        # pixels that filter support covers.
+        region_box, source_box = [], []
+        for axis, size in enumerate((width, height)):
+            ratio = size / new_size[axis]
+            support = LANCZOS_SUPPORT * max(ratio, 1)
+            start = math.floor((qr_box[axis] - support) / ratio - 0.5) - 1
+            end = math.ceil((qr_box[axis + 2] + support) / ratio + 0.5) + 1
+            start, end = max(start, 0), min(end, new_size[axis])
+            region_box.append((start, end))
+            source_box.append(
+                (
+                    max(math.floor(start * ratio - support) - 1, 0),
+                    min(math.ceil(end * ratio + support) + 1, size),
+                )
+            )
+
+        (rx0, rx1), (ry0, ry1) = region_box
+        (sx0, sx1), (sy0, sy1) = source_box
+        x_ratio, y_ratio = width / new_size[0], height / new_size[1]
+        return _Background(
+            image,
+            (rx0, ry0, rx1, ry1),
+            (sx0, sy0, sx1, sy1),
+            (
+                rx0 * x_ratio - sx0,
+                ry0 * y_ratio - sy0,
+                rx1 * x_ratio - sx0,
+                ry1 * y_ratio - sy0,
+            ),
+            (qr_x - sx0, qr_y - sy0),
+        )
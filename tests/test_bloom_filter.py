@@ -0,0 +1,50 @@
+import struct
+import uuid
+
+import pytest
+from src.bloom_filter import BloomFilter
+
+
+def test_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=2000, error_rate=0.01)
+    added = [str(uuid.uuid4()) for _ in range(2000)]
+    bloom.update(added)
+
+    assert all(key in bloom for key in added)
+    false_positives = sum(str(uuid.uuid4()) in bloom for _ in range(5000))
+    assert false_positives < 5000 * 0.03
+    assert bloom.count == 2000
+
+
+def test_save_and_load(tmp_path):
+    bloom = BloomFilter(capacity=100)
+    bloom.update(["a", "b"])
+    bloom.watermark = 42
+    bloom.meta = {"db_path": "/data/car_qr.db", "rows": 2}
+    path = str(tmp_path / "uuids.bloom")
+    bloom.save(path)
+
+    loaded = BloomFilter.load(path)
+    assert "a" in loaded and "b" in loaded
+    assert (loaded.num_bits, loaded.num_hashes) == (bloom.num_bits, bloom.num_hashes)
+    assert (loaded.count, loaded.watermark) == (2, 42)
+    assert loaded.meta == bloom.meta
+
+
+def test_load_version_1_files(tmp_path):
+    bloom = BloomFilter(capacity=100)
+    bloom.add("a")
+    path = tmp_path / "uuids.bloom"
+    header = struct.pack(">4sBQBQQ", b"QRBF", 1, bloom.num_bits, bloom.num_hashes, 1, 7)
+    path.write_bytes(header + bloom._bits)
+
+    loaded = BloomFilter.load(str(path))
+    assert "a" in loaded
+    assert (loaded.watermark, loaded.meta) == (7, {})
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "not.bloom"
+    path.write_bytes(b"not a bloom filter at all, honestly")
+    with pytest.raises(ValueError):
+        BloomFilter.load(str(path))
@@ -1,8 +1,17 @@
 import pytest
 import os
-from src.database import Database
+from src.database import MIGRATIONS, SCHEMA_VERSION, Database, decode_uuid, main
+from src.payload import to_compact_id
+import concurrent.futures
+import csv
+import io
+import json
+import random
 import sqlite3
+import threading
+import time
 import uuid
+from datetime import datetime
 
 
 @pytest.fixture
@@ -12,8 +21,10 @@ def temp_db():
     db = Database(db_path)
     yield db
     # Cleanup after tests
-    if os.path.exists(db_path):
-        os.remove(db_path)
+    db.close()
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
 
 
 def test_database_initialization(temp_db):
@@ -149,3 +160,538 @@ def test_qr_redirect_url_flow(temp_db):
 
     # Verify non-existent QR code returns None
     assert temp_db.get_redirect_url("non-existent-uuid") is None
+
+
+def test_compact_id_lookups(temp_db):
+    """Test that compact IDs resolve to the same QR code as legacy UUIDs"""
+    qr_uuid = temp_db.create_qr_record()
+    compact_id = to_compact_id(qr_uuid)
+
+    assert temp_db.get_redirect_url(compact_id) == temp_db.get_redirect_url(qr_uuid)
+    assert temp_db.get_qr_details(compact_id) == temp_db.get_qr_details(qr_uuid)
+
+    success, _ = temp_db.claim_qr(compact_id, "1234567890", "9876543210")
+    assert success is True
+    assert temp_db.get_redirect_url(qr_uuid) == (
+        f"www.sticqr.docpulp.com/contact/{qr_uuid}"
+    )
+    assert temp_db.claim_qr(qr_uuid, "1111111111", "2222222222")[0] is False
+
+
+def test_connection_is_reused_per_thread(temp_db):
+    """Test that each thread keeps one connection for all its calls"""
+    conn = temp_db._connection()
+    assert temp_db._connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(temp_db._connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+    # The thread's connection was closed when it exited
+    assert temp_db._connections == [conn]
+    with pytest.raises(sqlite3.ProgrammingError):
+        other[0].execute("SELECT 1")
+
+
+def test_short_lived_threads_do_not_keep_connections(temp_db):
+    """Test that a thread per request does not pile up open connections"""
+    qr_uuid = temp_db.create_qr_record()
+    for _ in range(20):
+        thread = threading.Thread(target=temp_db.get_redirect_url, args=(qr_uuid,))
+        thread.start()
+        thread.join()
+
+    assert len(temp_db._connections) == 1
+
+
+def test_concurrent_redirect_lookups(temp_db):
+    """Test that readers in many threads see the same redirect URLs"""
+    qr_uuids = [temp_db.create_qr_record() for _ in range(20)]
+    temp_db.claim_qr(qr_uuids[0], "1234567890", "9876543210")
+    expected = [temp_db.get_redirect_url(qr_uuid) for qr_uuid in qr_uuids]
+    results = []
+
+    def read():
+        results.append([temp_db.get_redirect_url(qr_uuid) for qr_uuid in qr_uuids])
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [expected] * 8
+
+
+def test_close_and_context_manager(tmp_path):
+    """Test that close() closes every connection and the db can be reopened"""
+    db_path = str(tmp_path / "context.db")
+    with Database(db_path) as db:
+        qr_uuid = db.create_qr_record()
+        conn = db._connection()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert db._connections == []
+    # A closed Database reconnects on the next call
+    assert db.get_qr_details(qr_uuid)[1] == qr_uuid
+    db.close()
+
+
+def test_create_qr_records(temp_db):
+    """Test bulk creation from a generator, in several chunks"""
+    batch_id = str(uuid.uuid4())
+    existing = temp_db.create_qr_record()
+    qr_uuids = [str(uuid.uuid4()) for _ in range(7)]
+    rows = (
+        {"qr_uuid": qr_uuid, "batch_id": batch_id, "file_path": f"{qr_uuid}.png"}
+        for qr_uuid in qr_uuids + [existing, qr_uuids[0]]
+    )
+
+    inserted, collisions = temp_db.create_qr_records(rows, chunk_size=3)
+
+    assert inserted == 7
+    assert collisions == [existing, qr_uuids[0]]
+    assert len(temp_db.get_batch_qrs(batch_id)) == 7
+    details = temp_db.get_qr_details(qr_uuids[4])
+    assert details[4] == batch_id
+    assert details[6] == f"{qr_uuids[4]}.png"
+    # The existing record is left untouched
+    assert temp_db.get_qr_details(existing)[4] is None
+
+
+def test_create_qr_records_generates_uuids(temp_db):
+    """Test that rows without a qr_uuid get a fresh one"""
+    inserted, collisions = temp_db.create_qr_records([{}, {"batch_id": "b"}])
+
+    assert inserted == 2
+    assert collisions == []
+    assert len(temp_db.get_batch_qrs("b")) == 1
+
+
+def test_migrates_unversioned_database(tmp_path):
+    """Test that a database created before versioning is upgraded in place"""
+    db_path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE qr_codes (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "qr_uuid VARCHAR(36) UNIQUE NOT NULL, "
+            "generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+            "claimed BOOLEAN DEFAULT FALSE, batch_id VARCHAR(50), "
+            "status VARCHAR(20) DEFAULT 'active', file_path VARCHAR(255), "
+            "sticker_path VARCHAR(255), redirect_url VARCHAR(255))"
+        )
+        conn.execute("INSERT INTO qr_codes (qr_uuid) VALUES ('legacy-uuid')")
+    conn.close()
+
+    with Database(db_path) as db:
+        assert db.schema_version() == SCHEMA_VERSION
+        assert db.get_redirect_url("legacy-uuid") == (
+            "www.sticqr.docpulp.com/claim/legacy-uuid"
+        )
+        indexes = {
+            row[0]
+            for row in db._connection().execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+        assert {"idx_qr_codes_batch_id", "idx_claims_qr_uuid"} <= indexes
+
+
+def test_migrate_resumes_from_recorded_version(tmp_path):
+    """Test that only the steps after the recorded version are applied"""
+    db_path = str(tmp_path / "steps.db")
+    with sqlite3.connect(db_path) as conn:
+        for statement in MIGRATIONS[0]:
+            conn.execute(statement)
+        conn.execute("PRAGMA user_version = 1")
+    conn.close()
+
+    with Database(db_path) as db:
+        assert db.schema_version() == SCHEMA_VERSION
+        # Already up to date, nothing is applied twice
+        assert db.migrate() == SCHEMA_VERSION
+        assert db.migrate(target=1) == SCHEMA_VERSION
+
+
+def test_hot_queries_use_indexes(temp_db):
+    """Test that none of the hot queries scans a table"""
+    plans = temp_db.query_plans()
+    assert set(plans) == {"redirect", "batch", "batch_page", "claim"}
+    for plan in plans.values():
+        assert all(detail.startswith("SEARCH") for detail in plan)
+    assert "COVERING INDEX" in plans["redirect"][0]
+
+
+def test_get_claim(temp_db):
+    """Test looking up the claim of a QR code"""
+    qr_uuid = temp_db.create_qr_record()
+    assert temp_db.get_claim(qr_uuid) is None
+
+    temp_db.claim_qr(qr_uuid, "1234567890", "9876543210")
+    assert temp_db.get_claim(qr_uuid) == ("1234567890", "9876543210")
+
+
+def test_check_prints_query_plans(tmp_path, capsys):
+    """Test the --check command line option"""
+    main([str(tmp_path / "check.db"), "--check"])
+
+    output = capsys.readouterr().out
+    assert f"schema version {SCHEMA_VERSION}" in output
+    assert "USING COVERING INDEX idx_qr_codes_redirect" in output
+
+
+def test_redirect_cache_is_invalidated(tmp_path):
+    """Test that cached redirects never outlive a claim or a new record"""
+    with Database(str(tmp_path / "cache.db"), cache_size=100) as db:
+        qr_uuid = db.create_qr_record()
+        cache = db.redirect_cache
+
+        claim_url = db.get_redirect_url(qr_uuid)
+        assert db.get_redirect_url(qr_uuid) == claim_url
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        db.claim_qr(qr_uuid, "1234567890", "9876543210")
+        assert db.get_redirect_url(qr_uuid) == (
+            f"www.sticqr.docpulp.com/contact/{qr_uuid}"
+        )
+
+        # Not-found answers are cached until the record is created
+        new_uuid = str(uuid.uuid4())
+        assert db.get_redirect_url(new_uuid) is None
+        assert db.get_redirect_url(new_uuid) is None
+        db.create_qr_records([{"qr_uuid": new_uuid}])
+        assert db.get_redirect_url(new_uuid) is not None
+
+
+def test_redirect_cache_is_off_by_default(tmp_path):
+    """Test that a claim made through another Database shows up at once"""
+    db_path = str(tmp_path / "nocache.db")
+    with Database(db_path) as db, Database(db_path) as other:
+        qr_uuid = db.create_qr_record()
+        assert db.redirect_cache is None
+        assert db.get_redirect_url(qr_uuid) == (
+            f"www.sticqr.docpulp.com/claim/{qr_uuid}"
+        )
+        other.claim_qr(qr_uuid, "1234567890", "9876543210")
+        assert db.get_redirect_url(qr_uuid) == (
+            f"www.sticqr.docpulp.com/contact/{qr_uuid}"
+        )
+
+
+def test_uuid_filter_skips_unknown_uuids(temp_db, monkeypatch):
+    """Test that unknown UUIDs are answered by the filter alone"""
+    known = temp_db.create_qr_record()
+    temp_db.enable_uuid_filter()
+    added = temp_db.create_qr_record()
+    bulk = [str(uuid.uuid4()) for _ in range(3)]
+    temp_db.create_qr_records({"qr_uuid": qr_uuid} for qr_uuid in bulk)
+
+    for qr_uuid in [known, added] + bulk:
+        assert temp_db.get_redirect_url(qr_uuid) is not None
+
+    def no_lookup(qr_uuid):
+        raise AssertionError("unknown UUIDs should not reach SQLite")
+
+    monkeypatch.setattr(temp_db, "_lookup_redirect_url", no_lookup)
+    assert temp_db.get_redirect_url(str(uuid.uuid4())) is None
+
+
+def test_uuid_filter_catches_up_after_reload(temp_db, tmp_path):
+    """Test that a saved filter picks up rows inserted by other writers"""
+    path = str(tmp_path / "uuids.bloom")
+    temp_db.create_qr_record()
+    temp_db.enable_uuid_filter(path)
+    temp_db.save_uuid_filter(path)
+
+    # Another process inserts while this resolver is down
+    with Database(temp_db.db_path) as writer:
+        late = writer.create_qr_record()
+
+    with Database(temp_db.db_path) as resolver:
+        resolver.enable_uuid_filter(path)
+        assert resolver.get_redirect_url(late) is not None
+
+
+def test_uuid_filter_from_another_database_is_rebuilt(temp_db, tmp_path):
+    """Test that a saved filter is not trusted by a database it was not
+    built from, or one restored to fewer rows"""
+    path = str(tmp_path / "uuids.bloom")
+    with Database(str(tmp_path / "other.db")) as other:
+        other.create_qr_record()
+        other.enable_uuid_filter(path)
+        other.save_uuid_filter(path)
+
+    known = temp_db.create_qr_record()
+    temp_db.enable_uuid_filter(path)
+    assert temp_db.get_redirect_url(known) is not None
+
+    # The database is restored from a backup taken before its second row
+    restored = str(tmp_path / "restored.db")
+    with Database(restored) as db:
+        db.create_qr_record()
+        db.create_qr_record()
+        db.enable_uuid_filter(path)
+        db.save_uuid_filter(path)
+    os.remove(restored)
+    with Database(restored) as db:
+        db.create_qr_record()
+        db.enable_uuid_filter(path)
+        # Takes the id the filter already counted as seen
+        missing = db.create_qr_record()
+        assert db.get_redirect_url(missing) is not None
+
+
+def test_uuid_filter_refreshes_on_unknown_uuid(temp_db, monkeypatch):
+    """Test that rows from other writers are found once the refresh is due"""
+    temp_db.enable_uuid_filter()
+    with Database(temp_db.db_path) as writer:
+        late = writer.create_qr_record()
+
+    assert temp_db.get_redirect_url(late) is None
+    monkeypatch.setattr("src.database.UUID_FILTER_REFRESH", 0)
+    assert temp_db.get_redirect_url(late) is not None
+
+
+def test_uuid_filter_sync_lets_new_threads_connect(temp_db, monkeypatch):
+    """Test that threads can open their connection while the filter syncs"""
+    qr_uuids = [str(uuid.uuid4()) for _ in range(5)]
+    temp_db.create_qr_records({"qr_uuid": qr_uuid} for qr_uuid in qr_uuids)
+    monkeypatch.setattr("src.database.UUID_FILTER_PAGE", 2)
+    blocked = []
+
+    def decode_while_connecting(key):
+        if not blocked:
+            thread = threading.Thread(target=temp_db._connection)
+            thread.start()
+            thread.join(timeout=5)
+            blocked.append(thread.is_alive())
+        return decode_uuid(key)
+
+    monkeypatch.setattr("src.database.decode_uuid", decode_while_connecting)
+    temp_db.enable_uuid_filter()
+
+    assert blocked == [False]
+    assert temp_db.uuid_filter.watermark == 5
+    assert temp_db.uuid_filter.meta["rows"] == 5
+    assert all(qr_uuid in temp_db.uuid_filter for qr_uuid in qr_uuids)
+
+
+def _claim_all(db_path, qr_uuids, worker):
+    """Claim every code in a random order, returning wins and latencies"""
+    qr_uuids = list(qr_uuids)
+    random.Random(worker).shuffle(qr_uuids)
+    wins, latencies = [], []
+    with Database(db_path) as db:
+        for qr_uuid in qr_uuids:
+            start = time.perf_counter()
+            success, _ = db.claim_qr(qr_uuid, f"phone-{worker}", f"masked-{worker}")
+            latencies.append(time.perf_counter() - start)
+            if success:
+                wins.append(qr_uuid)
+    return wins, latencies
+
+
+@pytest.mark.parametrize("executor", ["threads", "processes"])
+def test_concurrent_claims_have_one_winner(temp_db, executor):
+    """Test that racing claimants never both win the same code"""
+    qr_uuids = [temp_db.create_qr_record() for _ in range(25)]
+    workers = 8
+    pool_class = (
+        concurrent.futures.ThreadPoolExecutor
+        if executor == "threads"
+        else concurrent.futures.ProcessPoolExecutor
+    )
+    with pool_class(max_workers=workers) as pool:
+        results = list(
+            pool.map(
+                _claim_all,
+                [temp_db.db_path] * workers,
+                [qr_uuids] * workers,
+                range(workers),
+            )
+        )
+
+    wins = [qr_uuid for worker_wins, _ in results for qr_uuid in worker_wins]
+    assert sorted(wins) == sorted(qr_uuids)
+    with sqlite3.connect(temp_db.db_path) as conn:
+        (claims,) = conn.execute("SELECT COUNT(*) FROM claims").fetchone()
+    conn.close()
+    assert claims == len(qr_uuids)
+
+    latencies = sorted(latency for _, worker in results for latency in worker)
+    assert latencies[int(len(latencies) * 0.99)] < 1.0
+
+
+def test_claim_unknown_qr(temp_db):
+    """Test that claiming a code that does not exist fails"""
+    assert temp_db.claim_qr("no-such-uuid", "1234567890", "9876543210") == (
+        False,
+        "QR code not found",
+    )
+    assert temp_db.get_claim("no-such-uuid") is None
+
+
+def test_claim_retries_when_locked(temp_db, monkeypatch):
+    """Test that a claim locked out past busy_timeout is retried"""
+    qr_uuid = temp_db.create_qr_record()
+    attempts = []
+    claim = Database._claim
+
+    def locked_once(self, *args):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return claim(self, *args)
+
+    monkeypatch.setattr(Database, "_claim", locked_once)
+    monkeypatch.setattr("src.database.CLAIM_RETRY_DELAY", 0)
+    assert temp_db.claim_qr(qr_uuid, "1234567890", "9876543210")[0] is True
+    assert len(attempts) == 2
+
+
+def test_iter_batch_qrs_pages_by_id(temp_db):
+    """Test that batch iteration streams every row once, in id order"""
+    batch_id = str(uuid.uuid4())
+    qr_uuids = [temp_db.create_qr_record(batch_id=batch_id) for _ in range(7)]
+    temp_db.create_qr_record(batch_id="other batch")
+
+    rows = temp_db.iter_batch_qrs(batch_id, columns=["qr_uuid"], page_size=3)
+    assert not isinstance(rows, list)
+    assert [row[0] for row in rows] == qr_uuids
+    assert list(temp_db.iter_batch_qrs(batch_id)) == temp_db.get_batch_qrs(batch_id)
+
+    with pytest.raises(ValueError):
+        list(temp_db.iter_batch_qrs(batch_id, columns=["qr_uuid; DROP TABLE"]))
+
+
+@pytest.mark.parametrize("export_format", ["csv", "jsonl"])
+def test_export_batch(temp_db, export_format):
+    """Test exporting a batch as CSV and as JSON Lines"""
+    batch_id = str(uuid.uuid4())
+    qr_uuids = [temp_db.create_qr_record(batch_id=batch_id) for _ in range(3)]
+    output = io.StringIO()
+
+    count = temp_db.export_batch(
+        batch_id, output, export_format, columns=["qr_uuid", "claimed"]
+    )
+
+    assert count == 3
+    output.seek(0)
+    if export_format == "csv":
+        records = list(csv.DictReader(output))
+        assert records[0] == {"qr_uuid": qr_uuids[0], "claimed": "0"}
+    else:
+        records = [json.loads(line) for line in output]
+        assert records[0] == {"qr_uuid": qr_uuids[0], "claimed": 0}
+    assert [record["qr_uuid"] for record in records] == qr_uuids
+
+
+def test_export_command(temp_db, tmp_path):
+    """Test the --export command line option"""
+    qr_uuid = temp_db.create_qr_record(batch_id="partner")
+    output_path = tmp_path / "partner.jsonl"
+
+    export_args = ["--export", "partner", "--format", "jsonl", "-o", str(output_path)]
+    main([temp_db.db_path] + export_args)
+
+    record = json.loads(output_path.read_text())
+    assert record["qr_uuid"] == qr_uuid
+    assert record["batch_id"] == "partner"
+
+
+def test_blob_uuid_format(tmp_path):
+    """Test that BLOB keys are stored as 16 bytes and returned as strings"""
+    with Database(str(tmp_path / "blob.db"), uuid_format="blob") as db:
+        batch_id = str(uuid.uuid4())
+        qr_uuid = db.create_qr_record(batch_id=batch_id)
+        bulk_uuid = str(uuid.uuid4())
+        assert db.create_qr_records([{"qr_uuid": bulk_uuid}, {"qr_uuid": qr_uuid}]) == (
+            1,
+            [qr_uuid],
+        )
+
+        assert db.get_qr_details(qr_uuid)[1] == qr_uuid
+        assert db.get_qr_details(to_compact_id(qr_uuid))[1] == qr_uuid
+        assert db.get_batch_qrs(batch_id)[0][1] == qr_uuid
+        assert list(db.iter_batch_qrs(batch_id, columns=["batch_id", "qr_uuid"])) == [
+            (batch_id, qr_uuid)
+        ]
+        assert db.claim_qr(qr_uuid, "1234567890", "9876543210")[0] is True
+        assert db.get_redirect_url(qr_uuid) == (
+            f"www.sticqr.docpulp.com/contact/{qr_uuid}"
+        )
+        assert db.get_claim(qr_uuid) == ("1234567890", "9876543210")
+
+        conn = db._connection()
+        for table in ("qr_codes", "claims"):
+            assert conn.execute(
+                f"SELECT DISTINCT typeof(qr_uuid), length(qr_uuid) FROM {table}"
+            ).fetchall() == [("blob", 16)]
+
+        # IDs that are not canonical UUIDs keep working as text
+        db.create_qr_record(qr_uuid="legacy-id")
+        assert db.get_qr_details("legacy-id")[1] == "legacy-id"
+
+    # The format is stored in the database
+    with Database(str(tmp_path / "blob.db")) as db:
+        assert db.uuid_format == "blob"
+        assert db.get_qr_details(bulk_uuid)[1] == bulk_uuid
+
+
+def test_convert_uuid_format(tmp_path):
+    """Test converting an existing text database to BLOB keys and back"""
+    db_path = str(tmp_path / "convert.db")
+    with Database(db_path) as db:
+        qr_uuids = [db.create_qr_record(batch_id="b") for _ in range(5)]
+        db.claim_qr(qr_uuids[0], "1234567890", "9876543210")
+        before = db.get_batch_qrs("b")
+
+    with Database(db_path, uuid_format="blob") as db:
+        assert db.get_batch_qrs("b") == before
+        assert db.get_claim(qr_uuids[0]) == ("1234567890", "9876543210")
+        assert db.claim_qr(qr_uuids[0], "1111111111", "2222222222")[0] is False
+        assert db.claim_qr(qr_uuids[1], "1111111111", "2222222222")[0] is True
+
+        db.convert_uuid_format("text")
+        kinds = db._connection().execute("SELECT DISTINCT typeof(qr_uuid) FROM claims")
+        assert kinds.fetchall() == [("text",)]
+        assert db.get_claim(qr_uuids[1]) == ("1111111111", "2222222222")
+
+        with pytest.raises(ValueError):
+            db.convert_uuid_format("base64")
+
+
+@pytest.mark.parametrize("uuid_format", ["text", "blob"])
+def test_scan_log_records_redirects(tmp_path, uuid_format):
+    """Test that scans are written behind lookups and counted per batch"""
+    db_path = str(tmp_path / "scans.db")
+    with Database(db_path, uuid_format=uuid_format) as db:
+        first = [db.create_qr_record(batch_id="first") for _ in range(3)]
+        second = db.create_qr_record(batch_id="second")
+        db.claim_qr(first[0], "1234567890", "9876543210")
+        scan_log = db.enable_scan_log(flush_size=1000, flush_interval=60)
+
+        for qr_uuid in first + first[:1] + [second, str(uuid.uuid4())]:
+            db.get_redirect_url(qr_uuid)
+        assert scan_log.stats()["depth"] == 6
+        assert db.batch_scan_counts() == []
+
+        scan_log.flush()
+        assert db.batch_scan_counts() == [("first", 4, 3), ("second", 1, 1)]
+        assert db.batch_scan_counts("second") == [("second", 1, 1)]
+        outcomes = db._connection().execute(
+            "SELECT outcome, COUNT(*) FROM scans GROUP BY outcome ORDER BY outcome"
+        )
+        assert outcomes.fetchall() == [("claimed", 2), ("unclaimed", 3), ("unknown", 1)]
+        scanned_at = db._connection().execute("SELECT scanned_at FROM scans")
+        assert datetime.strptime(scanned_at.fetchone()[0], "%Y-%m-%d %H:%M:%S.%f")
+
+        db.get_redirect_url(second)
+
+    # close() writes what is still buffered
+    with Database(db_path) as db:
+        assert db.batch_scan_counts("second") == [("second", 2, 1)]
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from PIL import Image
+from src.image_encoding import (
+    ENCODE_PROFILES,
+    LOSSLESS_PROFILES,
+    compact_image,
+    encoded_complete,
+    extension,
+    save_image,
+)
+from src.qr_code_generator import QRCodeGenerator
+
+
+@pytest.fixture
+def qr_image(phone_icon_path):
+    return QRCodeGenerator(icon_path=phone_icon_path).generate("encode", 300)
+
+
+@pytest.mark.parametrize("profile", ENCODE_PROFILES)
+def test_profiles_round_trip(qr_image, tmp_path, profile):
+    path = str(tmp_path / f"qr{extension(profile)}")
+    save_image(qr_image, path, profile)
+
+    assert encoded_complete(path)
+    with Image.open(path) as saved:
+        decoded = np.asarray(saved.convert("RGBA")).astype(int)
+    changed = (decoded != np.asarray(qr_image)).any(2).mean()
+    if profile in LOSSLESS_PROFILES:
+        assert changed == 0
+    else:
+        assert changed <= 0.01
+
+
+def test_compact_qr_is_a_palette_image(qr_image, tmp_path):
+    default, compact = tmp_path / "default.png", tmp_path / "compact.png"
+    save_image(qr_image, str(default))
+    save_image(qr_image, str(compact), "compact")
+
+    assert Image.open(compact).mode == "P"
+    assert compact.stat().st_size < default.stat().st_size
+
+
+def test_compact_black_and_white_is_1_bit():
+    image = Image.new("RGB", (16, 16), "white")
+    image.paste((0, 0, 0), (0, 0, 8, 8))
+
+    assert compact_image(image).mode == "1"
+
+
+def test_compact_keeps_many_colours():
+    pixels = np.random.default_rng(0).integers(0, 256, (64, 64, 3), np.uint8)
+    image = Image.fromarray(pixels)
+    assert compact_image(image) is image
+
+
+@pytest.mark.parametrize("profile", ["default", "webp"])
+def test_truncated_files_are_incomplete(qr_image, tmp_path, profile):
+    path = tmp_path / f"qr{extension(profile)}"
+    save_image(qr_image, str(path), profile)
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 1)
+
+    assert not encoded_complete(str(path))
+    assert not encoded_complete(str(tmp_path / "missing.png"))
+
+
+def test_unknown_profile(qr_image, tmp_path):
+    with pytest.raises(ValueError):
+        save_image(qr_image, str(tmp_path / "qr.png"), "jpeg")
+    with pytest.raises(ValueError):
+        QRCodeGenerator(encode_profile="jpeg")
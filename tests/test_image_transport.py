@@ -0,0 +1,70 @@
+import concurrent.futures
+import queue
+
+import pytest
+from PIL import Image
+from src.image_transport import ImageRing, image_nbytes
+
+_ring = None
+
+
+def _init(ring):
+    global _ring
+    _ring = ring
+
+
+def _send_square(color):
+    return _ring.send([Image.new("RGBA", (64, 64), color)])
+
+
+@pytest.fixture
+def ring():
+    ring = ImageRing(2, image_nbytes("RGBA", (64, 64)) + image_nbytes("RGB", (8, 8)))
+    yield ring
+    ring.close()
+
+
+def test_round_trip_maps_the_slot(ring):
+    qr = Image.new("RGBA", (64, 64), (10, 20, 30, 255))
+    patch = Image.new("RGB", (8, 8), (1, 2, 3))
+    parcel = ring.send([qr, None, patch])
+
+    received_qr, nothing, received_patch = ring.receive(parcel)
+    assert nothing is None
+    assert received_qr.tobytes() == qr.tobytes()
+    assert received_patch.tobytes() == patch.tobytes()
+    # RGBA is a read-only view on the slot, RGB is unpacked into a copy
+    assert received_qr.readonly and not received_patch.readonly
+    del received_qr
+    ring.release(parcel.slot)
+
+
+def test_images_that_do_not_fit_are_not_sent(ring):
+    assert ring.send([Image.new("RGBA", (65, 64))]) is None
+    assert ring.send([Image.new("P", (8, 8))]) is None
+
+
+def test_senders_wait_for_a_free_slot(ring):
+    image = Image.new("L", (8, 8))
+    first, _ = ring.send([image]), ring.send([image])
+    with pytest.raises(queue.Empty):
+        ring.send([image], timeout=0.1)
+
+    ring.release(first.slot)
+    assert ring.send([image], timeout=5).slot == first.slot
+
+
+def test_send_from_worker_processes(ring):
+    colors = [(i, 0, 0, 255) for i in range(6)]
+    with concurrent.futures.ProcessPoolExecutor(
+        2, initializer=_init, initargs=(ring,)
+    ) as pool:
+        futures = [pool.submit(_send_square, color) for color in colors[:2]]
+        for i, color in enumerate(colors):
+            parcel = futures[i].result()
+            (image,) = ring.receive(parcel)
+            assert image.getpixel((0, 0)) == color
+            del image
+            ring.release(parcel.slot)
+            if i + 2 < len(colors):
+                futures.append(pool.submit(_send_square, colors[i + 2]))
@@ -1,18 +1,51 @@
+import hashlib
+import json
 import os
+import subprocess
+import sys
 import pytest
 from unittest.mock import patch, MagicMock
 
 try:
-    from src.main import main
+    from src.database import Database
+    from src.image_encoding import PNG_TRAILER
+    from src.main import PDF_TRAILER, cli, main, resume
+    from src.pipeline import RenderedSticker, StickerPipeline, complete_file
+    from src.qr_code_generator import QRCodeGenerator
 except ImportError:
     import sys
 
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-    from src.main import main
+    from src.database import Database
+    from src.image_encoding import PNG_TRAILER
+    from src.main import PDF_TRAILER, cli, main, resume
+    from src.pipeline import RenderedSticker, StickerPipeline, complete_file
+    from src.qr_code_generator import QRCodeGenerator
+
+_iter_items = StickerPipeline.iter_items
+
+
+def serial_iter_items(self, items, executor="serial", **kwargs):
+    """Keep the in-process pipeline serial so the test stays fast"""
+    return _iter_items(self, items, executor="serial")
+
+
+def consume_stickers(stickers, output_path, **kwargs):
+    """Stand-in for create_imposed_pdf that drains the sticker stream"""
+    return list(stickers)
+
+
+def mock_database():
+    """A Database mock holding a fresh batch job"""
+    mock_db = MagicMock()
+    mock_db.create_qr_records.return_value = (10, [])
+    mock_db.get_batch_job.return_value = {"status": "running", "items": 0}
+    mock_db.iter_batch_job_items.return_value = iter([])
+    return mock_db
 
 
 @patch("uuid.uuid4")
-@patch("src.main.Image.open")
+@patch("src.main.StickerPipeline")
 @patch("src.main.PDFGenerator")
 @patch("src.main.StickerGenerator")
 @patch("src.main.QRCodeGenerator")
@@ -20,7 +53,7 @@ def test_main_script_execution(
     mock_qr_generator,
     mock_sticker_generator,
     mock_pdf_generator,
-    mock_image_open,
+    mock_pipeline,
     mock_uuid,
     tmp_path,
     phone_icon_path,
@@ -32,20 +65,31 @@ def test_main_script_execution(
     mock_uuids = [f"test-uuid-{i}" for i in range(11)]  # 1 for batch + 10 for QRs
     mock_uuid.side_effect = mock_uuids
 
-    mock_qr_instance = MagicMock()
-    mock_sticker_instance = MagicMock()
+    mock_pipeline_instance = MagicMock()
     mock_pdf_instance = MagicMock()
-    mock_qr_generator.return_value = mock_qr_instance
-    mock_sticker_generator.return_value = mock_sticker_instance
+    mock_pipeline.return_value = mock_pipeline_instance
     mock_pdf_generator.return_value = mock_pdf_instance
+    mock_pdf_instance.create_imposed_pdf.side_effect = consume_stickers
 
     # Mock the database to avoid actual DB operations
-    mock_db = MagicMock()
+    mock_db = mock_database()
 
-    # Mock the QR paths with the UUIDs (excluding the batch UUID)
+    # The pipeline yields one rendered sticker per QR UUID (excluding the batch UUID)
     qr_uuids = mock_uuids[1:]  # Skip the first UUID which will be used for batch_id
-    mock_qr_paths = [f"qr_path_{uuid}" for uuid in qr_uuids]
-    mock_qr_instance.generate_batch.return_value = mock_qr_paths
+    planned = []
+
+    def iter_items(items, **kwargs):
+        for i, qr_uuid in items:
+            planned.append((i, qr_uuid))
+            yield RenderedSticker(
+                i,
+                qr_uuid,
+                f"layers_{qr_uuid}",
+                f"qr_path_{qr_uuid}",
+                f"sticker_{i}.png",
+            )
+
+    mock_pipeline_instance.iter_items.side_effect = iter_items
 
     # Define the output path for the test
     output_path = tmp_path / "enhanced_qr_card.png"
@@ -56,25 +100,381 @@ def test_main_script_execution(
         main(template_path, phone_icon_path, str(output_path), output_dir=str(tmp_path))
 
         # Check if the script ran to completion
-        mock_qr_generator.assert_called_once_with(icon_path=phone_icon_path)
-        mock_sticker_generator.assert_called_once_with(template_path=template_path)
+        mock_qr_generator.assert_called_once_with(
+            icon_path=phone_icon_path, encode_profile="default"
+        )
+        mock_sticker_generator.assert_called_once_with(
+            template_path=template_path, encode_profile="default"
+        )
 
-        # Should create stickers for all QR codes
-        assert mock_sticker_instance.create_sticker.call_count == len(mock_qr_paths)
+        # Verify the pipeline keeps the intermediate PNGs by default
+        _, pipeline_kwargs = mock_pipeline.call_args
+        assert pipeline_kwargs["qr_size"] == 700
+        batch_dir = tmp_path / mock_uuids[0]
+        assert pipeline_kwargs["qr_folder"] == str(batch_dir / "qrcodes_batch")
+        assert pipeline_kwargs["sticker_folder"] == str(batch_dir / "stickers_batch")
+        assert planned == list(enumerate(qr_uuids))
 
-        # Verify PDF generation
-        mock_pdf_instance.create_pdf_from_images.assert_called_once()
-
-        # Verify QR batch generation with proper parameters
-        mock_qr_instance.generate_batch.assert_called_once()
-        _, call_kwargs = mock_qr_instance.generate_batch.call_args
-        assert call_kwargs["num_qrs"] == 10
-        assert call_kwargs["size"] == 700
-        assert call_kwargs["output_folder"] == str(tmp_path / "qrcodes_batch")
+        # Verify the stickers are imposed 2x2 over the shared background
+        mock_pdf_instance.create_imposed_pdf.assert_called_once()
+        _, pdf_kwargs = mock_pdf_instance.create_imposed_pdf.call_args
+        assert pdf_kwargs["columns"] == 2
+        assert pdf_kwargs["rows"] == 2
+        assert (
+            pdf_kwargs["backgrounds"] == mock_sticker_generator.return_value.background
+        )
 
         # Verify database operations
-        assert mock_db.create_qr_record.call_count == len(mock_qr_paths)
-        for i, call_args in enumerate(mock_db.create_qr_record.call_args_list):
-            args, kwargs = call_args
-            assert kwargs["qr_uuid"] == qr_uuids[i]
-            assert kwargs["batch_id"] == mock_uuids[0]  # First UUID used for batch_id
+        records = [
+            record
+            for call_args in mock_db.create_qr_records.call_args_list
+            for record in call_args[0][0]
+        ]
+        assert len(records) == len(qr_uuids)
+        for i, record in enumerate(records):
+            assert record["qr_uuid"] == qr_uuids[i]
+            assert record["batch_id"] == mock_uuids[0]  # First UUID used for batch_id
+            assert record["file_path"] == f"qr_path_{qr_uuids[i]}"
+            assert record["sticker_path"] == f"sticker_{i}.png"
+
+
+def test_main_in_memory(tmp_path, phone_icon_path, template_path):
+    """Test that main only writes the PDF when intermediates are not kept."""
+    mock_db = mock_database()
+    with patch("src.main.Database", return_value=mock_db), patch(
+        "src.main.uuid.uuid4",
+        side_effect=[f"{i:08d}-0000-4000-8000-000000000000" for i in range(11)],
+    ), patch.object(StickerPipeline, "iter_items", serial_iter_items):
+        main(
+            template_path,
+            phone_icon_path,
+            "unused.png",
+            output_dir=str(tmp_path),
+            save_intermediates=False,
+        )
+
+    batch_dir = tmp_path / "00000000-0000-4000-8000-000000000000"
+    assert (batch_dir / "qr_codes" / "stickers.pdf").exists()
+    assert not (batch_dir / "qrcodes_batch").exists()
+    assert not (batch_dir / "stickers_batch").exists()
+    mock_db.create_qr_records.assert_called_once()
+    records = mock_db.create_qr_records.call_args[0][0]
+    assert len(records) == 10
+    for record in records:
+        assert record["file_path"] is None
+        assert record["sticker_path"] is None
+
+
+def test_main_streams_in_chunks(tmp_path, phone_icon_path, template_path, capsys):
+    """Test that records are stored and progress reported chunk by chunk."""
+    mock_db = mock_database()
+    mock_db.create_qr_records.side_effect = lambda records: (len(records), [])
+    with patch("src.main.Database", return_value=mock_db) as database, patch.object(
+        StickerPipeline, "iter_items", serial_iter_items
+    ):
+        main(
+            template_path,
+            phone_icon_path,
+            output_dir=str(tmp_path),
+            save_intermediates=False,
+            count=7,
+            qr_size=300,
+            batch_id="chunked",
+            db_path=str(tmp_path / "chunked.db"),
+            chunk_size=3,
+        )
+
+    database.assert_called_once_with(str(tmp_path / "chunked.db"))
+    chunks = [call[0][0] for call in mock_db.create_qr_records.call_args_list]
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert {record["batch_id"] for chunk in chunks for record in chunk} == {"chunked"}
+    output = capsys.readouterr().out
+    assert "3/7 stickers" in output and "7/7 stickers" in output
+    assert "stickers/s" in output
+
+
+def test_cli_arguments(tmp_path):
+    """Test that the command line flags reach main."""
+    with patch("src.main.main") as mock_main:
+        cli(
+            [
+                "--count",
+                "1000000",
+                "--size",
+                "500",
+                "--scale",
+                "0.5",
+                "--batch-id",
+                "run-1",
+                "--output-dir",
+                str(tmp_path),
+                "--db-path",
+                str(tmp_path / "run.db"),
+                "--no-intermediates",
+                "--encode-profile",
+                "webp",
+            ]
+        )
+
+    _, kwargs = mock_main.call_args
+    assert kwargs["count"] == 1000000
+    assert kwargs["qr_size"] == 500
+    assert kwargs["scale_factor"] == 0.5
+    assert kwargs["batch_id"] == "run-1"
+    assert kwargs["output_dir"] == str(tmp_path)
+    assert kwargs["db_path"] == str(tmp_path / "run.db")
+    assert kwargs["save_intermediates"] is False
+    assert kwargs["encode_profile"] == "webp"
+
+    with pytest.raises(SystemExit):
+        cli(["--count", "-1"])
+
+
+def run_batch(tmp_path, template_path, phone_icon_path, **kwargs):
+    kwargs.setdefault("batch_id", "resumable")
+    return main(
+        template_path,
+        phone_icon_path,
+        output_dir=str(tmp_path / "out"),
+        count=6,
+        qr_size=300,
+        db_path=str(tmp_path / "jobs.db"),
+        chunk_size=2,
+        executor="serial",
+        **kwargs,
+    )
+
+
+def file_hashes(paths):
+    hashes = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            hashes[path] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def test_resume_finishes_a_crashed_batch(tmp_path, phone_icon_path, template_path):
+    """Test that resume re-runs only what a crashed run left undone."""
+    _render = StickerPipeline.render
+
+    def crash_at_3(self, index, qr_uuid):
+        if index == 3:
+            raise RuntimeError("killed")
+        return _render(self, index, qr_uuid)
+
+    with patch.object(StickerPipeline, "render", crash_at_3):
+        with pytest.raises(RuntimeError):
+            run_batch(tmp_path, template_path, phone_icon_path)
+
+    db_path = str(tmp_path / "jobs.db")
+    with Database(db_path) as db:
+        job = db.get_batch_job("resumable")
+        assert job["status"] == "running"
+        assert job["stored"] == 2
+    with pytest.raises(ValueError):
+        run_batch(tmp_path, template_path, phone_icon_path)
+
+    pdf_path = resume("resumable", db_path, executor="serial")
+    with Database(db_path) as db:
+        job = db.get_batch_job("resumable")
+        assert (job["status"], job["items"], job["stored"]) == ("done", 6, 6)
+        items = list(db.iter_batch_job_items("resumable"))
+        records = db.get_batch_qrs("resumable")
+    assert [record[1] for record in records] == [qr_uuid for _, qr_uuid, _ in items]
+    assert all(os.path.exists(record[7]) for record in records)
+    assert complete_file(pdf_path, PDF_TRAILER)
+
+
+def test_resume_ignores_files_of_other_batches(
+    tmp_path, phone_icon_path, template_path
+):
+    """Test that a batch run between a crash and its resume is left alone."""
+    _render = StickerPipeline.render
+
+    def crash_at_3(self, index, qr_uuid):
+        if index == 3:
+            raise RuntimeError("killed")
+        return _render(self, index, qr_uuid)
+
+    with patch.object(StickerPipeline, "render", crash_at_3):
+        with pytest.raises(RuntimeError):
+            run_batch(tmp_path, template_path, phone_icon_path, batch_id="A")
+    pdf_b = run_batch(tmp_path, template_path, phone_icon_path, batch_id="B")
+    db_path = str(tmp_path / "jobs.db")
+    with Database(db_path) as db:
+        records_b = db.get_batch_qrs("B")
+    files_b = [pdf_b] + [path for r in records_b for path in (r[6], r[7])]
+    hashes_b = file_hashes(files_b)
+
+    pdf_a = resume("A", db_path, executor="serial")
+    with Database(db_path) as db:
+        records_a = db.get_batch_qrs("A")
+        assert db.get_batch_job("A")["pdf_path"] == pdf_a
+
+    assert file_hashes(files_b) == hashes_b
+    paths_a = [path for r in records_a for path in (r[6], r[7])]
+    assert len(paths_a) == 12 and not set(paths_a) & set(files_b)
+    assert all(complete_file(path, PNG_TRAILER) for path in paths_a)
+    assert pdf_a != pdf_b and complete_file(pdf_a, PDF_TRAILER)
+
+
+def test_resume_rebuilds_jobs_without_recorded_paths(
+    tmp_path, phone_icon_path, template_path, capsys
+):
+    """Test that a job from before paths were recorded reuses no files."""
+    run_batch(tmp_path, template_path, phone_icon_path)
+    db_path = str(tmp_path / "jobs.db")
+    with Database(db_path) as db:
+        options = db.get_batch_job("resumable")["options"]
+        for key in ("qr_folder", "sticker_folder", "pdf_path"):
+            del options[key]
+        with db._connection() as conn:
+            conn.execute(
+                "UPDATE batch_jobs SET options = ? WHERE batch_id = ?",
+                (json.dumps(options), "resumable"),
+            )
+    capsys.readouterr()
+
+    generated = []
+    generate = QRCodeGenerator.generate
+    with patch.object(
+        QRCodeGenerator,
+        "generate",
+        lambda self, qr_id, size: generated.append(qr_id)
+        or generate(self, qr_id, size),
+    ):
+        resume("resumable", db_path, executor="serial")
+
+    assert len(generated) == 6
+    assert "nothing to do" not in capsys.readouterr().out
+
+
+def test_resume_repairs_files_and_is_idempotent(
+    tmp_path, phone_icon_path, template_path, capsys
+):
+    """Test that resume only redoes missing or truncated files."""
+    pdf_path = run_batch(tmp_path, template_path, phone_icon_path)
+    db_path = str(tmp_path / "jobs.db")
+    with Database(db_path) as db:
+        records = db.get_batch_qrs("resumable")
+    capsys.readouterr()
+
+    resume("resumable", db_path, executor="serial")
+    output = capsys.readouterr().out
+    assert "nothing to do" in output
+    assert "stickers/s" not in output
+
+    missing_qr, truncated_sticker = records[1][6], records[4][7]
+    os.remove(missing_qr)
+    with open(truncated_sticker, "r+b") as f:
+        f.truncate(100)
+    untouched = {path: os.path.getmtime(path) for path in (records[0][6], pdf_path)}
+
+    generated = []
+    generate = QRCodeGenerator.generate
+    with patch.object(
+        QRCodeGenerator,
+        "generate",
+        lambda self, qr_id, size: generated.append(qr_id)
+        or generate(self, qr_id, size),
+    ):
+        resume("resumable", db_path, executor="serial")
+
+    assert generated == [records[1][1]]
+    assert complete_file(missing_qr, PNG_TRAILER)
+    assert complete_file(truncated_sticker, PNG_TRAILER)
+    assert {path: os.path.getmtime(path) for path in untouched} == untouched
+
+
+def test_cli_resume(tmp_path):
+    """Test that the resume command reaches resume."""
+    db_path = str(tmp_path / "jobs.db")
+    with Database(db_path) as db:
+        db.create_batch_job("batch-1", {})
+    with patch("src.main.resume") as mock_resume:
+        cli(["resume", "batch-1", "--db-path", db_path])
+    mock_resume.assert_called_once_with("batch-1", db_path, "processes", None)
+
+    with pytest.raises(SystemExit):
+        cli(["resume", "unknown", "--db-path", db_path])
+    with pytest.raises(SystemExit):
+        cli(["--batch-id", "batch-1", "--db-path", db_path])
+
+
+def test_console_script_exits_0(tmp_path):
+    """Test that a successful run and resume exit with status 0."""
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    db_path = str(tmp_path / "run.db")
+    runs = [
+        [
+            "--count",
+            "1",
+            "--size",
+            "300",
+            "--batch-id",
+            "exit-status",
+            "--output-dir",
+            str(tmp_path),
+            "--db-path",
+            db_path,
+            "--executor",
+            "threads",
+            "--no-intermediates",
+        ],
+        ["resume", "exit-status", "--db-path", db_path, "--executor", "threads"],
+    ]
+    for argv in runs:
+        result = subprocess.run(
+            [sys.executable, "-m", "src", *argv],
+            cwd=root,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stderr == ""
+    assert (tmp_path / "exit-status" / "qr_codes" / "stickers.pdf").exists()
+
+
+def test_main_staged_reports_queue_depths(
+    tmp_path, phone_icon_path, template_path, capsys
+):
+    """Test that the staged executor reports its queues with the progress."""
+    mock_db = mock_database()
+    mock_db.create_qr_records.side_effect = lambda records: (len(records), [])
+    with patch("src.main.Database", return_value=mock_db):
+        main(
+            template_path,
+            phone_icon_path,
+            output_dir=str(tmp_path),
+            count=4,
+            qr_size=300,
+            chunk_size=2,
+            batch_id="staged",
+            executor="staged",
+            max_workers=1,
+        )
+
+    assert len(os.listdir(tmp_path / "staged" / "stickers_batch")) == 4
+    output = capsys.readouterr().out
+    assert "4/4 stickers" in output and "queued draw=" in output
+
+
+def test_batches_sharing_an_output_dir_keep_their_files(
+    tmp_path, phone_icon_path, template_path
+):
+    """Test that a second batch in the same directory leaves the first alone."""
+    pdf_a = run_batch(tmp_path, template_path, phone_icon_path, batch_id="A")
+    db_path = str(tmp_path / "jobs.db")
+    with Database(db_path) as db:
+        records_a = db.get_batch_qrs("A")
+        assert db.get_batch_job("A")["pdf_path"] == pdf_a
+    files_a = [pdf_a] + [path for r in records_a for path in (r[6], r[7])]
+    hashes_a = file_hashes(files_a)
+
+    pdf_b = run_batch(tmp_path, template_path, phone_icon_path, batch_id="B")
+    with Database(db_path) as db:
+        records_b = db.get_batch_qrs("B")
+
+    assert file_hashes(files_a) == hashes_a
+    assert pdf_b != pdf_a
+    assert not set(files_a) & {path for r in records_b for path in (r[6], r[7])}
@@ -0,0 +1,49 @@
+import uuid
+import pytest
+from src.payload import (
+    COMPACT_ID_LENGTH,
+    claim_url,
+    from_compact_id,
+    is_compact_id,
+    resolve_qr_uuid,
+    to_compact_id,
+)
+
+
+def test_compact_id_round_trip():
+    for qr_uuid in [str(uuid.uuid4()) for _ in range(20)] + [
+        "00000000-0000-0000-0000-000000000000",
+        "ffffffff-ffff-ffff-ffff-ffffffffffff",
+    ]:
+        compact_id = to_compact_id(qr_uuid)
+        assert len(compact_id) == COMPACT_ID_LENGTH
+        assert compact_id == compact_id.upper()
+        assert from_compact_id(compact_id) == qr_uuid
+        assert from_compact_id(compact_id.lower()) == qr_uuid
+
+
+def test_resolve_qr_uuid():
+    qr_uuid = str(uuid.uuid4())
+    assert resolve_qr_uuid(qr_uuid) == qr_uuid
+    assert resolve_qr_uuid(to_compact_id(qr_uuid)) == qr_uuid
+    assert resolve_qr_uuid("non-existent-uuid") == "non-existent-uuid"
+
+
+def test_is_compact_id_rejects_out_of_range():
+    assert not is_compact_id("Z" * COMPACT_ID_LENGTH)  # larger than 128 bits
+    assert not is_compact_id("0" * (COMPACT_ID_LENGTH - 1))
+    assert not is_compact_id("-" * COMPACT_ID_LENGTH)
+    with pytest.raises(ValueError):
+        from_compact_id("!" * COMPACT_ID_LENGTH)
+
+
+def test_claim_url():
+    qr_uuid = str(uuid.uuid4())
+    assert claim_url(qr_uuid) == f"www.sticqr.docpulp.com/claim/{qr_uuid}"
+
+    compact_url = claim_url(qr_uuid, "compact")
+    assert compact_url == compact_url.upper()
+    assert compact_url.endswith("/" + to_compact_id(qr_uuid))
+
+    with pytest.raises(ValueError):
+        claim_url(qr_uuid, "short")
@@ -1,4 +1,5 @@
 import os
+import pytest
 from src.pdf_generator import PDFGenerator
 from PIL import Image
 
@@ -19,3 +20,91 @@ def test_create_pdf_from_images(tmpdir):
 
     # Check if PDF is created
     assert os.path.exists(output_path)
+
+
+def test_create_imposed_pdf_embeds_background_once(template_path, tmpdir):
+    from src.sticker_generator import StickerGenerator
+
+    sticker_generator = StickerGenerator(template_path)
+    stickers = [
+        sticker_generator.create_layers(
+            Image.new("RGBA", (700, 700), "black"), (720, 1200), 0.6
+        )
+        for _ in range(5)
+    ]
+    output_path = os.path.join(tmpdir, "imposed.pdf")
+
+    pages = PDFGenerator().create_imposed_pdf(
+        stickers, output_path, backgrounds=sticker_generator.background
+    )
+
+    assert pages == 2
+    with open(output_path, "rb") as f:
+        data = f.read()
+    assert data.startswith(b"%PDF-")
+    assert data.count(b"/Subtype /Image") == 1 + len(stickers)
+    assert data.count(b"/Type /Page ") == 2
+
+    # Every xref entry points at the start of its object
+    xref = int(data.rsplit(b"startxref\n", 1)[1].split()[0])
+    entries = data[xref:].split(b"\n")[3:]
+    for obj_id, entry in enumerate(entries, start=1):
+        if not entry[:1].isdigit():
+            break
+        offset = int(entry.split()[0])
+        assert data[offset:].startswith(f"{obj_id} 0 obj".encode())
+
+
+def test_create_imposed_pdf_from_images(tmpdir):
+    images = [Image.new("RGB", (400, 600), "red") for _ in range(9)]
+    output_path = os.path.join(tmpdir, "imposed.pdf")
+
+    pages = PDFGenerator().create_imposed_pdf(images, output_path, columns=2, rows=2)
+
+    assert pages == 3
+    assert os.path.exists(output_path)
+
+
+def test_create_imposed_pdf_rejects_oversized_grid(tmpdir):
+    images = [Image.new("RGB", (1200, 1200), "red")]
+    output_path = os.path.join(tmpdir, "imposed.pdf")
+
+    with pytest.raises(ValueError):
+        PDFGenerator().create_imposed_pdf(images, output_path, columns=3, rows=3)
+
+
+def test_create_imposed_pdf_vector(template_path, phone_icon_path, tmpdir):
+    from src.qr_code_generator import QRCodeGenerator
+    from src.sticker_generator import StickerGenerator
+
+    qr_generator = QRCodeGenerator(icon_path=phone_icon_path)
+    sticker_generator = StickerGenerator(template_path)
+    stickers = [
+        sticker_generator.create_vector_layers(
+            qr_generator.generate_vector(f"vector-{i}", 700), (720, 1200), 0.6
+        )
+        for i in range(5)
+    ]
+    output_path = os.path.join(tmpdir, "vector.pdf")
+
+    pages = PDFGenerator().create_imposed_pdf(
+        stickers, output_path, backgrounds=sticker_generator.background
+    )
+
+    assert pages == 2
+    with open(output_path, "rb") as f:
+        data = f.read()
+    # Only the template and the icon, however many stickers there are
+    assert data.count(b"/Subtype /Image") == 2
+
+
+def test_create_imposed_pdf_keeps_transparency(tmpdir):
+    images = [Image.new("RGBA", (400, 600), (255, 0, 0, 128))]
+    output_path = os.path.join(tmpdir, "imposed.pdf")
+
+    PDFGenerator().create_imposed_pdf(images, output_path)
+
+    with open(output_path, "rb") as f:
+        data = f.read()
+    assert data.count(b"/Subtype /Image") == 2
+    assert data.count(b"/SMask") == 1
@@ -0,0 +1,141 @@
+import os
+import pytest
+from PIL import Image
+from src.image_transport import ImageRing
+from src.pipeline import PENDING_PER_WORKER, ShippedSticker, StickerPipeline, _ship
+from src.qr_code_generator import QRCodeGenerator
+from src.sticker_generator import StickerGenerator
+
+
+@pytest.fixture
+def pipeline(phone_icon_path, template_path):
+    return StickerPipeline(
+        QRCodeGenerator(icon_path=phone_icon_path),
+        StickerGenerator(template_path),
+        qr_size=300,
+        position=(400, 400),
+        scale_factor=0.25,
+    )
+
+
+def test_render_in_memory(pipeline, tmp_path):
+    rendered = pipeline.render(0, "in-memory")
+
+    assert isinstance(pipeline.compose(rendered), Image.Image)
+    assert rendered.qr_path is None
+    assert rendered.sticker_path is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_render_keeps_intermediates(pipeline, tmp_path):
+    pipeline.qr_folder = str(tmp_path)
+    pipeline.sticker_folder = str(tmp_path)
+    rendered = pipeline.render(3, "on-disk")
+
+    assert rendered.qr_path == os.path.join(str(tmp_path), "carqr_on-disk.png")
+    assert rendered.sticker_path == os.path.join(str(tmp_path), "sticker_3.png")
+    assert os.path.exists(rendered.qr_path)
+    assert os.path.exists(rendered.sticker_path)
+
+
+@pytest.mark.parametrize("executor", ["serial", "threads", "processes", "staged"])
+def test_iter_stickers_preserves_order(pipeline, executor):
+    qr_uuids = [f"order-{i}" for i in range(4)]
+    rendered = list(pipeline.iter_stickers(qr_uuids, executor=executor, max_workers=2))
+
+    assert [r.qr_uuid for r in rendered] == qr_uuids
+    assert [r.index for r in rendered] == list(range(4))
+    expected = pipeline.compose(pipeline.render(2, "order-2"))
+    assert pipeline.compose(rendered[2]).tobytes() == expected.tobytes()
+
+
+def test_iter_stickers_invalid_executor(pipeline):
+    with pytest.raises(ValueError):
+        pipeline.iter_stickers(["a"], executor="gpu")
+
+
+def test_render_vector(pipeline, monkeypatch):
+    pipeline.vector = True
+    monkeypatch.setattr(
+        pipeline.qr_generator,
+        "generate",
+        lambda *args: pytest.fail("vector stickers should not rasterize the QR"),
+    )
+    rendered = pipeline.render(0, "vector")
+
+    assert rendered.layers.patch[2].kind == "modules"
+    assert rendered.qr_path is None
+
+
+def test_iter_stickers_reads_ahead_a_bounded_window(pipeline):
+    drawn = []
+
+    def qr_uuids():
+        for i in range(1000):
+            drawn.append(i)
+            yield f"lazy-{i}"
+
+    stickers = pipeline.iter_stickers(qr_uuids(), executor="threads", max_workers=2)
+    assert next(stickers).qr_uuid == "lazy-0"
+    assert len(drawn) <= 2 * PENDING_PER_WORKER + 1
+    stickers.close()
+
+
+def test_staged_writes_intermediates(pipeline, tmp_path):
+    pipeline.qr_folder = str(tmp_path / "qr")
+    pipeline.sticker_folder = str(tmp_path / "stickers")
+    os.makedirs(pipeline.qr_folder)
+    os.makedirs(pipeline.sticker_folder)
+    qr_uuids = [f"staged-{i}" for i in range(6)]
+    rendered = list(pipeline.iter_stickers(qr_uuids, executor="staged", max_workers=2))
+
+    assert [r.qr_uuid for r in rendered] == qr_uuids
+    assert all(pipeline.files_complete(r.index, r.qr_uuid) for r in rendered)
+    assert set(pipeline.queue_depths()) == {"draw", "save", "output"}
+
+
+def test_draw_then_save(pipeline, tmp_path):
+    pipeline.sticker_folder = str(tmp_path)
+    drawn = pipeline.draw(1, "split")
+
+    assert drawn.write_sticker and not drawn.write_qr
+    assert os.listdir(tmp_path) == []
+    rendered = pipeline.save(drawn)
+    assert os.listdir(tmp_path) == ["sticker_1.png"]
+    assert rendered.layers is drawn.layers
+
+
+def test_shipped_sticker_matches_render(pipeline, tmp_path):
+    pipeline.qr_folder = str(tmp_path)
+    ring = ImageRing(1, pipeline._slot_size())
+    try:
+        shipped = _ship(pipeline.draw(0, "shipped"), ring)
+        assert isinstance(shipped, ShippedSticker)
+        assert shipped.drawn.qr_image is None and shipped.drawn.layers.patch is None
+        rendered = pipeline._save_shipped(ring, shipped)
+    finally:
+        ring.close()
+
+    expected = pipeline.compose(pipeline.render(0, "shipped"))
+    assert pipeline.compose(rendered).tobytes() == expected.tobytes()
+    assert os.path.exists(rendered.qr_path)
+
+
+def test_webp_intermediates_are_reused(phone_icon_path, template_path, tmp_path):
+    pipeline = StickerPipeline(
+        QRCodeGenerator(icon_path=phone_icon_path, encode_profile="webp"),
+        StickerGenerator(template_path, encode_profile="webp"),
+        qr_size=300,
+        position=(400, 400),
+        scale_factor=0.25,
+        qr_folder=str(tmp_path),
+        sticker_folder=str(tmp_path),
+        reuse_files=True,
+    )
+    rendered = pipeline.render(2, "webp")
+
+    assert rendered.qr_path.endswith(".webp")
+    assert rendered.sticker_path == os.path.join(str(tmp_path), "sticker_2.webp")
+    assert pipeline.files_complete(2, "webp")
+    drawn = pipeline.draw(2, "webp")
+    assert not (drawn.write_qr or drawn.write_sticker)
@@ -1,7 +1,10 @@
+import concurrent.futures
 import os
+import pickle
 import pytest
 import qrcode
 from PIL import Image
+from src.payload import claim_url
 from src.qr_code_generator import QRCodeGenerator, _create_rounded_qr
 
 
@@ -174,3 +177,146 @@ def test_generate_batch(tmpdir):
         assert os.path.exists(image_path)
         assert os.path.basename(image_path).startswith("carqr_")
         assert os.path.basename(image_path).endswith(".png")
+
+
+@pytest.mark.parametrize("executor", ["serial", "threads", "processes"])
+def test_generate_batch_preserves_order(tmpdir, executor):
+    generator = QRCodeGenerator()
+    qr_uuids = [f"order-{i}" for i in range(6)]
+    image_paths = generator.generate_batch(
+        len(qr_uuids),
+        120,
+        str(tmpdir),
+        qr_uuids=qr_uuids,
+        executor=executor,
+        max_workers=2,
+        chunksize=2,
+    )
+
+    expected = [os.path.join(str(tmpdir), f"carqr_{q}.png") for q in qr_uuids]
+    assert image_paths == expected
+    for image_path in image_paths:
+        assert os.path.exists(image_path)
+
+
+def test_generate_batch_ships_the_generator_once(tmpdir, phone_icon_path, monkeypatch):
+    """Process workers get the generator from the pool initializer, the
+    tasks only carry their UUID"""
+    tasks = []
+
+    class RecordingPool(concurrent.futures.ThreadPoolExecutor):
+        def __init__(self, max_workers=None, initializer=None, initargs=()):
+            super().__init__(max_workers, initializer=initializer, initargs=initargs)
+            self.initargs = initargs
+
+        def map(self, fn, *iterables, **kwargs):
+            tasks.append((self.initargs, pickle.dumps(fn)))
+            return super().map(fn, *iterables, **kwargs)
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", RecordingPool)
+    generator = QRCodeGenerator(icon_path=phone_icon_path)
+    image_paths = generator.generate_batch(
+        3, 120, str(tmpdir), executor="processes", max_workers=2
+    )
+
+    assert all(os.path.exists(path) for path in image_paths)
+    [(initargs, task)] = tasks
+    assert initargs == (generator,)
+    assert len(task) < 500
+
+
+def test_generate_batch_invalid_executor(tmpdir):
+    generator = QRCodeGenerator()
+    with pytest.raises(ValueError):
+        generator.generate_batch(1, 120, str(tmpdir), executor="gpu")
+
+
+def test_render_plan_is_cached(phone_icon_path):
+    generator = QRCodeGenerator(icon_path=phone_icon_path)
+    plan = generator._get_render_plan(300)
+
+    assert plan is generator._get_render_plan(300)
+    assert plan is not generator._get_render_plan(400)
+
+    # Changing the style invalidates the cached overlays
+    generator.config["frame_color"] = (200, 0, 0, 255)
+    assert plan is not generator._get_render_plan(300)
+
+
+def test_render_plan_matches_across_calls(phone_icon_path):
+    generator = QRCodeGenerator(icon_path=phone_icon_path)
+    first = generator.generate("same-id", size=300)
+    second = generator.generate("same-id", size=300)
+
+    assert first.tobytes() == second.tobytes()
+
+
+@pytest.mark.parametrize("size", [120, 300, 333, 700])
+@pytest.mark.parametrize("with_icon", [False, True])
+def test_matrix_renderer_matches_pil(phone_icon_path, size, with_icon):
+    icon_path = phone_icon_path if with_icon else None
+    pil_generator = QRCodeGenerator(icon_path=icon_path, renderer="pil")
+    matrix_generator = QRCodeGenerator(icon_path=icon_path, renderer="matrix")
+
+    expected = pil_generator.generate("pixel-identical", size=size)
+    actual = matrix_generator.generate("pixel-identical", size=size)
+
+    assert actual.mode == expected.mode
+    assert actual.size == expected.size
+    assert actual.tobytes() == expected.tobytes()
+
+
+def test_invalid_renderer():
+    with pytest.raises(ValueError):
+        QRCodeGenerator(renderer="svg")
+
+
+def test_template_encoder_matches_qrcode_encoder(phone_icon_path):
+    template = QRCodeGenerator(icon_path=phone_icon_path, encoder="template")
+    library = QRCodeGenerator(icon_path=phone_icon_path, encoder="qrcode")
+
+    expected = library.generate("same-encoding", size=300)
+    assert template.generate("same-encoding", size=300).tobytes() == expected.tobytes()
+
+
+def test_invalid_encoder():
+    with pytest.raises(ValueError):
+        QRCodeGenerator(encoder="zxing")
+
+
+def test_compact_payload_uses_smaller_version():
+    qr_id = "3f1c2a5e-7d4b-4c1a-9b8e-1234567890ab"
+    legacy = QRCodeGenerator(payload="legacy")
+    compact = QRCodeGenerator(payload="compact")
+
+    legacy_matrix = legacy._encode(claim_url(qr_id, "legacy"))
+    compact_matrix = compact._encode(claim_url(qr_id, "compact"))
+    assert len(compact_matrix) < len(legacy_matrix)
+
+    qr_image = compact.generate(qr_id, size=300)
+    assert qr_image.size == legacy.generate(qr_id, size=300).size
+
+
+def test_invalid_payload():
+    with pytest.raises(ValueError):
+        QRCodeGenerator(payload="tiny")
+
+
+def test_generate_vector_matches_raster_layout(phone_icon_path):
+    generator = QRCodeGenerator(icon_path=phone_icon_path)
+    vector_qr = generator.generate_vector("vector", 300)
+
+    assert vector_qr.size == generator.generate("vector", 300).size
+    kinds = [shape.kind for shape in vector_qr.shapes]
+    assert kinds == ["rect", "rect", "modules", "rect", "rect", "rect", "image"]
+    modules = vector_qr.shapes[2]
+    assert (modules.fill == generator._encode(claim_url("vector"))).all()
+    assert vector_qr.shapes[-1].fill == phone_icon_path
+
+
+def test_generate_vector_without_icon_or_border():
+    generator = QRCodeGenerator(style_config={"border_width": 0})
+    vector_qr = generator.generate_vector("vector", 300)
+
+    assert vector_qr.size == (300, 300)
+    assert [shape.kind for shape in vector_qr.shapes] == ["rect", "modules"]
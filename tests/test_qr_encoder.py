@@ -0,0 +1,68 @@
+import uuid
+import numpy as np
+import pytest
+import qrcode
+from qrcode import util
+from src.qr_encoder import TemplateEncoder, lost_points
+
+
+def reference_matrix(data):
+    qr = qrcode.QRCode(
+        version=1, error_correction=qrcode.constants.ERROR_CORRECT_M, border=2
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return np.array(qr.get_matrix(), dtype=bool)
+
+
+def test_claim_urls_match_qrcode():
+    encoder = TemplateEncoder()
+    shapes = set()
+    for _ in range(25):
+        data = f"www.sticqr.docpulp.com/claim/{uuid.uuid4()}"
+        assert np.array_equal(encoder.encode(data), reference_matrix(data))
+        chunks = util.optimal_data_chunks(data, minimum=20)
+        shapes.add(tuple((chunk.mode, len(chunk)) for chunk in chunks))
+
+    # One template per payload shape, almost always a single one for claim URLs
+    assert len(encoder._templates) == len(shapes)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        "test123",
+        "HELLO WORLD 0123456789",
+        "12345678901234567890123456789",
+        "mixed 12345678901234567890 CASE payload " * 8,  # version >= 7
+    ],
+)
+def test_other_payload_shapes_match_qrcode(data):
+    encoder = TemplateEncoder()
+    assert np.array_equal(encoder.encode(data), reference_matrix(data))
+
+
+def test_template_cache_is_bounded():
+    encoder = TemplateEncoder(cache_size=2)
+    payloads = ["test123", "HELLO WORLD 0123456789", "a" * 40, "test123"]
+    for data in payloads:
+        assert np.array_equal(encoder.encode(data), reference_matrix(data))
+
+    # The least recently used shape was dropped
+    shapes = [
+        tuple(
+            (chunk.mode, len(chunk))
+            for chunk in util.optimal_data_chunks(data, minimum=20)
+        )
+        for data in ("a" * 40, "test123")
+    ]
+    assert list(encoder._templates) == shapes
+
+
+def test_lost_points_matches_qrcode():
+    qr = qrcode.QRCode()
+    qr.add_data(f"www.sticqr.docpulp.com/claim/{uuid.uuid4()}")
+    qr.make()
+
+    modules = np.array(qr.modules, dtype=bool)
+    assert lost_points(modules[None])[0] == util.lost_point(qr.modules)
@@ -0,0 +1,61 @@
+from src.redirect_cache import MISSING, RedirectCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_put_and_counters():
+    cache = RedirectCache(maxsize=10)
+    assert cache.get("a") is MISSING
+    cache.put("a", "url-a", cache.generation)
+    cache.put("missing", None, cache.generation)
+
+    assert cache.get("a") == "url-a"
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 2, "maxsize": 10}
+
+
+def test_least_recently_used_is_evicted():
+    cache = RedirectCache(maxsize=2)
+    cache.put("a", "url-a", cache.generation)
+    cache.put("b", "url-b", cache.generation)
+    cache.get("a")
+    cache.put("c", "url-c", cache.generation)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == "url-a"
+    assert cache.get("c") == "url-c"
+    assert len(cache) == 2
+
+
+def test_entries_expire():
+    clock = FakeClock()
+    cache = RedirectCache(ttl=5, clock=clock)
+    cache.put("a", "url-a", cache.generation)
+
+    clock.now = 4.9
+    assert cache.get("a") == "url-a"
+    clock.now = 5.0
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+
+
+def test_invalidate_drops_entry_and_stale_puts():
+    cache = RedirectCache()
+    cache.put("a", "url-a", cache.generation)
+    generation = cache.generation
+
+    cache.invalidate("a")
+    assert cache.get("a") is MISSING
+    # A lookup that started before the invalidation must not be stored
+    cache.put("a", "stale", generation)
+    assert cache.get("a") is MISSING
+
+    cache.put("a", "fresh", cache.generation)
+    cache.clear()
+    assert cache.get("a") is MISSING
@@ -0,0 +1,171 @@
+import struct
+import uuid
+
+import pytest
+from src.database import Database
+from src.payload import to_compact_id
+from src.redirect_snapshot import RedirectSnapshot, append_delta, main, write_snapshot
+from src.sharded_database import ShardedDatabase
+
+
+@pytest.fixture(params=["text", "blob"])
+def db(request, tmp_path):
+    with Database(str(tmp_path / "redirects.db"), uuid_format=request.param) as db:
+        yield db
+
+
+def _populate(db, count):
+    qr_uuids = [str(uuid.uuid4()) for _ in range(count)]
+    db.create_qr_records({"qr_uuid": qr_uuid} for qr_uuid in qr_uuids)
+    return qr_uuids
+
+
+def test_snapshot_answers_like_the_database(db, tmp_path):
+    qr_uuids = _populate(db, 300)
+    for qr_uuid in qr_uuids[::7]:
+        db.claim_qr(qr_uuid, "1234567890", "XXXXXX7890")
+    custom = qr_uuids[1]
+    db.claim_qr(custom, "1234567890", "XXXXXX7890")
+    with db._connection() as conn:
+        conn.execute(
+            "UPDATE qr_codes SET redirect_url = ? WHERE qr_uuid = ?",
+            ("https://example.com/ünïcode", db._key(custom)),
+        )
+    db.create_qr_record(qr_uuid="custom-id")
+    path = str(tmp_path / "redirects.snap")
+
+    assert write_snapshot(db, path) == (300, 1)
+    with RedirectSnapshot(path) as snapshot:
+        assert len(snapshot) == 300
+        for qr_uuid in qr_uuids + [str(uuid.uuid4())]:
+            assert snapshot.get_redirect_url(qr_uuid) == db.get_redirect_url(qr_uuid)
+        assert snapshot.get_redirect_url(custom) == "https://example.com/ünïcode"
+        assert snapshot.get_redirect_url(
+            to_compact_id(qr_uuids[0])
+        ) == db.get_redirect_url(qr_uuids[0])
+        assert snapshot.get_redirect_url("custom-id") is None
+
+
+def test_empty_snapshot(db, tmp_path):
+    path = str(tmp_path / "redirects.snap")
+    assert write_snapshot(db, path) == (0, 0)
+    with RedirectSnapshot(path) as snapshot:
+        assert snapshot.get_redirect_url(str(uuid.uuid4())) is None
+
+
+def test_delta_applies_new_codes_and_claims(db, tmp_path):
+    qr_uuids = _populate(db, 50)
+    path, delta_path = str(tmp_path / "redirects.snap"), str(tmp_path / "delta")
+    write_snapshot(db, path, delta_path)
+
+    with RedirectSnapshot(path, delta_path) as snapshot:
+        db.claim_qr(qr_uuids[3], "1234567890", "XXXXXX7890")
+        new_uuid = _populate(db, 1)[0]
+        assert snapshot.get_redirect_url(new_uuid) is None
+
+        assert append_delta(db, delta_path) == 2
+        assert snapshot.refresh() == 2
+        for qr_uuid in (qr_uuids[3], qr_uuids[4], new_uuid):
+            assert snapshot.get_redirect_url(qr_uuid) == db.get_redirect_url(qr_uuid)
+
+        assert append_delta(db, delta_path) == 0
+        assert snapshot.refresh() == 0
+        assert snapshot.watermarks == db.redirect_watermarks()
+
+    # A fresh reader replays the whole delta
+    with RedirectSnapshot(path, delta_path) as snapshot:
+        assert snapshot.get_redirect_url(new_uuid) == db.get_redirect_url(new_uuid)
+
+
+def test_incomplete_delta_group_is_ignored_and_rewritten(db, tmp_path):
+    qr_uuids = _populate(db, 10)
+    path, delta_path = str(tmp_path / "redirects.snap"), str(tmp_path / "delta")
+    write_snapshot(db, path, delta_path)
+    db.claim_qr(qr_uuids[0], "1234567890", "XXXXXX7890")
+    with open(delta_path, "a") as f:
+        f.write(f"{qr_uuids[0]}\tinterrupted\n#\t1")
+
+    with RedirectSnapshot(path, delta_path) as snapshot:
+        assert snapshot.refresh() == 0
+        assert append_delta(db, delta_path) == 1
+        assert snapshot.refresh() == 1
+        assert snapshot.get_redirect_url(qr_uuids[0]) == db.get_redirect_url(
+            qr_uuids[0]
+        )
+
+
+@pytest.mark.parametrize("uuid_format", ["text", "blob"])
+def test_sharded_snapshot_and_delta(tmp_path, uuid_format):
+    db_path = str(tmp_path / "sharded.db")
+    with ShardedDatabase(db_path, shards=3, uuid_format=uuid_format) as db:
+        qr_uuids = _populate(db, 60)
+        db.create_qr_record(qr_uuid="custom-id")
+        path, delta_path = str(tmp_path / "redirects.snap"), str(tmp_path / "delta")
+        assert write_snapshot(db, path, delta_path) == (60, 1)
+
+        db.claim_qr(qr_uuids[0], "1234567890", "XXXXXX7890")
+        new_uuids = _populate(db, 5)
+        assert append_delta(db, delta_path) == 6
+        with RedirectSnapshot(path, delta_path) as snapshot:
+            assert snapshot.watermarks == db.redirect_watermarks()
+            assert len(snapshot.watermarks) == 6
+            for qr_uuid in qr_uuids + new_uuids:
+                assert snapshot.get_redirect_url(qr_uuid) == db.get_redirect_url(
+                    qr_uuid
+                )
+
+    main([db_path, "--shards", "3", "--append", "--delta", delta_path])
+    with RedirectSnapshot(path, delta_path) as snapshot:
+        assert snapshot.refresh() == 0
+
+
+def test_reads_version_1_snapshots(db, tmp_path):
+    qr_uuids = _populate(db, 10)
+    path = tmp_path / "redirects.snap"
+    write_snapshot(db, str(path))
+    # Version 1 kept the watermark pair in the header and nothing after the URLs
+    data = bytearray(path.read_bytes()[:-16])
+    struct.pack_into("<H", data, 4, 1)
+    struct.pack_into("<QQ", data, 16, *db.redirect_watermarks())
+    path.write_bytes(data)
+
+    with RedirectSnapshot(str(path)) as snapshot:
+        assert snapshot.watermarks == db.redirect_watermarks()
+        assert snapshot.get_redirect_url(qr_uuids[0]) == db.get_redirect_url(
+            qr_uuids[0]
+        )
+
+
+def test_rejects_foreign_files(db, tmp_path):
+    path = tmp_path / "redirects.snap"
+    path.write_bytes(b"not a snapshot, honestly, not at all, nope")
+    with pytest.raises(ValueError):
+        RedirectSnapshot(str(path))
+
+    write_snapshot(db, str(path))
+    _populate(db, 1)
+    other_delta = str(tmp_path / "other.delta")
+    write_snapshot(db, str(tmp_path / "other.snap"), other_delta)
+    with pytest.raises(ValueError):
+        RedirectSnapshot(str(path), other_delta)
+
+
+def test_truncated_watermarks_are_rejected(db, tmp_path):
+    path = tmp_path / "redirects.snap"
+    write_snapshot(db, str(path))
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        RedirectSnapshot(str(path))
+
+
+def test_snapshot_command(db, tmp_path, capsys):
+    _populate(db, 5)
+    path, delta_path = str(tmp_path / "redirects.snap"), str(tmp_path / "delta")
+    main([db.db_path, path, "--delta", delta_path])
+    _populate(db, 2)
+    main([db.db_path, "--append", "--delta", delta_path])
+
+    output = capsys.readouterr().out
+    assert "5 codes" in output and "appended 2 changes" in output
+    with RedirectSnapshot(path, delta_path) as snapshot:
+        assert snapshot.watermarks == db.redirect_watermarks()
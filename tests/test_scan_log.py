@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+from src.scan_log import ScanLog
+
+
+class Writer:
+    def __init__(self):
+        self.batches = []
+        self.written = threading.Event()
+        self.fail = False
+
+    def __call__(self, events):
+        if self.fail:
+            raise RuntimeError("database is locked")
+        self.batches.append(list(events))
+        self.written.set()
+
+
+def test_flushes_when_flush_size_is_reached():
+    writer = Writer()
+    scan_log = ScanLog(writer, flush_size=3, flush_interval=60)
+    for i in range(3):
+        scan_log.record(f"uuid-{i}", "unclaimed", scanned_at=i)
+
+    assert writer.written.wait(5)
+    assert writer.batches == [[(f"uuid-{i}", "unclaimed", i) for i in range(3)]]
+    scan_log.close()
+    assert scan_log.stats() == {
+        "depth": 0,
+        "recorded": 3,
+        "flushed": 3,
+        "dropped": 0,
+        "flushes": 1,
+        "failed_flushes": 0,
+    }
+
+
+def test_flushes_after_flush_interval():
+    writer = Writer()
+    scan_log = ScanLog(writer, flush_size=100, flush_interval=0.05)
+    scan_log.record("uuid", "claimed")
+
+    assert writer.written.wait(5)
+    assert [event[:2] for event in writer.batches[0]] == [("uuid", "claimed")]
+    scan_log.close()
+
+
+def test_drops_events_when_the_buffer_is_full():
+    writer = Writer()
+    scan_log = ScanLog(writer, flush_size=100, flush_interval=60, max_buffer=2)
+    results = [scan_log.record(f"uuid-{i}", "unknown") for i in range(5)]
+
+    assert results == [True, True, False, False, False]
+    assert len(scan_log) == 2
+    assert scan_log.stats()["dropped"] == 3
+    scan_log.close()
+    assert len(writer.batches[0]) == 2
+
+
+def test_failed_flush_keeps_the_events():
+    writer = Writer()
+    writer.fail = True
+    scan_log = ScanLog(writer, flush_size=100, flush_interval=60)
+    scan_log.record("uuid-0", "unclaimed")
+    scan_log.record("uuid-1", "unclaimed")
+
+    with pytest.raises(RuntimeError):
+        scan_log.flush()
+    assert len(scan_log) == 2
+    assert scan_log.failed_flushes == 1
+
+    writer.fail = False
+    assert scan_log.flush() == 2
+    assert [event[0] for event in writer.batches[0]] == ["uuid-0", "uuid-1"]
+    scan_log.close()
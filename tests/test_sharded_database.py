@@ -0,0 +1,122 @@
+import io
+import os
+import uuid
+
+import pytest
+from src.payload import to_compact_id
+from src.sharded_database import ShardedDatabase, shard_paths
+
+
+@pytest.fixture
+def sharded_db(tmp_path):
+    with ShardedDatabase(str(tmp_path / "car_qr.db"), shards=4) as db:
+        yield db
+
+
+def test_shard_files(sharded_db, tmp_path):
+    paths = shard_paths(str(tmp_path / "car_qr.db"), 4)
+    assert os.path.basename(paths[3]) == "car_qr.shard03of04.db"
+    assert all(os.path.exists(path) for path in paths)
+    assert sharded_db.schema_version() > 0
+
+
+def test_records_are_routed_by_uuid(sharded_db):
+    qr_uuids = [sharded_db.create_qr_record(batch_id="spread") for _ in range(40)]
+
+    for qr_uuid in qr_uuids:
+        shard = sharded_db.shard_for(qr_uuid)
+        assert shard.get_qr_details(qr_uuid)[1] == qr_uuid
+        assert sharded_db.shard_for(to_compact_id(qr_uuid)) is shard
+    assert all(shard.get_batch_qrs("spread") for shard in sharded_db.shards)
+
+
+def test_claim_and_redirect(sharded_db):
+    qr_uuid = sharded_db.create_qr_record()
+    assert sharded_db.get_redirect_url(qr_uuid) == (
+        f"www.sticqr.docpulp.com/claim/{qr_uuid}"
+    )
+
+    assert sharded_db.claim_qr(qr_uuid, "1234567890", "9876543210")[0] is True
+    assert sharded_db.claim_qr(qr_uuid, "1111111111", "2222222222")[0] is False
+    assert sharded_db.get_redirect_url(to_compact_id(qr_uuid)) == (
+        f"www.sticqr.docpulp.com/contact/{qr_uuid}"
+    )
+    assert sharded_db.get_claim(qr_uuid) == ("1234567890", "9876543210")
+
+
+def test_batches_fan_out(sharded_db):
+    batch_id = str(uuid.uuid4())
+    existing = sharded_db.create_qr_record(batch_id=batch_id)
+    qr_uuids = [str(uuid.uuid4()) for _ in range(20)]
+    rows = ({"qr_uuid": qr_uuid, "batch_id": batch_id} for qr_uuid in qr_uuids)
+
+    inserted, collisions = sharded_db.create_qr_records(
+        list(rows) + [{"qr_uuid": existing}], chunk_size=7
+    )
+
+    assert inserted == 20
+    assert collisions == [existing]
+    expected = sorted(qr_uuids + [existing])
+    assert sorted(row[1] for row in sharded_db.get_batch_qrs(batch_id)) == expected
+    streamed = sharded_db.iter_batch_qrs(batch_id, columns=["qr_uuid"], page_size=2)
+    assert sorted(row[0] for row in streamed) == expected
+
+    output = io.StringIO()
+    assert sharded_db.export_batch(batch_id, output, "jsonl") == 21
+
+
+def test_batch_scan_counts(sharded_db):
+    qr_uuids = [sharded_db.create_qr_record(batch_id="spread") for _ in range(20)]
+    sharded_db.enable_scan_log(flush_size=1000, flush_interval=60)
+    for qr_uuid in qr_uuids + qr_uuids[:5]:
+        sharded_db.get_redirect_url(qr_uuid)
+    for shard in sharded_db.shards:
+        shard.scan_log.flush()
+
+    assert sharded_db.batch_scan_counts() == [("spread", 25, 20)]
+
+
+def test_batch_jobs(sharded_db):
+    sharded_db.create_batch_job("job", {"count": 3}, "/tmp/job.pdf")
+    with pytest.raises(ValueError):
+        sharded_db.create_batch_job("job", {})
+    qr_uuids = [str(uuid.uuid4()) for _ in range(3)]
+    sharded_db.add_batch_job_items("job", enumerate(qr_uuids))
+    sharded_db.mark_batch_job_items_stored("job", [0, 2])
+
+    items = list(sharded_db.iter_batch_job_items("job", page_size=2))
+    assert items == [(i, qr_uuid, i != 1) for i, qr_uuid in enumerate(qr_uuids)]
+    sharded_db.finish_batch_job("job", "/tmp/job.pdf")
+    job = sharded_db.get_batch_job("job")
+    assert (job["status"], job["items"], job["stored"]) == ("done", 3, 2)
+    assert job["options"] == {"count": 3}
+
+
+def test_redirects_merge_in_key_order(sharded_db):
+    qr_uuids = [sharded_db.create_qr_record() for _ in range(30)]
+    sharded_db.claim_qr(qr_uuids[0], "1234567890", "9876543210")
+
+    rows = list(sharded_db.iter_redirects(page_size=4))
+    assert [row[0] for row in rows] == sorted(qr_uuids)
+    assert dict((row[0], row[1]) for row in rows)[qr_uuids[0]]
+    watermarks = sharded_db.redirect_watermarks()
+    assert len(watermarks) == 2 * len(sharded_db.shards)
+    new_uuid = sharded_db.create_qr_record()
+    sharded_db.claim_qr(qr_uuids[1], "1234567890", "9876543210")
+    watermarks, changes = sharded_db.redirect_changes(*watermarks)
+    assert sorted(row[0] for row in changes) == sorted([new_uuid, qr_uuids[1]])
+    assert sharded_db.redirect_changes(*watermarks) == (watermarks, [])
+    with pytest.raises(ValueError):
+        sharded_db.redirect_changes(0, 0)
+
+
+def test_migrate_and_query_plans(sharded_db):
+    qr_uuid = sharded_db.create_qr_record()
+    assert sharded_db.migrate() == sharded_db.schema_version()
+    assert "USING COVERING INDEX idx_qr_codes_redirect" in " ".join(
+        sharded_db.query_plans()["redirect"]
+    )
+
+    sharded_db.convert_uuid_format("blob")
+    assert {shard.uuid_format for shard in sharded_db.shards} == {"blob"}
+    assert sharded_db.get_qr_details(qr_uuid)[1] == qr_uuid
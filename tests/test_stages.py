@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+from src.stages import Stage, StagedExecutor
+
+
+def double(x):
+    return x * 2
+
+
+def test_map_keeps_the_input_order():
+    executor = StagedExecutor(
+        [
+            Stage("double", double, 2, "processes"),
+            # Later items finish first in the second stage
+            Stage("slow", lambda x: time.sleep(0.01 * (x % 3)) or x + 1, 3, "threads"),
+        ],
+        queue_size=2,
+    )
+
+    assert list(executor.map(range(20))) == [x * 2 + 1 for x in range(20)]
+    stats = executor.stats()
+    assert [stats[name]["processed"] for name in ("double", "slow")] == [20, 20]
+    assert executor.queue_depths() == {"double": 0, "slow": 0, "output": 0}
+
+
+def test_slow_stage_throttles_the_input():
+    release = threading.Event()
+    fed = []
+
+    def items():
+        for i in range(100):
+            fed.append(i)
+            yield i
+
+    def wait(x):
+        release.wait()
+        return x
+
+    executor = StagedExecutor(
+        [Stage("fast", double, 2, "threads"), Stage("disk", wait, 1, "threads")],
+        queue_size=3,
+    )
+    results = executor.map(items())
+    consumer = threading.Thread(target=lambda: fed.append(list(results)))
+    consumer.start()
+    time.sleep(0.5)
+
+    # Three queues of 3 items and one busy worker per stage at most
+    in_flight = len(fed)
+    assert in_flight <= executor.window
+    assert executor.queue_depths()["disk"] == 3
+    release.set()
+    consumer.join(10)
+    assert fed[-1] == [x * 2 for x in range(100)]
+    stats = executor.stats()
+    assert stats["fast"]["max_depth"] <= 3 and stats["disk"]["max_depth"] <= 3
+
+
+def test_slow_caller_throttles_the_stages():
+    fed = []
+
+    def items():
+        for i in range(100):
+            fed.append(i)
+            yield i
+
+    executor = StagedExecutor([Stage("double", double, 2, "threads")], queue_size=2)
+    results = executor.map(items())
+    assert next(results) == 0
+    time.sleep(0.3)
+
+    assert len(fed) <= executor.window + 1
+    results.close()
+
+
+def test_stage_error_reaches_the_caller():
+    def fail_on_3(x):
+        if x == 3:
+            raise RuntimeError("disk full")
+        return x
+
+    executor = StagedExecutor([Stage("save", fail_on_3, 2, "threads")])
+    results = executor.map(range(10))
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(RuntimeError, match="disk full"):
+        next(results)
+
+
+def test_unknown_stage_executor():
+    with pytest.raises(ValueError):
+        StagedExecutor([Stage("draw", double, 1, "asyncio")])
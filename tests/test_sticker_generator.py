@@ -1,7 +1,8 @@
 import os
 import pytest
-from PIL import Image
-from src.sticker_generator import StickerGenerator
+from PIL import Image, ImageChops
+from src.qr_code_generator import QRCodeGenerator
+from src.sticker_generator import CACHED_STICKER_TOLERANCE, StickerGenerator
 
 
 def test_sticker_generator_init(template_path):
@@ -59,3 +60,57 @@ def test_sticker_generator_rgb_conversion(
 
     assert isinstance(result, Image.Image)
     assert os.path.exists(output_path)
+
+
+@pytest.mark.parametrize("scale_factor", [None, 0.6, 0.5, 1.3])
+@pytest.mark.parametrize("position", [(720, 1200), (50, 50)])
+def test_cached_background_matches_full_template(
+    template_path, phone_icon_path, scale_factor, position
+):
+    qr_image = QRCodeGenerator(icon_path=phone_icon_path).generate("cached", 400)
+    cached = StickerGenerator(template_path)
+    full = StickerGenerator(template_path, cache_backgrounds=False)
+
+    expected = full.create_sticker(qr_image, position, scale_factor=scale_factor)
+    actual = cached.create_sticker(qr_image, position, scale_factor=scale_factor)
+
+    assert actual.size == expected.size
+    assert actual.mode == expected.mode
+    difference = ImageChops.difference(actual, expected)
+    assert max(high for _, high in difference.getextrema()) <= CACHED_STICKER_TOLERANCE
+
+
+def test_background_is_cached(template_path, sample_qr_image):
+    generator = StickerGenerator(template_path)
+    generator.create_sticker(sample_qr_image, (720, 1200), scale_factor=0.6)
+    generator.create_sticker(sample_qr_image, (720, 1200), scale_factor=0.6)
+    assert len(generator._backgrounds) == 1
+
+    generator.create_sticker(sample_qr_image, (720, 1200), scale_factor=0.5)
+    assert len(generator._backgrounds) == 2
+
+
+def test_qr_outside_template(template_path, sample_qr_image):
+    generator = StickerGenerator(template_path)
+    result = generator.create_sticker(sample_qr_image, (5000, 5000), scale_factor=0.5)
+    expected = StickerGenerator(template_path, cache_backgrounds=False).create_sticker(
+        sample_qr_image, (5000, 5000), scale_factor=0.5
+    )
+    assert result.tobytes() == expected.tobytes()
+
+
+def test_create_vector_layers(template_path, phone_icon_path):
+    generator = StickerGenerator(template_path)
+    vector_qr = QRCodeGenerator(icon_path=phone_icon_path).generate_vector("v", 400)
+    layers = generator.create_vector_layers(vector_qr, (720, 1200), 0.5)
+
+    raster = generator.create_layers(
+        Image.new("RGBA", vector_qr.size), (720, 1200), 0.5
+    )
+    assert layers.background_key == raster.background_key
+    assert layers.box == (257.5, 497.5, 462.5, 702.5)
+    assert layers.patch[0].box == layers.box
+    assert len(layers.patch) == len(vector_qr.shapes)
+
+    with pytest.raises(ValueError):
+        generator.create_vector_layers(vector_qr, (5000, 5000), 0.5)